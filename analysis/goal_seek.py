@@ -0,0 +1,193 @@
+""" This module solves for the value of a single input which makes a function of the model reach a target value, all else
+    being equal. The input is kept within its [min, max] range. Once a sign change has been bracketed, the root is found
+    with Newton steps safeguarded by bisection, using the derivative from the forward-mode differentiation, or with
+    Brent's method when no derivative is available."""
+import numpy as np
+
+from ceteris_paribus.analysis.jacobian import compute_jacobian
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+
+# The available root finding methods
+NEWTON = 'newton'  # Newton steps which fall back to bisection whenever a step leaves the bracket
+BRENT = 'brent'  # Brent's method, combining bisection, the secant method and inverse quadratic interpolation
+BISECTION = 'bisection'
+
+ROOT_FINDING_METHODS = (NEWTON, BRENT, BISECTION)
+
+
+class GoalSeekResult(object):
+    """ The outcome of a goal seek. If no solution was found, the value is the one which came closest to the target."""
+
+    def __init__(self, input_key, target_key, target_value, value, achieved, converged, iterations, method):
+        self.input_key = input_key
+        self.target_key = target_key
+        self.target_value = target_value
+        # The value of the input and the value of the target function it results in
+        self.value = value
+        self.achieved = achieved
+        self.converged = converged
+        self.iterations = iterations
+        self.method = method
+
+    def get_error(self):
+        return self.achieved - self.target_value
+
+
+class _Objective(object):
+    # The difference between a function of the model and its target value, as a function of a single input
+
+    def __init__(self, compiled, input_key, target_key, target_value):
+        self.compiled = compiled
+        self.input_key = input_key
+        self.target_key = target_key
+        self.target_value = target_value
+        self.evaluations = 0
+
+    def __call__(self, value):
+        """ Returns the difference at the given value of the input, together with its derivative if it exists."""
+        self.evaluations += 1
+        jacobian = compute_jacobian(self.compiled, [self.input_key], [self.target_key], {self.input_key: value})
+        if self.target_key in jacobian.output_values:
+            difference = jacobian.output_values[self.target_key] - self.target_value
+            return difference, jacobian.get_derivative(self.target_key, self.input_key)
+        # The function could not be differentiated, so it is evaluated without its derivative
+        results = evaluate_batch(self.compiled, {self.input_key: value}, [self.target_key])
+        if self.target_key not in results:
+            raise ValueError("The function " + str(self.target_key) + " cannot be evaluated")
+        return float(results[self.target_key]) - self.target_value, None
+
+    def scan(self, minimum, maximum, points):
+        """ Evaluates the difference on an even grid over the range of the input as a single batch."""
+        samples = np.linspace(minimum, maximum, points)
+        results = evaluate_batch(self.compiled, {self.input_key: samples}, [self.target_key])
+        self.evaluations += points
+        if self.target_key not in results:
+            raise ValueError("The function " + str(self.target_key) + " cannot be evaluated")
+        return samples, results[self.target_key] - self.target_value
+
+
+def find_bracket(objective, minimum, maximum, points=64):
+    """
+    Finds an interval within [minimum, maximum] on which the objective changes sign.
+    :return: the bounds of the interval and the differences at the bounds, or None together with the sample which
+        came closest to the target if the objective does not change sign on the grid
+    """
+    samples, differences = objective.scan(minimum, maximum, points)
+    signs = np.sign(differences)
+    exact = np.flatnonzero(signs == 0)
+    if len(exact):
+        index = exact[0]
+        return (samples[index], samples[index], 0.0, 0.0), None
+    changes = np.flatnonzero(signs[:-1] != signs[1:])
+    if len(changes):
+        index = changes[0]
+        return (samples[index], samples[index + 1], differences[index], differences[index + 1]), None
+    closest = int(np.argmin(np.abs(differences)))
+    return None, (samples[closest], differences[closest])
+
+
+def _solve_newton(objective, a, b, fa, fb, tolerance, max_iterations, use_derivative=True):
+    # Keeps a bracket [a, b] around the root at all times. A Newton step is taken from the best point when it lands
+    # inside the bracket, and the bracket is bisected otherwise.
+    x = (a + b) / 2
+    for iteration in range(1, max_iterations + 1):
+        fx, derivative = objective(x)
+        if abs(fx) <= tolerance or abs(b - a) <= 1e-15 * max(1.0, abs(x)):
+            return x, fx, True, iteration
+        if np.sign(fx) == np.sign(fa):
+            a, fa = x, fx
+        else:
+            b, fb = x, fx
+        step = None
+        if use_derivative and derivative:
+            step = x - fx / derivative
+        if step is None or not min(a, b) < step < max(a, b):
+            step = (a + b) / 2
+        x = step
+    fx, derivative = objective(x)
+    return x, fx, abs(fx) <= tolerance, max_iterations
+
+
+def _solve_brent(objective, a, b, fa, fb, tolerance, max_iterations):
+    # Brent's method as described in Numerical Recipes, with the bracket [b, c] always containing the root
+    c, fc = a, fa
+    d = e = b - a
+    for iteration in range(1, max_iterations + 1):
+        if np.sign(fb) == np.sign(fc):
+            c, fc = a, fa
+            d = e = b - a
+        if abs(fc) < abs(fb):
+            a, b, c = b, c, b
+            fa, fb, fc = fb, fc, fb
+        x_tolerance = 2e-16 * abs(b) + 1e-15
+        middle = (c - b) / 2
+        if abs(fb) <= tolerance or abs(middle) <= x_tolerance:
+            return b, fb, True, iteration
+        if abs(e) >= x_tolerance and abs(fa) > abs(fb):
+            s = fb / fa
+            if a == c:
+                # Secant step
+                p = 2 * middle * s
+                q = 1 - s
+            else:
+                # Inverse quadratic interpolation
+                q = fa / fc
+                r = fb / fc
+                p = s * (2 * middle * q * (q - r) - (b - a) * (r - 1))
+                q = (q - 1) * (r - 1) * (s - 1)
+            if p > 0:
+                q = -q
+            p = abs(p)
+            if 2 * p < min(3 * middle * q - abs(x_tolerance * q), abs(e * q)):
+                e = d
+                d = p / q
+            else:
+                d = e = middle
+        else:
+            d = e = middle
+        a, fa = b, fb
+        b += d if abs(d) > x_tolerance else np.copysign(x_tolerance, middle)
+        fb = objective(b)[0]
+    return b, fb, abs(fb) <= tolerance, max_iterations
+
+
+def goal_seek(compiled, input_key, target_key, target_value, method=NEWTON, tolerance=1e-9, max_iterations=100):
+    """
+    Solves for the value of an input which makes a function reach a target value, all other inputs keeping their
+    current values.
+    :param compiled: the CompiledModel to solve on
+    :param input_key: the key of the input to change, either a global parameter or an "Organ.variable"
+    :param target_key: the key of the function which should reach the target value
+    :param target_value: the value the function should reach
+    :param method: one of NEWTON, BRENT or BISECTION. Newton falls back to Brent's method if the function cannot be
+        differentiated.
+    :param tolerance: the largest difference between the function and its target which is accepted as a solution
+    :param max_iterations: the maximum number of iterations of the root finding
+    :return: a GoalSeekResult
+    """
+    if method not in ROOT_FINDING_METHODS:
+        raise ValueError("Unknown root finding method: " + str(method))
+    if target_key not in compiled.nodes:
+        raise KeyError("Unknown function: " + str(target_key))
+    minimum, maximum = compiled.input_ranges[input_key]
+    objective = _Objective(compiled, input_key, target_key, target_value)
+    # The sign change nearest to the current value is not necessarily found, but the grid makes sure that a solution
+    # is found whenever the function crosses the target between two samples
+    bracket, closest = find_bracket(objective, minimum, maximum)
+    if bracket is None:
+        value, difference = closest
+        return GoalSeekResult(input_key, target_key, target_value, float(value), float(difference + target_value),
+                              False, 0, method)
+    a, b, fa, fb = bracket
+    if fa == 0 or fb == 0:
+        value = a if fa == 0 else b
+        return GoalSeekResult(input_key, target_key, target_value, float(value), float(target_value), True, 0, method)
+    if method == NEWTON and objective((a + b) / 2)[1] is None:
+        method = BRENT
+    if method == BRENT:
+        value, difference, converged, iterations = _solve_brent(objective, a, b, fa, fb, tolerance, max_iterations)
+    else:
+        value, difference, converged, iterations = _solve_newton(objective, a, b, fa, fb, tolerance, max_iterations,
+                                                                 method == NEWTON)
+    return GoalSeekResult(input_key, target_key, target_value, float(value), float(difference + target_value),
+                          converged, iterations, method)
@@ -0,0 +1,157 @@
+""" This module computes the derivatives of the functions of a model with respect to its inputs by forward-mode
+    differentiation. Every input is replaced by a dual number, which carries the derivatives of a value with respect to
+    all inputs next to the value itself. A single pass over the dependency graph then gives the whole Jacobian, instead
+    of two evaluations of the model per input with finite differences."""
+import math
+
+import numpy as np
+
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, DEPENDENCY, INVALID
+
+
+class DualNumber(object):
+    """ A value together with its gradient, the array of derivatives with respect to each of the inputs. The arithmetic
+        of the expression language applies the chain rule to the gradients."""
+
+    __slots__ = ('value', 'gradient')
+
+    def __init__(self, value, gradient):
+        self.value = float(value)
+        self.gradient = gradient
+
+    @staticmethod
+    def _split(other):
+        if isinstance(other, DualNumber):
+            return other.value, other.gradient
+        return float(other), 0.0
+
+    def __add__(self, other):
+        value, gradient = self._split(other)
+        return DualNumber(self.value + value, self.gradient + gradient)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        value, gradient = self._split(other)
+        return DualNumber(self.value - value, self.gradient - gradient)
+
+    def __rsub__(self, other):
+        value, gradient = self._split(other)
+        return DualNumber(value - self.value, gradient - self.gradient)
+
+    def __mul__(self, other):
+        value, gradient = self._split(other)
+        return DualNumber(self.value * value, self.gradient * value + gradient * self.value)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        value, gradient = self._split(other)
+        return DualNumber(self.value / value, (self.gradient * value - gradient * self.value) / (value * value))
+
+    def __rtruediv__(self, other):
+        value, gradient = self._split(other)
+        return DualNumber(value / self.value, (gradient * self.value - self.gradient * value) / (self.value ** 2))
+
+    def __pow__(self, other):
+        value, gradient = self._split(other)
+        result = self.value ** value
+        derivative = value * self.value ** (value - 1) * self.gradient if value != 0 else 0.0
+        if isinstance(other, DualNumber) and self.value > 0:
+            # The exponent only contributes when it depends on the inputs itself
+            derivative = derivative + result * math.log(self.value) * gradient
+        return DualNumber(result, derivative)
+
+    def __rpow__(self, other):
+        value = float(other)
+        result = value ** self.value
+        derivative = result * math.log(value) * self.gradient if value > 0 else 0.0 * self.gradient
+        return DualNumber(result, derivative)
+
+    def __neg__(self):
+        return DualNumber(-self.value, -self.gradient)
+
+    def __pos__(self):
+        return self
+
+
+class Jacobian(object):
+    """ The values of the functions of a model and their derivatives with respect to a set of inputs."""
+
+    def __init__(self, inputs, outputs, input_values, output_values, matrix):
+        # The keys of the inputs and functions, in the order of the columns and rows of the matrix
+        self.inputs = inputs
+        self.outputs = outputs
+        # The point at which the derivatives were taken and the values of the functions at that point
+        self.input_values = input_values
+        self.output_values = output_values
+        self.matrix = matrix
+        self._rows = {key: row for row, key in enumerate(outputs)}
+        self._columns = {key: column for column, key in enumerate(inputs)}
+
+    def get_derivative(self, output_key, input_key):
+        return float(self.matrix[self._rows[output_key], self._columns[input_key]])
+
+    def get_gradient(self, output_key):
+        """ Returns the derivatives of a single function, keyed by input."""
+        return dict(zip(self.inputs, self.matrix[self._rows[output_key]].tolist()))
+
+    def get_elasticities(self, output_key):
+        """ Returns the relative change of a function per relative change of each input, (dy / y) / (dx / x)."""
+        value = self.output_values[output_key]
+        elasticities = {}
+        for input_key, derivative in self.get_gradient(output_key).items():
+            elasticities[input_key] = derivative * self.input_values[input_key] / value if value else 0.0
+        return elasticities
+
+
+def compute_jacobian(compiled, inputs=None, targets=None, values=None, errors=None):
+    """
+    Differentiates the functions of a model with respect to its inputs at a single point.
+    :param compiled: the CompiledModel to differentiate
+    :param inputs: the keys of the inputs to differentiate to, by default all global parameters and organ variables
+    :param targets: the keys of the functions to differentiate, together with everything they depend on. By default,
+        all functions are differentiated.
+    :param values: the input values at which the derivatives are taken, by default the current values of the model
+    :param errors: if given, functions which cannot be differentiated are appended as UnresolvedFunction records
+    :return: a Jacobian with a row for every function which could be differentiated
+    """
+    if inputs is None:
+        inputs = list(compiled.input_ranges)
+    inputs = list(inputs)
+    point = dict(compiled.values)
+    if values:
+        point.update(values)
+    duals = dict(point)
+    identity = np.eye(len(inputs))
+    for column, key in enumerate(inputs):
+        duals[key] = DualNumber(point[key], identity[column])
+
+    order = compiled.nodes if targets is None else compiled.get_ancestors(targets)
+    results = {}
+    for key in order:
+        node = compiled.nodes[key]
+        missing = [dep for dep in node.function_deps if dep not in results]
+        if missing:
+            if errors is not None:
+                errors.append(UnresolvedFunction(key, node.expression, DEPENDENCY, tuple(sorted(missing))))
+            continue
+        try:
+            result = eval(node.code, compiled.make_namespace(node, duals, results))
+        except ZeroDivisionError:
+            # As with the evaluation of the model, a division by zero results in a value of 0
+            result = 0.0
+        except (NameError, TypeError, KeyError, AttributeError, ValueError):
+            if errors is not None:
+                errors.append(UnresolvedFunction(key, node.expression, INVALID, ()))
+            continue
+        if not isinstance(result, DualNumber):
+            # The function does not depend on any of the inputs
+            result = DualNumber(result, np.zeros(len(inputs)))
+        results[key] = result
+
+    outputs = [key for key in order if key in results and (targets is None or key in targets)]
+    matrix = np.array([np.broadcast_to(results[key].gradient, (len(inputs),)) for key in outputs])
+    matrix = matrix.reshape(len(outputs), len(inputs))
+    return Jacobian(inputs, outputs, {key: point[key] for key in inputs}, {key: results[key].value for key in outputs},
+                    matrix)
@@ -0,0 +1,107 @@
+""" This module propagates the uncertainty in the inputs of a model to its functions. The inputs are sampled from their
+    [min, max] ranges and the samples are evaluated in chunks with the batch evaluation, or with a WorkerPool."""
+import numpy as np
+
+from ceteris_paribus.analysis.sensitivity import get_sweepable_inputs
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+
+# The available sampling methods
+UNIFORM = 'uniform'  # independent uniform samples over [min, max]
+TRIANGULAR = 'triangular'  # independent samples from the triangular distribution on [min, max] with its mode at val
+LATIN_HYPERCUBE = 'latin_hypercube'  # one uniform sample in each of n equally sized strata of every range
+
+SAMPLING_METHODS = (UNIFORM, TRIANGULAR, LATIN_HYPERCUBE)
+
+
+class MonteCarloResult(object):
+    """ The samples drawn for the inputs and the resulting distributions of the functions."""
+
+    def __init__(self, samples, outputs):
+        # Both dicts map keys to arrays with one element per sample
+        self.samples = samples
+        self.outputs = outputs
+
+    def get_output(self, key):
+        return self.outputs[key]
+
+    def get_mean(self, key):
+        return float(np.nanmean(self.outputs[key]))
+
+    def get_std(self, key):
+        return float(np.nanstd(self.outputs[key]))
+
+    def get_percentiles(self, key, percentiles=(5, 50, 95)):
+        return [float(value) for value in np.nanpercentile(self.outputs[key], percentiles)]
+
+    def get_summary(self, percentiles=(5, 50, 95)):
+        """ Returns the mean, standard deviation and percentiles of every function."""
+        summary = {}
+        for key in self.outputs:
+            summary[key] = {'mean': self.get_mean(key), 'std': self.get_std(key)}
+            for percentile, value in zip(percentiles, self.get_percentiles(key, percentiles)):
+                summary[key]['p' + str(percentile)] = value
+        return summary
+
+
+def sample_inputs(compiled, samples, method=UNIFORM, inputs=None, seed=None):
+    """
+    Draws samples for the ranged inputs of a compiled model.
+    :param compiled: the CompiledModel whose input ranges are sampled
+    :param samples: the number of samples
+    :param method: one of UNIFORM, TRIANGULAR or LATIN_HYPERCUBE
+    :param inputs: the keys of the inputs to sample, by default all inputs with a non-empty range
+    :param seed: the seed of the random number generator, for reproducible results
+    :return: a dict mapping the input keys to arrays of samples
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError("Unknown sampling method: " + str(method))
+    if inputs is None:
+        inputs = get_sweepable_inputs(compiled)
+    rng = np.random.default_rng(seed)
+    sampled = {}
+    for key in inputs:
+        minimum, maximum = compiled.input_ranges[key]
+        if method == UNIFORM:
+            sampled[key] = rng.uniform(minimum, maximum, samples)
+        elif method == TRIANGULAR:
+            if maximum > minimum:
+                mode = min(max(compiled.values[key], minimum), maximum)
+                sampled[key] = rng.triangular(minimum, mode, maximum, samples)
+            else:
+                sampled[key] = np.full(samples, float(minimum))
+        else:
+            strata = (rng.permutation(samples) + rng.random(samples)) / samples
+            sampled[key] = minimum + strata * (maximum - minimum)
+    return sampled
+
+
+def run_monte_carlo(compiled, samples=10000, method=UNIFORM, inputs=None, targets=None, chunk_size=100000, seed=None,
+                    pool=None, errors=None):
+    """
+    Samples the inputs of a model and evaluates the samples in chunks, so memory use is bounded by the chunk size.
+    :param compiled: the CompiledModel to evaluate, inputs which are not sampled keep their current values
+    :param samples: the number of samples
+    :param method: one of UNIFORM, TRIANGULAR or LATIN_HYPERCUBE
+    :param inputs: the keys of the inputs to sample, by default all inputs with a non-empty range
+    :param targets: the keys of the functions to record, by default all functions
+    :param chunk_size: the number of samples evaluated at once
+    :param seed: the seed of the random number generator, for reproducible results
+    :param pool: an optional WorkerPool on the same model, in which case the chunks are evaluated in parallel
+    :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+    :return: a MonteCarloResult
+    """
+    sampled = sample_inputs(compiled, samples, method, inputs, seed)
+    if targets is None:
+        targets = list(compiled.nodes)
+    outputs = {key: np.full(samples, np.nan) for key in targets}
+    for start in range(0, samples, chunk_size):
+        stop = min(start + chunk_size, samples)
+        chunk = {key: values[start:stop] for key, values in sampled.items()}
+        if pool is not None:
+            results = pool.evaluate(chunk, targets, base_values=dict(compiled.values))
+        else:
+            results = evaluate_batch(compiled, chunk, targets, errors if start == 0 else None)
+        for key in targets:
+            if key in results:
+                outputs[key][start:stop] = results[key]
+    return MonteCarloResult(sampled, outputs)
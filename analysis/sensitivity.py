@@ -0,0 +1,73 @@
+""" This module contains the one-at-a-time (ceteris paribus) sensitivity analysis. Each ranged input is swept over its
+    [min, max] range while all other inputs are held at their current values, and the response of every function is
+    recorded. The sweep of an input is evaluated as a single batch, and only the functions downstream of the input are
+    recomputed."""
+import numpy as np
+
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+
+
+class SensitivityProfile(object):
+    """ The response curves of the functions of a model to a sweep over a single input."""
+
+    def __init__(self, input_key, samples, responses, affected):
+        self.input_key = input_key
+        # The values the input was set to
+        self.samples = samples
+        # Maps the key of every function to an array of its values, one for each sample
+        self.responses = responses
+        # The keys of the functions which actually depend on the input
+        self.affected = affected
+
+    def get_response(self, key):
+        return self.responses[key]
+
+    def get_range(self, key):
+        """ Returns the smallest and the largest value of a function over the sweep."""
+        return float(np.min(self.responses[key])), float(np.max(self.responses[key]))
+
+
+def get_sweepable_inputs(compiled):
+    """ Returns the keys of all inputs which have a range to sweep over, the global parameters first."""
+    return [key for key, (minimum, maximum) in compiled.input_ranges.items() if maximum > minimum]
+
+
+def compute_profile(compiled, input_key, points=50, targets=None, baseline=None, errors=None):
+    """
+    Sweeps a single input over its range while keeping all other inputs at their current values.
+    :param compiled: the CompiledModel to analyse, the current values of its inputs are used for the other inputs
+    :param input_key: the key of the input to sweep, either a global parameter or an "Organ.variable"
+    :param points: the number of samples, spread evenly over [min, max]
+    :param targets: the keys of the functions for which the response is recorded, by default all functions
+    :param baseline: the results of the model at the current values, computed if it is not given
+    :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+    :return: a SensitivityProfile
+    """
+    minimum, maximum = compiled.input_ranges[input_key]
+    samples = np.linspace(minimum, maximum, points)
+    if baseline is None:
+        baseline = compiled.update()
+    if targets is None:
+        targets = list(compiled.nodes)
+    affected = compiled.get_downstream(input_key)
+    # Everything which does not depend on the swept input keeps its current value
+    known = {key: value for key, value in baseline.items() if key not in affected}
+    responses = evaluate_batch(compiled, {input_key: samples}, targets, errors, known)
+    responses = {key: responses[key] for key in targets if key in responses}
+    return SensitivityProfile(input_key, samples, responses, [key for key in targets if key in affected])
+
+
+def compute_profiles(compiled, points=50, inputs=None, targets=None, errors=None):
+    """
+    Computes the SensitivityProfile of every input.
+    :param compiled: the CompiledModel to analyse
+    :param points: the number of samples for each input
+    :param inputs: the keys of the inputs to sweep, by default all inputs with a non-empty range
+    :param targets: the keys of the functions for which the response is recorded, by default all functions
+    :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+    :return: a dict mapping the input keys to their profiles
+    """
+    if inputs is None:
+        inputs = get_sweepable_inputs(compiled)
+    baseline = dict(compiled.update(errors=errors))
+    return {key: compute_profile(compiled, key, points, targets, baseline, errors) for key in inputs}
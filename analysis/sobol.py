@@ -0,0 +1,145 @@
+""" This module contains the variance-based global sensitivity analysis. The first-order and total Sobol indices of
+    every function are estimated with respect to every ranged input, using the Saltelli sampling scheme on a scrambled
+    Halton sequence. The scheme needs N * (k + 2) evaluations of the model for N base samples and k inputs, which are
+    evaluated in chunks with the batch evaluation, or with a WorkerPool."""
+import numpy as np
+
+from ceteris_paribus.analysis.sensitivity import get_sweepable_inputs
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+
+
+class SobolIndices(object):
+    """ The first-order and total Sobol indices of a set of functions with respect to a set of inputs."""
+
+    def __init__(self, inputs, first_order, total, variances, samples):
+        # The keys of the inputs, in the order of the columns of the index arrays
+        self.inputs = inputs
+        # Both map the key of every function to an array with an index for each input
+        self.first_order = first_order
+        self.total = total
+        # The variance of every function over the sampled inputs
+        self.variances = variances
+        # The number of base samples N, the model was evaluated N * (k + 2) times
+        self.samples = samples
+
+    def get_first_order(self, key):
+        return dict(zip(self.inputs, self.first_order[key]))
+
+    def get_total(self, key):
+        return dict(zip(self.inputs, self.total[key]))
+
+    def get_ranking(self, key):
+        """ Returns the inputs ordered by their total index for a function, the most influential first."""
+        order = np.argsort(-self.total[key], kind='stable')
+        return [self.inputs[index] for index in order]
+
+
+def get_primes(count):
+    """ Returns the first count prime numbers."""
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % prime for prime in primes if prime * prime <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton(samples, dimensions, seed=None, skip=1):
+    """
+    Generates a scrambled Halton sequence in the unit hypercube. The digits of every dimension are permuted at random,
+    which removes the correlations between the dimensions of the plain sequence when there are many of them.
+    :param samples: the number of points
+    :param dimensions: the number of dimensions
+    :param seed: the seed of the permutations, for reproducible results
+    :param skip: the number of leading points to leave out, the first point is the origin
+    :return: an array of shape (samples, dimensions) with values in [0, 1)
+    """
+    rng = np.random.default_rng(seed)
+    points = np.zeros((samples, dimensions))
+    for dimension, base in enumerate(get_primes(dimensions)):
+        # Zero is kept in place, so the trailing zero digits of an index do not add to its value
+        permutation = np.concatenate(([0], 1 + rng.permutation(base - 1)))
+        indices = np.arange(skip, skip + samples)
+        scale = 1.0 / base
+        while np.any(indices > 0):
+            points[:, dimension] += permutation[indices % base] * scale
+            indices = indices // base
+            scale /= base
+    return points
+
+
+def run_sobol(compiled, samples=1024, inputs=None, targets=None, chunk_size=100000, seed=None, pool=None, errors=None):
+    """
+    Estimates the first-order and total Sobol indices with the Saltelli scheme. The base samples are evaluated in chunks,
+    and the estimators are accumulated over the chunks, so memory use is bounded by the chunk size.
+    :param compiled: the CompiledModel to analyse, inputs which are not sampled keep their current values
+    :param samples: the number of base samples N
+    :param inputs: the keys of the inputs to sample, by default all inputs with a non-empty range
+    :param targets: the keys of the functions to analyse, by default the global functions
+    :param chunk_size: the number of model evaluations done at once
+    :param seed: the seed of the scrambling of the sequence, for reproducible results
+    :param pool: an optional WorkerPool on the same model, in which case the chunks are evaluated in parallel
+    :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+    :return: a SobolIndices
+    """
+    if inputs is None:
+        inputs = get_sweepable_inputs(compiled)
+    if targets is None:
+        targets = compiled.get_global_output_keys()
+    inputs = list(inputs)
+    dimensions = len(inputs)
+    # The columns of the sequence are split into the two independent sample matrices A and B
+    points = halton(samples, 2 * dimensions, seed)
+    ranges = np.array([compiled.input_ranges[key] for key in inputs], dtype=float).reshape(dimensions, 2)
+    points = np.tile(ranges[:, 0], 2) + np.tile(ranges[:, 1] - ranges[:, 0], 2) * points
+
+    # The outputs are shifted by their value at the first sample, which keeps the sums of squares accurate and does
+    # not depend on the chunk size
+    shifts = {}
+    sums = {key: np.zeros(2) for key in targets}
+    squares = {key: 0.0 for key in targets}
+    first_sums = {key: np.zeros(dimensions) for key in targets}
+    total_sums = {key: np.zeros(dimensions) for key in targets}
+    # Every base sample takes k + 2 evaluations: A, B and the k matrices A_B^i with column i taken from B
+    rows = max(1, chunk_size // (dimensions + 2))
+    for start in range(0, samples, rows):
+        stop = min(start + rows, samples)
+        size = stop - start
+        a = points[start:stop, :dimensions]
+        b = points[start:stop, dimensions:]
+        stacked = np.tile(a, (dimensions + 2, 1))
+        stacked[size:2 * size] = b
+        for index in range(dimensions):
+            block = slice((index + 2) * size, (index + 3) * size)
+            stacked[block, index] = b[:, index]
+        chunk = {key: stacked[:, index] for index, key in enumerate(inputs)}
+        if pool is not None:
+            results = pool.evaluate(chunk, targets, base_values=dict(compiled.values))
+        else:
+            results = evaluate_batch(compiled, chunk, targets, errors if start == 0 else None)
+        for key in targets:
+            if key not in results:
+                continue
+            outputs = np.broadcast_to(results[key], (len(stacked),)).reshape(dimensions + 2, size)
+            outputs = outputs - shifts.setdefault(key, float(outputs[0, 0]))
+            output_a, output_b, output_ab = outputs[0], outputs[1], outputs[2:]
+            sums[key] += (np.sum(output_a), np.sum(output_b))
+            squares[key] += np.sum(output_a ** 2) + np.sum(output_b ** 2)
+            # The estimators of Saltelli et al. (2010) for the first-order and of Jansen for the total indices
+            first_sums[key] += np.sum(output_b * (output_ab - output_a), axis=1)
+            total_sums[key] += np.sum((output_a - output_ab) ** 2, axis=1)
+
+    first_order, total, variances = {}, {}, {}
+    for key in targets:
+        mean = np.sum(sums[key]) / (2 * samples)
+        variance = squares[key] / (2 * samples) - mean ** 2
+        variances[key] = float(variance)
+        if variance > 0:
+            first_order[key] = first_sums[key] / samples / variance
+            total[key] = total_sums[key] / (2 * samples) / variance
+        else:
+            # A function which does not vary over the sampled inputs is not sensitive to any of them
+            first_order[key] = np.zeros(dimensions)
+            total[key] = np.zeros(dimensions)
+    return SobolIndices(inputs, first_order, total, variances, samples)
@@ -0,0 +1,131 @@
+""" This module contains a pool of worker processes for evaluating large batches of input vectors in parallel. Every
+    worker loads and compiles the model from the database once, when it is started. The input vectors and the results
+    are exchanged through shared memory, so only the names of the buffers and the bounds of each chunk are sent to the
+    workers. With a cache directory, the workers share an ExpressionStore, so that a worker only compiles the expressions
+    which no earlier worker has compiled."""
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from ceteris_paribus.db.function_parser import expression_cache
+from ceteris_paribus.db.sqlite_database import open_database
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+from ceteris_paribus.model.compiled_model import compile_database
+
+# The compiled model of a worker process, created once by _init_worker
+_worker_model = None
+
+
+def _use_store(cache_dir):
+    # The store is only imported when it is used, as it needs modules which are otherwise not loaded
+    from ceteris_paribus.db.expression_store import ExpressionStore
+    expression_cache.set_store(ExpressionStore(cache_dir))
+
+
+def _init_worker(db_path, cache_dir=None):
+    global _worker_model
+    if cache_dir is not None:
+        _use_store(cache_dir)
+    _worker_model = compile_database(open_database(db_path))
+
+
+def _attach(name):
+    # Attaches to a shared memory buffer created by the parent process. The parent owns the buffer, so the worker must
+    # not register it with the resource tracker, which would otherwise remove it when the worker exits.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 the buffer is always registered
+        buffer = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(buffer._name, 'shared_memory')
+        return buffer
+
+
+def _evaluate_chunk(task):
+    input_name, output_name, input_keys, output_keys, size, start, stop, base_values = task
+    input_buffer = _attach(input_name)
+    output_buffer = _attach(output_name)
+    try:
+        inputs = np.ndarray((len(input_keys), size), dtype=np.float64, buffer=input_buffer.buf)
+        outputs = np.ndarray((len(output_keys), size), dtype=np.float64, buffer=output_buffer.buf)
+        # The base values are the same for the whole chunk, the compiled model of the worker itself is never changed
+        chunk = dict(base_values) if base_values else {}
+        chunk.update((key, inputs[index, start:stop]) for index, key in enumerate(input_keys))
+        results = evaluate_batch(_worker_model, chunk, output_keys)
+        for index, key in enumerate(output_keys):
+            # Functions which could not be evaluated are marked with nan
+            outputs[index, start:stop] = results[key] if key in results else np.nan
+        del inputs, outputs, chunk, results
+    finally:
+        input_buffer.close()
+        output_buffer.close()
+    return stop - start
+
+
+class WorkerPool(object):
+    """ A pool of warm worker processes, each holding its own compiled copy of the model stored at db_path."""
+
+    def __init__(self, db_path, processes=None, cache_dir=None):
+        """
+        :param db_path: the model database
+        :param processes: the number of worker processes, by default the number of CPUs
+        :param cache_dir: the directory of an ExpressionStore shared by the workers, by default none is used
+        :raises ExpressionStoreError: if the directory cannot be used as an ExpressionStore
+        """
+        self.db_path = db_path
+        self.processes = processes or multiprocessing.cpu_count()
+        if cache_dir is not None:
+            _use_store(cache_dir)
+        # The parent process compiles the model as well, to know which inputs and functions exist. This fills the
+        # store before the workers start.
+        self.compiled = compile_database(open_database(db_path))
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(db_path, cache_dir))
+
+    def evaluate(self, inputs, targets=None, base_values=None, chunk_size=None):
+        """
+        Evaluates the model for a batch of input vectors, divided over the workers.
+        :param inputs: a dict mapping input keys to one-dimensional arrays of equal length
+        :param targets: the keys of the functions to return, by default all functions
+        :param base_values: the values of the inputs which are not part of the batch. By default the values stored in
+            the database are used.
+        :param chunk_size: the number of input vectors evaluated by a worker at a time
+        :return: a dict mapping the keys of the functions to arrays of results, nan where the evaluation failed
+        """
+        input_keys = list(inputs)
+        output_keys = list(self.compiled.nodes) if targets is None else list(targets)
+        size = len(next(iter(inputs.values()))) if inputs else 0
+        if size == 0 or not output_keys:
+            return {key: np.empty(0) for key in output_keys}
+        if chunk_size is None:
+            # A few chunks per worker keeps the load balanced when chunks take different amounts of time
+            chunk_size = max(1, -(-size // (self.processes * 4)))
+
+        input_buffer = shared_memory.SharedMemory(create=True, size=8 * len(input_keys) * size)
+        output_buffer = shared_memory.SharedMemory(create=True, size=8 * len(output_keys) * size)
+        try:
+            shared_inputs = np.ndarray((len(input_keys), size), dtype=np.float64, buffer=input_buffer.buf)
+            for index, key in enumerate(input_keys):
+                shared_inputs[index] = inputs[key]
+            tasks = [(input_buffer.name, output_buffer.name, input_keys, output_keys, size, start,
+                      min(start + chunk_size, size), base_values) for start in range(0, size, chunk_size)]
+            self._pool.map(_evaluate_chunk, tasks)
+            shared_outputs = np.ndarray((len(output_keys), size), dtype=np.float64, buffer=output_buffer.buf)
+            results = {key: shared_outputs[index].copy() for index, key in enumerate(output_keys)}
+            del shared_inputs, shared_outputs
+        finally:
+            input_buffer.close()
+            input_buffer.unlink()
+            output_buffer.close()
+            output_buffer.unlink()
+        return results
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
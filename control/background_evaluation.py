@@ -0,0 +1,93 @@
+""" This module evaluates the outputs of the model on a worker thread, so that dragging a slider never waits for an
+    evaluation. Changes of the inputs are queued and coalesced: when several changes of the same input arrive while an
+    evaluation is running, only the latest value is applied. Every request has a generation number, and a result is
+    only delivered if no newer change was requested in the meantime, so the GUI never shows an outdated state."""
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from ceteris_paribus.db.diagnostics import diagnostics, Diagnostic, ERROR, EVALUATION_FAILED
+
+
+class BackgroundEvaluator(QObject):
+    """ Applies input changes to the model and evaluates its outputs on a single worker thread. The outputs_ready
+        signal is emitted with the outputs and the generation of the newest state, it is delivered on the thread of the
+        connected receiver."""
+
+    outputs_ready = pyqtSignal(object, int)
+
+    def __init__(self, get_model):
+        """
+        :param get_model: a function returning the current GlobalModel, the model can be replaced while the program runs
+        """
+        super().__init__()
+        self.get_model = get_model
+        self._condition = threading.Condition()
+        # The latest value of every input which changed since the previous evaluation
+        self._pending = {}
+        self._requested = 0
+        self._running = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="BackgroundEvaluator", daemon=True)
+        self._thread.start()
+
+    def set_input(self, key, value):
+        """ Requests a change of a global parameter or, with a key of the form "Organ.variable", of a local value.
+            :return: the generation of the requested state
+        """
+        with self._condition:
+            self._pending[key] = value
+            self._requested += 1
+            self._condition.notify()
+            return self._requested
+
+    def is_current(self, generation):
+        """ Returns whether no change was requested after the state with the given generation."""
+        with self._condition:
+            return generation == self._requested
+
+    def is_idle(self):
+        with self._condition:
+            return not self._pending and not self._running
+
+    def stop(self, timeout=None):
+        """ Applies the changes which are still pending, after which the worker thread ends."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+                generation = self._requested
+                self._running = True
+            try:
+                outputs = self._evaluate(pending)
+            except Exception as error:
+                # The worker keeps running, so that the next change is still evaluated
+                diagnostics.report(Diagnostic(EVALUATION_FAILED, ERROR, "The outputs could not be evaluated: " +
+                                              repr(error)))
+                continue
+            finally:
+                with self._condition:
+                    self._running = False
+            # A result which was overtaken by a newer change is dropped, the newer change is evaluated next
+            if self.is_current(generation):
+                self.outputs_ready.emit(outputs, generation)
+
+    def _evaluate(self, pending):
+        model = self.get_model()
+        with model.lock:
+            for key, value in pending.items():
+                try:
+                    model.set_input_value(key, value)
+                except KeyError:
+                    # The input was removed, or the model replaced, after the change was requested
+                    pass
+            return model.get_outputs()
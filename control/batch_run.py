@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+""" A command line entry point which evaluates models without a GUI, for batches of scenarios on headless machines.
+    One or more model databases, TinyDB or SQLite, are loaded, the inputs are overridden from the command line and from
+    the rows of a CSV file, and one record per scenario is written as JSON lines or CSV. Errors never stop the run, they
+    are written as part of the records instead.
+
+    Example: python -m ceteris_paribus.control.batch_run model.json --set BodyCO=4000 --scenarios scenarios.csv
+"""
+import argparse
+import csv
+import json
+import sys
+
+import numpy as np
+
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, UNDEFINED
+from ceteris_paribus.db.function_parser import expression_cache
+from ceteris_paribus.db.model_loader import load_model_description, ModelLoadError
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+from ceteris_paribus.model.compiled_model import compile_database
+
+# The status of a record
+OK = 'ok'  # all requested outputs were evaluated
+PARTIAL = 'partial'  # some of the requested outputs could not be evaluated
+ERROR = 'error'  # the scenario could not be evaluated at all
+
+# The reasons for errors which are not about a function of the model
+LOAD_FAILED = 'load failed'
+UNKNOWN_INPUT = 'unknown input'
+INVALID_VALUE = 'invalid value'
+
+# The name of the optional column of the scenario file which identifies each scenario
+SCENARIO_COLUMN = 'scenario'
+
+
+class BatchRunError(Exception):
+    """ Raised when a model database cannot be used for a batch run."""
+
+
+def load_database(path):
+    """ Loads a model database and compiles it, without changing the file."""
+    try:
+        return compile_database(load_model_description(path, report=False))
+    except ModelLoadError as error:
+        raise BatchRunError("The database " + path + " cannot be loaded: " + "; ".join(error.problems))
+
+
+def read_scenarios(path):
+    """
+    Reads the scenarios from a CSV file with a header of input keys and one scenario per row.
+    :return: a list of (scenario id, dict mapping input keys to the text of their values) tuples. The id is taken from
+        the "scenario" column if there is one and is the row number otherwise. Empty cells are left out, so these
+        inputs keep the value of the model.
+    """
+    scenarios = []
+    with open(path, newline='') as file:
+        for number, row in enumerate(csv.DictReader(file), 1):
+            scenario_id = row.pop(SCENARIO_COLUMN, None) or str(number)
+            scenarios.append((scenario_id, {key.strip(): value.strip() for key, value in row.items()
+                                            if key is not None and value is not None and value.strip()}))
+    return scenarios
+
+
+def parse_assignment(text):
+    """ Parses a KEY=VALUE argument of the command line."""
+    key, separator, value = text.partition('=')
+    if not separator or not key.strip():
+        raise argparse.ArgumentTypeError("expected KEY=VALUE, got " + repr(text))
+    try:
+        return key.strip(), float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("the value of " + key.strip() + " is not a number: " + repr(value))
+
+
+def describe_error(error):
+    """ Converts an UnresolvedFunction record into a dict which can be written as JSON."""
+    return {'name': error.name, 'reason': error.reason, 'names': list(error.names)}
+
+
+def make_record(database, scenario, status, inputs=None, outputs=None, errors=()):
+    return {'database': database, 'scenario': scenario, 'status': status, 'inputs': inputs or {}, 'outputs': outputs,
+            'errors': list(errors)}
+
+
+def _parse_inputs(compiled, values):
+    # Converts the values of a scenario to numbers, the keys which are not inputs of the model are errors
+    inputs = {}
+    errors = []
+    for key, value in values.items():
+        if key not in compiled.values:
+            errors.append({'name': key, 'reason': UNKNOWN_INPUT, 'names': []})
+            continue
+        try:
+            inputs[key] = float(value)
+        except (TypeError, ValueError):
+            errors.append({'name': key, 'reason': INVALID_VALUE, 'names': [str(value)]})
+    return inputs, errors
+
+
+def run_scenarios(compiled, database, scenarios, overrides=None, outputs=None, chunk_size=1000):
+    """
+    Evaluates a compiled model for a list of scenarios. The scenarios are evaluated together in chunks, with one array
+    per input, so a chunk costs about as much as a single evaluation.
+    :param compiled: the CompiledModel to evaluate
+    :param database: the name of the database, which is included in the records
+    :param scenarios: a list of (scenario id, dict mapping input keys to values) tuples
+    :param overrides: a dict of input values which apply to every scenario, a scenario can override these in turn
+    :param outputs: the keys of the functions to report, by default the global functions
+    :param chunk_size: the largest number of scenarios evaluated at once
+    :return: a generator of records, one for each scenario and in the same order
+    """
+    targets = list(outputs) if outputs is not None else compiled.global_function_names
+    known_targets = [key for key in targets if key in compiled.nodes]
+    # Requested outputs which cannot be compiled fail for every scenario, with the reason found during compilation
+    compile_errors = {error.name: error for error in compiled.errors}
+    static_errors = [describe_error(compile_errors.get(key, UnresolvedFunction(key, None, UNDEFINED, (key,))))
+                     for key in targets if key not in compiled.nodes]
+
+    for start in range(0, len(scenarios), chunk_size):
+        chunk = []
+        for scenario_id, values in scenarios[start:start + chunk_size]:
+            combined = dict(overrides or {})
+            combined.update(values)
+            inputs, errors = _parse_inputs(compiled, combined)
+            chunk.append((scenario_id, inputs, errors))
+
+        valid = [(scenario_id, inputs) for scenario_id, inputs, errors in chunk if not errors]
+        results = {}
+        batch_errors = []
+        if valid:
+            # Every input which is set in any scenario gets an array, the other scenarios use the value of the model
+            keys = sorted({key for scenario_id, inputs in valid for key in inputs})
+            batch_inputs = {key: np.array([inputs.get(key, compiled.values[key]) for scenario_id, inputs in valid])
+                            for key in keys}
+            results = evaluate_batch(compiled, batch_inputs, known_targets, batch_errors)
+        function_errors = static_errors + [describe_error(error) for error in batch_errors]
+
+        index = 0
+        for scenario_id, inputs, errors in chunk:
+            if errors:
+                yield make_record(database, scenario_id, ERROR, inputs, None, errors)
+                continue
+            values = {}
+            for key in targets:
+                if key in results:
+                    value = results[key]
+                    values[key] = float(value if np.ndim(value) == 0 else value[index])
+                else:
+                    values[key] = None
+            index += 1
+            if not function_errors:
+                status = OK
+            elif any(value is not None for value in values.values()):
+                status = PARTIAL
+            else:
+                status = ERROR
+            yield make_record(database, scenario_id, status, inputs, values, function_errors)
+
+
+class JsonLinesWriter(object):
+    """ Writes every record as a single line of JSON."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.flush()
+
+
+class CsvWriter(object):
+    """ Writes the records as CSV, with one column per output. The errors of a record are joined in a single column."""
+
+    BASE_COLUMNS = ['database', 'scenario', 'status', 'errors']
+
+    def __init__(self, file, outputs=None):
+        self.file = file
+        self.outputs = list(outputs) if outputs is not None else None
+        self.writer = None
+        # Records are held back until the output columns are known, from the first record which has outputs
+        self.pending = []
+
+    def write(self, record):
+        if self.writer is None:
+            if self.outputs is None and record['outputs'] is None:
+                self.pending.append(record)
+                return
+            self._start(record['outputs'])
+        self._write_row(record)
+
+    def _start(self, outputs):
+        if self.outputs is None:
+            self.outputs = list(outputs or {})
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.BASE_COLUMNS + self.outputs)
+        for record in self.pending:
+            self._write_row(record)
+        self.pending = []
+
+    def _write_row(self, record):
+        errors = "; ".join(error['name'] + ": " + error['reason'] +
+                           (" (" + ", ".join(error['names']) + ")" if error['names'] else "")
+                           for error in record['errors'])
+        outputs = record['outputs'] or {}
+        row = [record['database'], record['scenario'], record['status'], errors]
+        row.extend('' if outputs.get(key) is None else repr(outputs[key]) for key in self.outputs)
+        self.writer.writerow(row)
+
+    def close(self):
+        if self.writer is None:
+            self._start(None)
+        self.file.flush()
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Evaluates models for batches of scenarios, without a GUI.")
+    parser.add_argument('databases', nargs='+', help="the model databases to evaluate")
+    parser.add_argument('--set', dest='overrides', metavar='KEY=VALUE', action='append', type=parse_assignment,
+                        default=[], help="sets an input for all scenarios, such as BodyCO=4000 or Heart.Weight=0.3")
+    parser.add_argument('--scenarios', metavar='CSV', help="a CSV file with one scenario per row and one column per "
+                                                          "input key, with an optional 'scenario' column")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl', help="the format of the results")
+    parser.add_argument('--output', metavar='FILE', help="the file to write to, by default the standard output")
+    parser.add_argument('--outputs', metavar='KEY,...', help="the functions to report, by default the global functions")
+    parser.add_argument('--all-functions', action='store_true', help="reports every function, including those of "
+                                                                     "the organs")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="the number of scenarios evaluated at once")
+    parser.add_argument('--cache-dir', metavar='DIR', help="a directory in which the compiled expressions are kept, "
+                                                          "so that later runs do not compile them again")
+    return parser
+
+
+def main(argv=None):
+    """ Runs the batch described by the command line arguments.
+        :return: the exit status, which is 1 if any scenario was not fully evaluated
+    """
+    args = make_parser().parse_args(argv)
+    outputs = [key.strip() for key in args.outputs.split(',') if key.strip()] if args.outputs else None
+    scenarios = read_scenarios(args.scenarios) if args.scenarios else [('1', {})]
+    overrides = dict(args.overrides)
+    if args.cache_dir:
+        # Only imported when it is used, as the store needs modules which are otherwise not loaded
+        from ceteris_paribus.db.expression_store import ExpressionStore, ExpressionStoreError
+        try:
+            expression_cache.set_store(ExpressionStore(args.cache_dir))
+        except ExpressionStoreError as error:
+            print(str(error), file=sys.stderr)
+            return 1
+
+    file = open(args.output, 'w', newline='') if args.output else sys.stdout
+    writer = CsvWriter(file, outputs) if args.format == 'csv' else JsonLinesWriter(file)
+    failed = False
+    try:
+        for database in args.databases:
+            try:
+                compiled = load_database(database)
+            except BatchRunError as error:
+                writer.write(make_record(database, None, ERROR, errors=[{'name': database, 'reason': LOAD_FAILED,
+                                                                         'names': [str(error)]}]))
+                failed = True
+                continue
+            targets = outputs
+            if targets is None and args.all_functions:
+                targets = list(compiled.nodes)
+            for record in run_scenarios(compiled, database, scenarios, overrides, targets, args.chunk_size):
+                writer.write(record)
+                failed = failed or record['status'] != OK
+        writer.close()
+    finally:
+        if file is not sys.stdout:
+            file.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,11 @@ from PyQt5.QtGui import QFont
 
 from ceteris_paribus.control.model_control import ModelController
 from ceteris_paribus.control.view_control import ViewController
-from ceteris_paribus.gui.visual_elements import print_warning
+from ceteris_paribus.db.change_journal import open_journal
+from ceteris_paribus.db.diagnostics import diagnostics
+from ceteris_paribus.db.model_loader import load_model_description, ModelLoadError
+from ceteris_paribus.db.snapshot import is_snapshot_path, SnapshotError
+from ceteris_paribus.gui.visual_elements import print_warning, DiagnosticsRelay, confirm_diagnostic
 
 from PyQt5.QtWidgets import QApplication, QMessageBox
 
@@ -21,6 +25,12 @@ class Controller(object):
         model and the User Interface."""
 
     def __init__(self):
+        # The model reports its diagnostics without a GUI, here they are shown to the user as dialogs
+        self.diagnostics_relay = DiagnosticsRelay()
+        diagnostics.subscribe(self.diagnostics_relay)
+        diagnostics.set_confirm_handler(confirm_diagnostic)
+        # Whether the models are evaluated with a single generated function, this is kept when another model is opened
+        self.code_generation = False
         # Create a view control object and a model control object, to be used by this controller
         self.model_control = ModelController(None)
         self.view_control = ViewController(self)
@@ -28,33 +38,36 @@ class Controller(object):
         self.db = None
 
     def new_model(self, db):
+        # The edits of the previous model are on disk once its journal is closed
+        self.get_model().set_journal(None)
         self.model_control = ModelController(db)
+        self.get_model().set_code_generation(self.code_generation)
 
     def open_new_db(self):
         # Change to a new database, opens a UI dialog
-        self.db = select_db_dialog()
-        if self.verify_db(self.db):
-            self.new_model(self.db)
-            return True
-        else:
+        path = select_db_dialog()
+        if not path:
             return False
-
-    def verify_db(self, db):
         try:
-            # This function returns True only if the underlying DB has the correct structure
-            tables = {'GlobalFunctions', 'GlobalParameters', 'SystemicOrgans', 'GlobalConstants'}
-            if len(set(tables).intersection(db.tables())) == 4:
-                global_param_table = db.table("GlobalParameters").all()
-                for param in global_param_table[0]:
-                    if len(global_param_table[0][param]) != 3:
-                        print_warning("Unable to read database, global parameters do not define range")
-                        return False
-                return True
-            print_warning("Unable to read database, not all required tables are present")
-            return False
-        except:
-            print_warning("Unspecified error when trying to read the database")
+            # The file is read and validated in a single pass, the model is built from the result
+            self.db = load_model_description(path)
+        except ModelLoadError as error:
+            print_warning("Unable to read database:\n" + str(error))
             return False
+        self.new_model(self.db)
+        if is_snapshot_path(path):
+            # The edits made since the snapshot was last compacted are recovered, and the new edits are recorded
+            try:
+                open_journal(self.get_model(), path)
+            except (OSError, SnapshotError) as error:
+                print_warning("Unable to open the journal of the snapshot, the changes made to the model are not "
+                              "recorded:\n" + str(error))
+        return True
+
+    def set_code_generation(self, enabled):
+        # Chosen in the View menu, it applies to the current model and to the models opened later
+        self.code_generation = enabled
+        self.get_model().set_code_generation(enabled)
 
     def get_model_control(self):
         return self.model_control
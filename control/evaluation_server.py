@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+""" A local server which answers evaluation requests of other programs, without a GUI. The model is loaded and compiled
+    once, after which JSON requests are accepted over HTTP:
+
+        GET  /model       the inputs with their ranges and current values, and the global functions
+        POST /evaluate    {"inputs": {"BodyCO": 4000}, "outputs": ["VO2"]}, gives {"outputs": {...}, "errors": [...]}
+        POST /sweep       {"input": "BodyCO", "points": 50, "outputs": ["VO2"]}, gives the samples and the responses
+
+    Evaluate requests which arrive within a short window of each other are answered with a single vectorized evaluation
+    of the model, so many concurrent clients cost little more than one.
+
+    Example: python -m ceteris_paribus.control.evaluation_server model.json --port 8765
+"""
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ceteris_paribus.analysis.sensitivity import compute_profile
+from ceteris_paribus.control.batch_run import load_database, describe_error, BatchRunError
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, UNDEFINED
+from ceteris_paribus.db.function_parser import expression_cache
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """ Raised when a request cannot be answered, the status is the HTTP status of the response."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _PendingEvaluation(object):
+    # An evaluate request which waits for the next batch
+
+    def __init__(self, inputs, targets, future):
+        self.inputs = inputs
+        self.targets = targets
+        self.future = future
+
+
+class EvaluationServer(object):
+    """ Keeps a compiled model warm and answers requests for it. All evaluations run on a single worker thread, so the
+        compiled model is never used by two evaluations at once and the event loop stays responsive."""
+
+    def __init__(self, compiled, batch_window=0.005, max_batch=1024):
+        """
+        :param compiled: the CompiledModel to evaluate
+        :param batch_window: the time in seconds for which evaluate requests are collected into a single batch
+        :param max_batch: the largest number of requests in a batch, a full batch is evaluated right away
+        """
+        self.compiled = compiled
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        # The number of batches and requests evaluated so far
+        self.batches = 0
+        self.requests = 0
+        self._pending = []
+        self._flush_handle = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """ Starts listening, a port of 0 picks a free port.
+            :return: the (host, port) the server listens on
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def evaluate(self, inputs, targets=None):
+        """
+        Evaluates the model for one input vector, together with the other requests of the same batch.
+        :param inputs: a dict mapping input keys to numbers, the other inputs keep their current values
+        :param targets: the keys of the functions to return, by default the global functions
+        :return: a dict with the "outputs" and the "errors" of the evaluation
+        """
+        inputs = self._check_inputs(inputs)
+        targets = self._check_targets(targets)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_PendingEvaluation(inputs, targets, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await future
+
+    async def sweep(self, input_key, points=50, targets=None):
+        """ Sweeps a single input over its range, all other inputs keeping their current values."""
+        if input_key not in self.compiled.input_ranges:
+            raise RequestError("Unknown input: " + str(input_key))
+        if not isinstance(points, int) or not 2 <= points <= 100000:
+            raise RequestError("The number of points must be an integer from 2 to 100000")
+        targets = self._check_targets(targets)
+        profile = await asyncio.get_running_loop().run_in_executor(
+            self._executor, compute_profile, self.compiled, input_key, points,
+            [key for key in targets if key in self.compiled.nodes])
+        return {'input': input_key, 'samples': profile.samples.tolist(),
+                'responses': {key: values.tolist() for key, values in profile.responses.items()}}
+
+    def describe_model(self):
+        return {'inputs': {key: {'value': self.compiled.values[key], 'range': list(self.compiled.input_ranges[key])
+                                 if key in self.compiled.input_ranges else None} for key in self.compiled.values},
+                'outputs': self.compiled.global_function_names}
+
+    def _check_inputs(self, inputs):
+        if not isinstance(inputs, dict):
+            raise RequestError("The inputs must be an object mapping input keys to numbers")
+        checked = {}
+        for key, value in inputs.items():
+            if key not in self.compiled.values:
+                raise RequestError("Unknown input: " + str(key))
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise RequestError("The value of " + key + " is not a number")
+            checked[key] = float(value)
+        return checked
+
+    def _check_targets(self, targets):
+        if targets is None:
+            return self.compiled.global_function_names
+        if not isinstance(targets, list) or not all(isinstance(key, str) for key in targets):
+            raise RequestError("The outputs must be a list of function keys")
+        return targets
+
+    def _flush(self):
+        # Takes all waiting requests and evaluates them as a single batch on the worker thread
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().run_in_executor(self._executor, self._evaluate_batch, batch)
+            task.add_done_callback(lambda done: self._resolve(batch, done))
+
+    def _evaluate_batch(self, batch):
+        # Every input which is set in any request gets an array, the other requests use the value of the model
+        keys = sorted({key for request in batch for key in request.inputs})
+        inputs = {key: np.array([request.inputs.get(key, self.compiled.values[key]) for request in batch])
+                  for key in keys}
+        targets = sorted({key for request in batch for key in request.targets if key in self.compiled.nodes})
+        errors = []
+        results = evaluate_batch(self.compiled, inputs, targets, errors)
+        self.batches += 1
+        self.requests += len(batch)
+        return results, errors
+
+    def _resolve(self, batch, done):
+        if done.exception() is not None:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(done.exception())
+            return
+        results, errors = done.result()
+        compile_errors = {error.name: error for error in self.compiled.errors}
+        for index, request in enumerate(batch):
+            outputs = {}
+            request_errors = []
+            for key in request.targets:
+                if key in results:
+                    value = results[key]
+                    outputs[key] = float(value if np.ndim(value) == 0 else value[index])
+                else:
+                    outputs[key] = None
+                    if key not in self.compiled.nodes:
+                        request_errors.append(compile_errors.get(key, UnresolvedFunction(key, None, UNDEFINED,
+                                                                                         (key,))))
+            targets = set(request.targets)
+            request_errors.extend(error for error in errors if error.name in targets)
+            if not request.future.done():
+                request.future.set_result({'outputs': outputs,
+                                           'errors': [describe_error(error) for error in request_errors]})
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, response = await self._dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                _write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        try:
+            if path == '/model':
+                if method != 'GET':
+                    raise RequestError("Use GET for " + path, 405)
+                return 200, self.describe_model()
+            if path not in ('/evaluate', '/sweep'):
+                raise RequestError("Unknown path: " + path, 404)
+            if method != 'POST':
+                raise RequestError("Use POST for " + path, 405)
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                raise RequestError("The body is not valid JSON")
+            if not isinstance(payload, dict):
+                raise RequestError("The body must be a JSON object")
+            if path == '/evaluate':
+                return 200, await self.evaluate(payload.get('inputs', {}), payload.get('outputs'))
+            return 200, await self.sweep(payload.get('input'), payload.get('points', 50), payload.get('outputs'))
+        except RequestError as error:
+            return error.status, {'error': str(error)}
+
+
+async def _read_request(reader):
+    # Reads a single HTTP/1.1 request, returns None once the client has closed the connection
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ConnectionError("Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0) or 0)
+    body = await reader.readexactly(length) if length else b''
+    return parts[0].upper(), parts[1].split('?')[0], headers, body
+
+
+def _write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    head = ("HTTP/1.1 " + str(status) + " " + REASONS.get(status, "") + "\r\n" +
+            "Content-Type: application/json\r\n" +
+            "Content-Length: " + str(len(body)) + "\r\n" +
+            "Connection: " + ("keep-alive" if keep_alive else "close") + "\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+
+async def request(host, port, method, path, payload=None):
+    """ Sends a single request to an evaluation server and returns the HTTP status and the decoded JSON response."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = (method + " " + path + " HTTP/1.1\r\nHost: " + str(host) + "\r\nContent-Type: application/json\r\n" +
+                "Content-Length: " + str(len(body)) + "\r\nConnection: close\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        response = await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, json.loads(response)
+    finally:
+        writer.close()
+
+
+async def serve(database, host='127.0.0.1', port=8765, batch_window=0.005, max_batch=1024):
+    server = EvaluationServer(load_database(database), batch_window, max_batch)
+    host, port = await server.start(host, port)
+    print("Serving " + database + " on http://" + str(host) + ":" + str(port), flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answers evaluation requests for a model over HTTP, without a GUI.")
+    parser.add_argument('database', help="the model database to serve")
+    parser.add_argument('--host', default='127.0.0.1', help="the address to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="the port to listen on")
+    parser.add_argument('--window', type=float, default=5.0, help="the time in milliseconds for which evaluate "
+                                                                  "requests are collected into a single batch")
+    parser.add_argument('--max-batch', type=int, default=1024, help="the largest number of requests in a batch")
+    parser.add_argument('--cache-dir', metavar='DIR', help="a directory in which the compiled expressions are kept, "
+                                                          "so that later starts do not compile them again")
+    args = parser.parse_args(argv)
+    if args.cache_dir:
+        # Only imported when it is used, as the store needs modules which are otherwise not loaded
+        from ceteris_paribus.db.expression_store import ExpressionStore, ExpressionStoreError
+        try:
+            expression_cache.set_store(ExpressionStore(args.cache_dir))
+        except ExpressionStoreError as error:
+            print(str(error), file=sys.stderr)
+            return 1
+    try:
+        asyncio.run(serve(args.database, args.host, args.port, args.window / 1000, args.max_batch))
+    except BatchRunError as error:
+        print(str(error), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
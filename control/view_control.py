@@ -1,6 +1,9 @@
+from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QUndoStack
 
+from ceteris_paribus.control.background_evaluation import BackgroundEvaluator
 from ceteris_paribus.gui.graph_editor import GraphWindow
+from ceteris_paribus.model.compiled_model import qualify
 
 
 class ViewController(object):
@@ -12,6 +15,9 @@ class ViewController(object):
 
         # Create an undo stack
         self.undo_stack = QUndoStack()
+        # The sliders change the model on a worker thread, the outputs are shown once the newest state is evaluated
+        self.evaluator = BackgroundEvaluator(self.global_control.get_model)
+        self.evaluator.outputs_ready.connect(self.outputs_evaluated, Qt.QueuedConnection)
         # Finally, a UI is instantiated based on the current model
         self.ui = GraphWindow(self)
         # The context pane remains empty for now
@@ -61,6 +67,30 @@ class ViewController(object):
     def get_outputs(self):
         return self.global_control.get_model().get_outputs()
 
+    def set_code_generation(self, enabled):
+        self.global_control.set_code_generation(enabled)
+
+    def get_sweepable_inputs(self):
+        return self.global_control.get_model().get_sweepable_inputs()
+
+    def get_sensitivity_profile(self, input_key, points):
+        # Only the global outputs are shown in the profiles
+        model = self.global_control.get_model()
+        targets = model.get_compiled_model().get_global_output_keys()
+        return model.get_sensitivity_profile(input_key, points, targets)
+
+    def get_output_names(self):
+        return self.global_control.get_model().get_compiled_model().get_global_output_keys()
+
+    def goal_seek(self, input_key, target_key, target_value):
+        return self.global_control.get_model().goal_seek(input_key, target_key, target_value)
+
+    def apply_input_value(self, key, value):
+        # Sets an input to a value found by the model, after which the sliders and outputs are updated
+        self.global_control.get_model().set_input_value(key, value)
+        self.context_pane.reload_input_layout()
+        self.context_pane.update_output(None, None)
+
     def get_organs(self):
         # Return the list of organs in the model
         return self.global_control.get_model().get_organs()
@@ -75,7 +105,7 @@ class ViewController(object):
         # node is in their range with respect to this value
         color_scheme_names = self.global_control.get_model().color_schemes[name]
 
-        gradient = self.context_pane.colorBar.getLookupTable(100)  # A lookup table giving RGB colors
+        gradient = self.context_pane.get_color_bar().getLookupTable(100)  # A lookup table giving RGB colors
 
         for organ in self.global_control.get_model().organs.values():
             if organ.get_name() in color_scheme_names:
@@ -117,9 +147,8 @@ class ViewController(object):
         # If the user changes a local value in an organ, this function is called. We change the local value and update
         # the UI accordingly
         organ = self.context_pane.current_organ
-        organ.local_changed(name, new_value)
         label.setText(str(round(new_value, 2)))
-        self.context_pane.update_output(None, None)
+        self.evaluator.set_input(qualify(organ.get_name(), name), new_value)
 
     def add_global_function(self, f_name, f_str):
         self.global_control.get_model().add_global_func(f_name, f_str)
@@ -131,9 +160,29 @@ class ViewController(object):
         # Returns the global functions defined in the model
         return self.global_control.get_model().get_global_functions()
 
+    def model_structure_changed(self, organ):
+        # Called after the functions or variables of an organ were edited in place
+        self.global_control.get_model().organ_changed(organ)
+
+    def rename_organ(self, organ, name):
+        # Called after the node of an organ was given a new name
+        old_name = organ.get_name()
+        self.global_control.get_model().rename_organ(organ, name)
+        items = self.ui.get_scene().items
+        items[name] = items.pop(old_name)
+
+    def organ_moved(self, organ, pos):
+        # Called after the node of an organ was moved in the graph
+        self.global_control.get_model().move_organ(organ, [pos.x(), pos.y()])
+
     def verify_function(self, func):
         # Verifies that the argument can be used as a global function
         return self.global_control.get_model().verify_function(func)
 
     def input_slider_changed(self, name, value):
-        return self.global_control.get_model().param_changed(name, value)
+        self.evaluator.set_input(name, value)
+
+    def outputs_evaluated(self, outputs, generation):
+        # Results which were overtaken by a newer slider change are not shown
+        if self.evaluator.is_current(generation):
+            self.context_pane.show_outputs(outputs)
@@ -0,0 +1,209 @@
+""" This module contains an append-only journal of the edits made to a model which was opened from a snapshot. Every
+    edit is appended to the journal as it happens, so saving only has to flush the journal to disk, and the work of a
+    session is recovered by replaying the journal when the snapshot is opened again.
+
+    The journal is kept next to the snapshot, with the .journal suffix, and holds one JSON object per line. Every change
+    has a sequence number. Once enough changes were recorded, the model is compacted into a new snapshot on a
+    background thread, which replaces the previous snapshot with an atomic rename. The snapshot stores the sequence
+    number of the last change it contains, so a journal which was not yet shortened when the program stopped is replayed
+    correctly. The kinds of changes are listed in the model_changes module.
+"""
+import json
+import os
+import threading
+
+from ceteris_paribus.db.diagnostics import diagnostics, Diagnostic, COMPACTION_FAILED, INVALID_CHANGE, WARNING
+from ceteris_paribus.db.model_loader import ModelDescription
+from ceteris_paribus.db.snapshot import Snapshot, dump_snapshot, sync_directory, write_snapshot
+from ceteris_paribus.db.sqlite_database import get_model_data
+from ceteris_paribus.model.compiled_model import compile_database
+
+JOURNAL_SUFFIX = '.journal'
+# The number of changes after which the model is compacted into a new snapshot
+COMPACT_AFTER = 10000
+
+
+def read_changes(path, after=0, errors=None):
+    """ Returns the changes in a journal file with a sequence number larger than after. A last line which was only
+        partly written is ignored, and a damaged line is skipped.
+        :param errors: a list to which the numbers of the damaged lines are appended
+    """
+    changes = []
+    if not os.path.exists(path):
+        return changes
+    with open(path, 'rb') as file:
+        for number, line in enumerate(file, 1):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                change = json.loads(line)
+                if change['seq'] > after:
+                    changes.append(change)
+            except (ValueError, KeyError, TypeError):
+                if errors is not None:
+                    errors.append(number)
+    return changes
+
+
+class ChangeJournal(object):
+    """ The journal of a model which was opened from, or saved as, a snapshot."""
+
+    def __init__(self, snapshot_path, model, compact_after=COMPACT_AFTER):
+        """
+        :param snapshot_path: the snapshot the journal belongs to, it must exist
+        :param model: the GlobalModel which was built from the snapshot
+        :param compact_after: the number of changes after which the model is compacted into a new snapshot
+        """
+        self.snapshot_path = snapshot_path
+        self.path = snapshot_path + JOURNAL_SUFFIX
+        self.model = model
+        self.compact_after = compact_after
+        self.snapshot_sequence = Snapshot(snapshot_path).journal_sequence
+        changes = read_changes(self.path, self.snapshot_sequence)
+        self.sequence = changes[-1]['seq'] if changes else self.snapshot_sequence
+        # The number of changes which are not yet contained in the snapshot
+        self.pending = len(changes)
+        self._lock = threading.Lock()
+        self._compaction = None
+        self._discard_partial_line()
+        self._file = open(self.path, 'ab')
+
+    def _discard_partial_line(self):
+        # A line which was only partly written when the program stopped is removed, so new changes start on a new line
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as file:
+            content = file.read()
+            if content and not content.endswith(b'\n'):
+                file.truncate(content.rfind(b'\n') + 1)
+
+    def replay(self):
+        """ Applies the changes which are not yet contained in the snapshot to the model. This is done before the
+            journal is attached to the model, so that the changes are not recorded a second time. A change which cannot
+            be read or applied is skipped and reported, so that the rest of the session is still recovered."""
+        errors = []
+        for change in read_changes(self.path, self.snapshot_sequence, errors):
+            try:
+                self.model.apply_change(change)
+            except Exception as error:
+                diagnostics.report(Diagnostic(INVALID_CHANGE, WARNING, "Unable to apply change " + str(change['seq']) +
+                                              " of the journal, it was skipped: " + repr(error)))
+        for number in errors:
+            diagnostics.report(Diagnostic(INVALID_CHANGE, WARNING, "Line " + str(number) + " of the journal " +
+                                          self.path + " is damaged, it was skipped"))
+
+    def record(self, op, **fields):
+        """ Appends a change to the journal, and starts a compaction once enough changes were recorded."""
+        with self._lock:
+            self.sequence += 1
+            self._file.write((json.dumps(dict(fields, seq=self.sequence, op=op)) + '\n').encode('utf-8'))
+            self._file.flush()
+            self.pending += 1
+            compact = self.pending >= self.compact_after and not self.is_compacting()
+        if compact:
+            self.start_compaction()
+
+    def sync(self):
+        """ Makes sure all recorded changes are on disk. As the changes are recorded as they happen, saving the model
+            takes the same time irrespective of its size."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def is_compacting(self):
+        return self._compaction is not None and self._compaction.is_alive()
+
+    def start_compaction(self):
+        """ Writes the current state of the model to a new snapshot on a background thread.
+            :return: the thread doing the compaction
+        """
+        self.wait()
+        data, sequence, offset = self._capture()
+        self._compaction = threading.Thread(target=self._compact_in_background, args=(data, sequence, offset),
+                                            name="JournalCompaction", daemon=True)
+        self._compaction.start()
+        return self._compaction
+
+    def compact(self):
+        """ Writes the current state of the model to a new snapshot and waits until it is done."""
+        self.wait()
+        self._write_compaction(*self._capture())
+
+    def wait(self):
+        if self._compaction is not None:
+            self._compaction.join()
+
+    def _capture(self):
+        # The model data is copied while the model cannot change, the snapshot is written from the copy
+        with self.model.lock, self._lock:
+            data = get_model_data(self.model)
+            self._file.flush()
+            offset = self._file.tell()
+            sequence = self.sequence
+            self.pending = 0
+        return data, sequence, offset
+
+    def _compact_in_background(self, data, sequence, offset):
+        # Nobody waits for the background thread, so a failure is reported instead of raised
+        try:
+            self._write_compaction(data, sequence, offset)
+        except Exception as error:
+            diagnostics.report(Diagnostic(COMPACTION_FAILED, WARNING, "Unable to compact the journal " + self.path +
+                                          " into a new snapshot, the changes are kept in the journal: " + repr(error)))
+
+    def _write_compaction(self, data, sequence, offset):
+        try:
+            # The functions are ordered from the copy, so the model is not held while its graph is compiled
+            organ_infos = [dict(organ, name=name) for name, organ in data['organs'].items()]
+            order = list(compile_database(ModelDescription(data['parameters'], data['constants'], data['functions'],
+                                                           organ_infos)).nodes)
+            # The snapshot and its name are on disk when write_snapshot returns, only then is the journal shortened
+            write_snapshot(data, self.snapshot_path, order, sequence)
+        except Exception:
+            # The captured changes are still only in the journal, so a later change starts the compaction again
+            with self._lock:
+                self.pending += sequence - self.snapshot_sequence
+            raise
+        # The changes recorded while the snapshot was written are kept, the journal is replaced with an atomic rename
+        with self._lock:
+            self._file.flush()
+            with open(self.path, 'rb') as file:
+                file.seek(offset)
+                remaining = file.read()
+            temporary = self.path + '.tmp'
+            with open(temporary, 'wb') as file:
+                file.write(remaining)
+                file.flush()
+                os.fsync(file.fileno())
+            self._file.close()
+            try:
+                os.replace(temporary, self.path)
+                sync_directory(self.path)
+            finally:
+                # The snapshot contains the changes, so the journal is usable even if it could not be shortened
+                self._file = open(self.path, 'ab')
+                self.snapshot_sequence = sequence
+
+    def close(self):
+        self.wait()
+        self.sync()
+        self._file.close()
+
+
+def open_journal(model, snapshot_path, compact_after=COMPACT_AFTER):
+    """ Replays the journal of a snapshot onto the model which was built from it, and attaches the journal to the model
+        so that its further changes are recorded."""
+    journal = ChangeJournal(snapshot_path, model, compact_after)
+    journal.replay()
+    model.set_journal(journal)
+    return journal
+
+
+def start_journal(model, snapshot_path, compact_after=COMPACT_AFTER):
+    """ Saves the model as a new snapshot with an empty journal, and attaches the journal to the model."""
+    dump_snapshot(model, snapshot_path)
+    if os.path.exists(snapshot_path + JOURNAL_SUFFIX):
+        os.remove(snapshot_path + JOURNAL_SUFFIX)
+    journal = ChangeJournal(snapshot_path, model, compact_after)
+    model.set_journal(journal)
+    return journal
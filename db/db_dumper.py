@@ -5,8 +5,26 @@ import os
 
 from tinydb import TinyDB
 
+from ceteris_paribus.db.change_journal import start_journal
+from ceteris_paribus.db.snapshot import is_snapshot_path
+from ceteris_paribus.db.sqlite_database import is_sqlite_path, save_to_sqlite
+
 def dump_model(model, target = os.getcwd() + "/db/" +  "new_organ_db"):
-    """Serialize a model as a JSON file in such a way that it can be reopened at any moment for later use."""
+    """Serialize a model as a JSON file in such a way that it can be reopened at any moment for later use. A target
+       which is a SQLite database, or a new file with a SQLite suffix such as .sqlite, is saved as a SQLite database
+       instead, where only the changed rows are written, and a target with the .cpsnap suffix is saved as a binary
+       snapshot. The edits of a model saved as a snapshot are recorded in its journal from then on, so saving it again
+       only flushes the journal."""
+    if is_snapshot_path(target):
+        journal = model.get_journal()
+        if journal is not None and os.path.abspath(journal.snapshot_path) == os.path.abspath(target):
+            journal.sync()
+        else:
+            start_journal(model, target)
+        return
+    if is_sqlite_path(target):
+        save_to_sqlite(model, target)
+        return
     # Create the db for dumping
     try:
         target_db = TinyDB(target + ".json")
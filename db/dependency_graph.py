@@ -0,0 +1,93 @@
+""" This module contains the generic parts of the dependency graph used to evaluate functions. Every function is
+    evaluated exactly once, in an order where all of its inputs have been computed before it. Functions which cannot be
+    evaluated are reported as UnresolvedFunction records instead of stopping the program."""
+from collections import namedtuple
+
+# The reasons for which a function could not be resolved
+UNDEFINED = 'undefined'  # the function uses names which are not defined anywhere
+CYCLE = 'cycle'  # the function is part of a cycle of functions depending on each other
+DEPENDENCY = 'dependency'  # the function depends on another function which could not be resolved
+INVALID = 'invalid'  # the function is not an allowed expression, or its evaluation failed
+
+UnresolvedFunction = namedtuple('UnresolvedFunction', ['name', 'expression', 'reason', 'names'])
+UnresolvedFunction.__doc__ = """ Describes a function which could not be evaluated. The names field contains the
+    undefined names, or the other functions involved in the cycle or failed dependency."""
+
+
+class UnresolvableFunctionsError(Exception):
+    """ Raised when a set of functions cannot be fully evaluated. The errors attribute holds the UnresolvedFunction
+        records and the results attribute holds everything which could be computed."""
+
+    def __init__(self, errors, results=None):
+        super().__init__(describe_unresolved(errors))
+        self.errors = errors
+        self.results = results if results is not None else {}
+
+
+def describe_unresolved(errors):
+    """ Creates a human readable description of a list of UnresolvedFunction records."""
+    lines = []
+    for error in errors:
+        line = str(error.name) + ": " + str(error.expression)
+        if error.reason == UNDEFINED:
+            line += " (undefined: " + ", ".join(error.names) + ")"
+        elif error.reason == CYCLE:
+            line += " (cycle with: " + ", ".join(error.names) + ")"
+        elif error.reason == DEPENDENCY:
+            line += " (depends on unresolved: " + ", ".join(error.names) + ")"
+        else:
+            line += " (invalid expression)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def topological_order(dependencies):
+    """ Orders the keys of the dependencies dict such that every key comes after all keys it depends on.
+        :param dependencies: a dict mapping each key to the set of keys it depends on. Keys which are not in the dict
+            themselves are ignored.
+        :return: a tuple of the ordered keys and a dict containing the keys which could not be ordered because they are
+            part of, or depend on, a cycle. The latter maps each such key to its unordered dependencies.
+    """
+    dependents = {key: [] for key in dependencies}
+    remaining = {}
+    for key, required in dependencies.items():
+        required = [dep for dep in required if dep in dependencies]
+        remaining[key] = len(required)
+        for dep in required:
+            dependents[dep].append(key)
+
+    # Kahn's algorithm, the ready list is kept in insertion order so that the result is deterministic
+    order = [key for key in dependencies if remaining[key] == 0]
+    index = 0
+    while index < len(order):
+        for dependent in dependents[order[index]]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                order.append(dependent)
+        index += 1
+
+    unordered = {}
+    if len(order) < len(dependencies):
+        ordered = set(order)
+        for key in dependencies:
+            if key not in ordered:
+                unordered[key] = {dep for dep in dependencies[key] if dep in dependencies and dep not in ordered}
+    return order, unordered
+
+
+def split_cycles(unordered):
+    """ Returns the keys in the result of topological_order which are actually part of a cycle, the other keys merely
+        depend on one. Keys which nothing else depends on are stripped repeatedly, what remains are the cycles.
+    """
+    cyclic = {key: set(deps) for key, deps in unordered.items()}
+    stripped = True
+    while stripped:
+        stripped = False
+        required = set()
+        for deps in cyclic.values():
+            required.update(deps)
+        for key in list(cyclic):
+            if key not in required:
+                cyclic.pop(key)
+                stripped = True
+    return set(cyclic)
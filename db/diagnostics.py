@@ -0,0 +1,104 @@
+""" This module contains the diagnostics which are raised while a model is built, changed and evaluated, such as a
+    division by zero or functions which cannot be evaluated. The model and the evaluators never talk to the user
+    themselves, they pass every Diagnostic to the shared reporter. The GUI subscribes to the reporter to show dialogs,
+    while programs without a GUI can collect the diagnostics or ignore them, so that nothing ever waits for a user."""
+
+# The severity of a diagnostic
+WARNING = 'warning'
+ERROR = 'error'
+
+# The kinds of diagnostics
+DIVISION_BY_ZERO = 'division by zero'  # a function divided by zero, its value was set to 0
+UNRESOLVED = 'unresolved'  # functions could not be evaluated, the errors attribute holds the UnresolvedFunction records
+INVALID_NAME = 'invalid name'  # values with a name which is not an identifier were left out of the model
+DUPLICATE_NAME = 'duplicate name'  # a value or function which is added already exists
+NOT_FOUND = 'not found'  # a value or function which is removed does not exist
+INVALID_FUNCTION = 'invalid function'  # a function which is added cannot be evaluated in the model
+INVALID_CHANGE = 'invalid change'  # a change recorded in a journal cannot be applied to the model, it was skipped
+EVALUATION_FAILED = 'evaluation failed'  # the outputs of the model could not be evaluated on a worker thread
+COMPACTION_FAILED = 'compaction failed'  # the model could not be written to a new snapshot, the journal is kept
+
+
+class Diagnostic(object):
+    """ A single message from the model, together with the data it is about."""
+
+    def __init__(self, kind, severity, message, name=None, organ_name=None, errors=()):
+        """
+        :param kind: one of the kinds of diagnostics, such as DIVISION_BY_ZERO
+        :param severity: WARNING or ERROR
+        :param message: a human readable description
+        :param name: the name of the function or value the diagnostic is about, if any
+        :param organ_name: the name of the organ of that function or value, if any
+        :param errors: the UnresolvedFunction records of an UNRESOLVED diagnostic
+        """
+        self.kind = kind
+        self.severity = severity
+        self.message = message
+        self.name = name
+        self.organ_name = organ_name
+        self.errors = tuple(errors)
+
+    def __repr__(self):
+        return "Diagnostic(" + repr(self.kind) + ", " + repr(self.message) + ")"
+
+
+class DiagnosticsReporter(object):
+    """ Passes the diagnostics to the subscribed handlers. A handler is called with every Diagnostic, a diagnostic
+        without any handler is dropped. A single confirm handler answers the questions of the model, such as whether an
+        existing value should be overwritten."""
+
+    def __init__(self):
+        self._handlers = []
+        self._confirm_handler = None
+
+    def subscribe(self, handler):
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def unsubscribe(self, handler):
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def set_confirm_handler(self, handler):
+        """ Sets the function which is called with a Diagnostic and returns whether to go ahead, or None to remove it."""
+        self._confirm_handler = handler
+
+    def report(self, diagnostic):
+        for handler in list(self._handlers):
+            handler(diagnostic)
+
+    def confirm(self, diagnostic, default=False):
+        """ Asks whether the action described by the diagnostic should go ahead.
+            :return: the answer of the confirm handler, or the default if there is none
+        """
+        if self._confirm_handler is None:
+            return default
+        return bool(self._confirm_handler(diagnostic))
+
+
+class DiagnosticsCollector(object):
+    """ A handler which stores the diagnostics it receives. It subscribes itself while used in a with statement."""
+
+    def __init__(self, reporter=None):
+        self.reporter = reporter if reporter is not None else diagnostics
+        self.diagnostics = []
+
+    def __call__(self, diagnostic):
+        self.diagnostics.append(diagnostic)
+
+    def __enter__(self):
+        self.reporter.subscribe(self)
+        return self
+
+    def __exit__(self, *args):
+        self.reporter.unsubscribe(self)
+
+    def get_kinds(self):
+        return [diagnostic.kind for diagnostic in self.diagnostics]
+
+    def clear(self):
+        self.diagnostics = []
+
+
+# The reporter is shared by every model and evaluator in the program
+diagnostics = DiagnosticsReporter()
@@ -0,0 +1,144 @@
+""" This module contains a persistent store of compiled expressions, which lets a new process skip parsing, validating
+    and compiling the expressions it has seen before. The store is a directory in which every expression has a file,
+    named after a hash of the expression text and of the interpreter which compiled it, as code objects can only be
+    loaded by the interpreter version which created them. A file holds the marshalled code objects together with the
+    names and accessors found in the expression.
+
+    The code objects are run without being validated again, so the store must only hold entries written by the user.
+    The directory is private to the user, and every entry is signed with an HMAC. The key of the HMAC is kept outside
+    the directory, so an entry which was written by anyone without the key is treated as missing.
+"""
+import hashlib
+import hmac
+import importlib.util
+import marshal
+import os
+import stat
+import sys
+import tempfile
+
+# Changing the validation or the compilation of expressions requires a new format, so that old entries are not used
+FORMAT_VERSION = 2
+CACHE_TAG = (str(sys.implementation.cache_tag) + "-" + importlib.util.MAGIC_NUMBER.hex() + "-" +
+             str(FORMAT_VERSION))
+# The size in bytes of the key with which the entries are signed, and of the signature in front of every entry
+KEY_SIZE = 32
+SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+
+class ExpressionStoreError(Exception):
+    """ Raised when a directory or a key cannot be used for an ExpressionStore."""
+
+
+def make_key(expression):
+    """ Returns the name of the file in which an expression is stored."""
+    return hashlib.sha256((CACHE_TAG + "\0" + expression).encode('utf-8')).hexdigest()
+
+
+def get_default_key_path():
+    """ Returns the file holding the key with which the entries are signed, in the configuration of the user."""
+    config = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config, 'ceteris_paribus', 'expression_store.key')
+
+
+def _check_private(path, forbidden):
+    # Refuses a file or directory which belongs to another user, or whose mode has any of the forbidden bits
+    if not hasattr(os, 'getuid'):
+        return
+    status = os.stat(path)
+    if status.st_uid != os.getuid():
+        raise ExpressionStoreError(str(path) + " belongs to another user")
+    if status.st_mode & forbidden:
+        raise ExpressionStoreError(str(path) + " can be accessed by other users")
+
+
+def _load_signing_key(path):
+    # Reads the key, or creates it if it does not exist yet
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(os.urandom(KEY_SIZE))
+    _check_private(path, stat.S_IRWXG | stat.S_IRWXO)
+    with open(path, 'rb') as file:
+        key = file.read()
+    if len(key) != KEY_SIZE:
+        raise ExpressionStoreError("The key " + str(path) + " is damaged")
+    return key
+
+
+class ExpressionStore(object):
+    """ A directory of compiled expressions, which may be shared by any number of processes of the same user."""
+
+    def __init__(self, directory, key_path=None):
+        """
+        :param directory: the directory of the store, it is created if it does not exist. A directory which belongs to
+            another user, or in which other users can write, is refused.
+        :param key_path: the file holding the key with which the entries are signed, it must be outside the directory.
+            By default, the key is kept in the configuration directory of the user.
+        :raises ExpressionStoreError: if the directory or the key cannot be used
+        """
+        self.directory = directory
+        key_path = key_path if key_path is not None else get_default_key_path()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _check_private(directory, stat.S_IWGRP | stat.S_IWOTH)
+        directory, key_path = os.path.realpath(directory), os.path.realpath(key_path)
+        if os.path.commonpath([directory, key_path]) == directory:
+            raise ExpressionStoreError("The key " + key_path + " must be kept outside the directory of the store")
+        self._signing_key = _load_signing_key(key_path)
+
+    def _sign(self, data):
+        return hmac.new(self._signing_key, data, hashlib.sha256).digest()
+
+    def get_path(self, expression):
+        key = make_key(expression)
+        # The files are spread over subdirectories, so that no single directory becomes very large
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self, expression):
+        """ Returns the fields of the CompiledExpression stored for the expression, or None if it is not stored. An
+            entry which cannot be read, or whose signature does not match, is treated as missing."""
+        try:
+            with open(self.get_path(expression), 'rb') as file:
+                content = file.read()
+        except OSError:
+            return None
+        signature, data = content[:SIGNATURE_SIZE], content[SIGNATURE_SIZE:]
+        # The signature is checked before the entry is unmarshalled, so nothing from an unsigned file is ever loaded
+        if not hmac.compare_digest(signature, self._sign(data)):
+            return None
+        try:
+            entry = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(entry, tuple) or len(entry) != 9 or entry[0] != CACHE_TAG or entry[1] != expression:
+            return None
+        code, accessed, accessors, opaque_names, array_safe, direct_code, accessor_names = entry[2:]
+        return code, accessed, accessors, opaque_names, array_safe, direct_code, dict(accessor_names)
+
+    def save(self, expression, compiled):
+        """ Stores a CompiledExpression. The file is written under a temporary name and then renamed, so that other
+            processes never read a partly written entry."""
+        path = self.get_path(expression)
+        entry = (CACHE_TAG, expression, compiled.code, dict(compiled.accessed), tuple(sorted(compiled.accessors)),
+                 tuple(sorted(compiled.opaque_names)), compiled.array_safe, compiled.direct_code,
+                 tuple(sorted(compiled.accessor_names.items())))
+        data = marshal.dumps(entry)
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(self._sign(data) + data)
+            os.replace(temporary, path)
+        except OSError:
+            # The store only saves time, an expression which cannot be stored is compiled again next time
+            pass
+
+    def clear(self):
+        """ Removes all stored expressions."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                os.remove(os.path.join(root, name))
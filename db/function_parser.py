@@ -1,6 +1,10 @@
 import ast
+import threading
+from collections import OrderedDict
 
-from PyQt5.QtWidgets import QMessageBox
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, topological_order, split_cycles, \
+    describe_unresolved, UNDEFINED, CYCLE, DEPENDENCY, INVALID
+from ceteris_paribus.db.diagnostics import diagnostics, Diagnostic, DIVISION_BY_ZERO, UNRESOLVED, ERROR
 
 
 class EvalWrapper(object):
@@ -25,29 +29,13 @@ class EvalWrapper(object):
         self.transformer.set_variables(self.variables)  # Create syntax tree transformer
         if self.function:
             try:
-                tree = ast.parse(self.function, mode='eval')
-                self.transformer.visit(tree)
-                clause = compile(tree, '<AST>', 'eval')
-                # make the globals contain only the Decimal class,
-                # and eval the compiled object
-                return eval(clause, self.variables)
-            except SyntaxError:
-                # On division by zero we will simply return 0 as an answer
+                # Parsing, validating and compiling happens only once per expression, after which the code object is
+                # served from the shared cache
+                compiled = expression_cache.get(self.function)
+                self.transformer.visit_compiled(compiled)
+            except (SyntaxError, NameError):
                 return None
-            except (NameError, TypeError):
-                return None
-            except ZeroDivisionError:
-                # On division by zero we will simply return 0 as an answer
-                msg = QMessageBox()
-                msg.setWindowTitle("Error")
-                self.variables.pop("__builtins__", None)
-                if self.organ_name is not None:
-                    message = " in " + self.organ_name
-                else:
-                    message = ""
-                msg.setText("Division by zero, we are setting the value of " + self.function_name + message + " to 0\n")
-                msg.exec_()
-                return 0
+            return evaluate_expression(compiled, self.variables, self.function_name, self.organ_name)
         else:
             raise NameError("Cannot evaluate: no function is defined")
 
@@ -75,8 +63,10 @@ class Transformer(ast.NodeTransformer):
         'Name',  # an identifier...
         'Load',  # loads a value of a variable with given identifier
         'Str',  # a string literal
-        'Power',  # a string literal
+        'Power',
+        'Pow',  # the node type of the power operator
         'Num',  # allow numbers too
+        'Constant',  # numbers and strings are both parsed as constants since Python 3.8
         'Subscript',
         'Attribute',
         'Index'
@@ -88,6 +78,11 @@ class Transformer(ast.NodeTransformer):
             raise SyntaxError("Invalid expression: %s not allowed" % nodetype)
         return ast.NodeTransformer.generic_visit(self, node)
 
+    def visit_compiled(self, compiled):
+        """ Called with a cached CompiledExpression before it is evaluated. The whitelist has already been enforced
+            when the expression was compiled, so the plain transformer has nothing left to check."""
+        pass
+
 
 class ModelTransformer(Transformer):
     """ Works as an extension of the regular Transformer. This transformer is only used by the model to keep track of
@@ -102,7 +97,8 @@ class ModelTransformer(Transformer):
     def visit_Name(self, node):
         self.visited[node.id] = ""
         self.current_node = node.id
-        if node.id not in self.variables.keys():
+        # When compiling for the cache there are no variables yet, the names are only checked on evaluation
+        if self.variables is not None and node.id not in self.variables.keys():
             raise NameError
         return self.generic_visit(node)
 
@@ -110,46 +106,282 @@ class ModelTransformer(Transformer):
         self.visited[self.current_node] = node.s
         return self.generic_visit(node)
 
+    def visit_Constant(self, node):
+        # Since Python 3.8 string literals are no longer visited as Str nodes
+        if isinstance(node.value, str):
+            self.visited[self.current_node] = node.value
+        return self.generic_visit(node)
+
+    def visit_compiled(self, compiled):
+        # The visited values are taken from the cache, but every name must still be defined in the current variables
+        self.visited = dict(compiled.accessed)
+        for name in compiled.names:
+            if name not in self.variables:
+                raise NameError(name)
+
+
+class CompiledExpression(object):
+    """ An expression which has been parsed, checked against the whitelist of the Transformer and compiled. Instances
+        are shared through the expression cache and must therefore not be modified."""
 
-def evaluate_functions(functions, variables, prerequisites=None):
+    def __init__(self, code, accessed, accessors=frozenset(), opaque_names=None, array_safe=False, direct_code=None,
+                 accessor_names=None):
+        self.code = code
+        # Maps every name in the expression to the string subscript following it, or "" if there is none
+        self.accessed = accessed
+        self.names = frozenset(accessed)
+        # Accessors are the (name, method, key) triples of all terms of the form Heart.get_local_vals()['VO2']
+        self.accessors = frozenset(accessors)
+        # The opaque names are those names which are used in any other way than through an accessor
+        self.opaque_names = self.names if opaque_names is None else frozenset(opaque_names)
+        # An expression is array safe if it can be evaluated with NumPy arrays in place of numbers
+        self.array_safe = array_safe
+        # The same expression in which every accessor is replaced by a plain name, so that the value can be looked up
+        # directly instead of calling the organ. The accessor_names map the accessors to the names which replace them.
+        self.direct_code = direct_code
+        self.accessor_names = accessor_names or {}
+
+
+def _subscript_key(node):
+    # Returns the string used as a subscript, or None if the subscript is anything other than a string literal
+    key = node.slice
+    if type(key).__name__ == 'Index':
+        # Before Python 3.9 the subscript is wrapped in an Index node
+        key = key.value
+    if type(key).__name__ == 'Str':
+        return key.s
+    if isinstance(key, ast.Constant) and isinstance(key.value, str):
+        return key.value
+    return None
+
+
+def find_accessors(tree):
+    """ Finds all terms of the form Name.method()['key'] in a syntax tree.
+        :return: the set of (name, method, key) triples and the set of names which also occur outside of such a term
     """
-    This function calculates the global outputs of the model
-    :return: a dictionary containing the names of the outputs and their calculated values.
+    accessors = set()
+    wrapped = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Call):
+            call = node.value
+            key = _subscript_key(node)
+            if key is not None and not call.args and not call.keywords and isinstance(call.func, ast.Attribute) \
+                    and isinstance(call.func.value, ast.Name):
+                accessors.add((call.func.value.id, call.func.attr, key))
+                wrapped.add(id(call.func.value))
+    opaque_names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in wrapped}
+    return accessors, opaque_names
+
+
+class AccessorRewriter(ast.NodeTransformer):
+    """ Replaces every term of the form Name.method()['key'] by a plain name, which is bound to the value of the term
+        when the expression is evaluated."""
+
+    def __init__(self, names=()):
+        self.accessor_names = {}
+        # The names already used in the expression, which must not be reused for the accessors
+        self.names = set(names)
+
+    def visit_Subscript(self, node):
+        call = node.value
+        key = _subscript_key(node)
+        if isinstance(call, ast.Call) and key is not None and not call.args and not call.keywords \
+                and isinstance(call.func, ast.Attribute) and isinstance(call.func.value, ast.Name):
+            accessor = (call.func.value.id, call.func.attr, key)
+            if accessor not in self.accessor_names:
+                name = '__accessor' + str(len(self.accessor_names))
+                while name in self.names:
+                    name += '_'
+                self.accessor_names[accessor] = name
+            return ast.copy_location(ast.Name(id=self.accessor_names[accessor], ctx=ast.Load()), node)
+        return self.generic_visit(node)
+
+
+def is_array_safe(tree):
+    """ Checks whether a syntax tree only consists of arithmetic and the accessors of organs, in which case it gives the
+        same results when evaluated with NumPy arrays in place of numbers."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if node.args or node.keywords or not isinstance(node.func, ast.Attribute) \
+                    or not isinstance(node.func.value, ast.Name):
+                return False
+    return True
+
+
+def compile_expression(expression):
+    """ Parses, validates and compiles a single expression. Raises SyntaxError if the expression is not allowed."""
+    tree = ast.parse(expression, mode='eval')
+    transformer = ModelTransformer(None)
+    transformer.visit(tree)
+    accessors, opaque_names = find_accessors(tree)
+    code = compile(tree, '<AST>', 'eval')
+    array_safe = is_array_safe(tree)
+    direct_code = None
+    rewriter = AccessorRewriter(transformer.visited)
+    if accessors:
+        # The tree is rewritten in place, after everything else has been taken from it
+        direct_code = compile(ast.fix_missing_locations(rewriter.visit(tree)), '<AST>', 'eval')
+    return CompiledExpression(code, transformer.visited, accessors, opaque_names, array_safe, direct_code,
+                              rewriter.accessor_names)
+
+
+class ExpressionCache(object):
+    """ A bounded cache of compiled expressions keyed by their text. The least recently used expression is evicted once
+        the cache is full. With an ExpressionStore, the expressions which are not in memory are looked up on disk
+        before they are compiled, and the compiled expressions are kept for later processes."""
+
+    def __init__(self, max_size=4096, store=None):
+        self.max_size = max_size
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        # The misses which were answered by the store
+        self.store_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_store(self, store):
+        """ Sets the ExpressionStore in which the compiled expressions are kept, or None to only keep them in memory."""
+        self.store = store
+
+    def get(self, expression):
+        """ Returns the CompiledExpression for the given text, compiling it on a miss."""
+        with self._lock:
+            compiled = self._entries.get(expression)
+            if compiled is not None:
+                self.hits += 1
+                self._entries.move_to_end(expression)
+                return compiled
+            self.misses += 1
+        store = self.store
+        fields = store.load(expression) if store is not None else None
+        if fields is not None:
+            compiled = CompiledExpression(*fields)
+            with self._lock:
+                self.store_hits += 1
+        else:
+            # Compilation happens outside of the lock, invalid expressions raise and are never stored
+            compiled = compile_expression(expression)
+            if store is not None:
+                store.save(expression, compiled)
+        with self._lock:
+            self._entries[expression] = compiled
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.store_hits = 0
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'store_hits': self.store_hits, 'size': len(self._entries),
+                'max_size': self.max_size}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, expression):
+        return expression in self._entries
+
+
+# The cache is shared by every evaluator in the program
+expression_cache = ExpressionCache()
+
+
+def evaluate_expression(compiled, variables, function_name=None, organ_name=None, code=None):
+    """ Evaluates a compiled expression using the given variables.
+        :param code: if given, this code object is evaluated in place of the code of the expression
+        :return: the value of the expression, or None if it could not be evaluated
+    """
+    try:
+        return eval(compiled.code if code is None else code, variables)
+    except (NameError, TypeError, KeyError, AttributeError):
+        return None
+    except ZeroDivisionError:
+        # On division by zero we will simply return 0 as an answer
+        variables.pop("__builtins__", None)
+        report_division_by_zero(function_name, organ_name)
+        return 0
+
+
+def report_division_by_zero(function_name, organ_name=None):
+    """ Reports that a function divided by zero and its value was set to 0."""
+    if organ_name is not None:
+        message = " in " + organ_name
+    else:
+        message = ""
+    diagnostics.report(Diagnostic(DIVISION_BY_ZERO, ERROR, "Division by zero, we are setting the value of " +
+                                  str(function_name) + message + " to 0\n", function_name, organ_name))
+
+
+def report_unresolved(errors):
+    """ Reports which functions could not be evaluated."""
+    diagnostics.report(Diagnostic(UNRESOLVED, ERROR, "The model cannot be fully evaluated,\nplease look at the "
+                                  "following unresolvable functions: \n" + describe_unresolved(errors), errors=errors))
+
+
+def evaluate_functions(functions, variables, prerequisites=None, errors=None):
+    """
+    This function evaluates a set of functions which may depend on each other. The names used by each function are
+    known from its compiled expression, so a dependency graph is built first and every function is evaluated exactly
+    once, in topological order.
+    :param functions: a dict containing the names of the functions and their expressions
+    :param variables: a dict containing the values available to the functions, the results are added to it
+    :param prerequisites: if given, the names and subscripts accessed by each function are stored in this dict
+    :param errors: if given, the functions which could not be evaluated are appended to this list as
+        UnresolvedFunction records. Otherwise they are reported as a diagnostic.
+    :return: a dictionary containing the names of the functions and their calculated values.
     """
-    # Make a shallow copy of the global function dict, so that we can freely modify it
-    changed = True
     output = {}
+    unresolved = []
+    compiled_functions = {}
+    dependencies = {}
+
+    for function_name, function in functions.items():
+        try:
+            compiled = expression_cache.get(function)
+        except SyntaxError:
+            unresolved.append(UnresolvedFunction(function_name, function, INVALID, ()))
+            continue
+        if prerequisites is not None:
+            # We are also supposed to store the required values as a side effect
+            prerequisites[function_name] = dict(compiled.accessed)
+        undefined = sorted(name for name in compiled.names if name not in variables and name not in functions)
+        if undefined:
+            unresolved.append(UnresolvedFunction(function_name, function, UNDEFINED, tuple(undefined)))
+            continue
+        compiled_functions[function_name] = compiled
+        # A function which uses its own name refers to the value which was defined before it was evaluated
+        dependencies[function_name] = {name for name in compiled.names
+                                       if name in functions and not (name == function_name and name in variables)}
+
+    order, unordered = topological_order(dependencies)
+    cyclic = split_cycles(unordered)
+    for function_name in unordered:
+        reason = CYCLE if function_name in cyclic else DEPENDENCY
+        unresolved.append(UnresolvedFunction(function_name, functions[function_name], reason,
+                                             tuple(sorted(unordered[function_name]))))
 
-    while changed:
-        changed = False
-        for function_name in list(functions):
-            # For every unresolved functions, we create an evaluator object
-
-            evaluator = EvalWrapper(variables, ModelTransformer(variables))
-            new_func = functions[function_name]
-            evaluator.set_function(new_func)
-            evaluator.set_function_name(function_name)
-            # The result of the evaluation is stored in the result variable if it exists
-            result = evaluator.evaluate()
-            if prerequisites is not None:
-                # We are also supposed to store the required values as a side effect
-                required_vals = evaluator.transformer.visited
-                prerequisites[function_name] = required_vals
-
-            if result is not None:
-                # We have found a new result, therefore, we set changed to True and we store the result
-                changed = True
-                variables[function_name] = result
-                output[function_name] = result
-                # Finally, we remove the function we just resolved from the globals so that we don't loop infinitely
-                functions.pop(function_name)
-    if functions:
-        msg = QMessageBox()
-        msg.setWindowTitle("Error")
-        unresolved_string = {str(x) + ": " + functions[x] + "\n" for x in functions.keys()}
-        msg.setText(
-            "The specified database cannot create the model,\nplease look at the following unresolvable functions: \n" + "".join(
-                unresolved_string))
-        msg.exec_()
-        quit(-1)
+    for function_name in order:
+        missing = sorted(name for name in dependencies[function_name] if name not in output)
+        if missing:
+            # One of the functions this function depends on could not be evaluated
+            unresolved.append(UnresolvedFunction(function_name, functions[function_name], DEPENDENCY, tuple(missing)))
+            continue
+        result = evaluate_expression(compiled_functions[function_name], variables, function_name)
+        if result is None:
+            unresolved.append(UnresolvedFunction(function_name, functions[function_name], INVALID, ()))
+            continue
+        variables[function_name] = result
+        output[function_name] = result
+
+    if unresolved:
+        if errors is None:
+            report_unresolved(unresolved)
+        else:
+            errors.extend(unresolved)
     return output
@@ -0,0 +1,16 @@
+""" This module contains the kinds of changes a GlobalModel reports for its edits. The changes are recorded in the
+    journal of a snapshot, and followed by a SQLite database to know which rows to write when the model is saved.
+"""
+
+# The kinds of changes, every change is a dict with an 'op' and the fields listed here
+SET_INPUT = 'set_input'                 # key, value
+ADD_PARAMETER = 'add_parameter'         # name, range
+REMOVE_PARAMETER = 'remove_parameter'   # name
+ADD_CONSTANT = 'add_constant'           # name, value
+ADD_FUNCTION = 'add_function'           # name, expression
+REMOVE_FUNCTION = 'remove_function'     # name
+ADD_ORGAN = 'add_organ'                 # organ_info, pos
+REMOVE_ORGAN = 'remove_organ'           # name
+MOVE_ORGAN = 'move_organ'               # name, pos
+UPDATE_ORGAN = 'update_organ'           # name, variables, functions
+RENAME_ORGAN = 'rename_organ'           # name, new_name
@@ -0,0 +1,228 @@
+""" This module loads a model from a database file in a single pass. The file is parsed once into a ModelDescription,
+    and the whole schema is validated while doing so: every parameter and variable must have a [min, max, value] range,
+    names must be identifiers and every function must be a valid expression. The description offers the same tables()
+    and table(name).all() as TinyDB, so the GlobalModel and the CompiledModel are built from it without reading the file
+    again.
+"""
+import json
+import numbers
+import sqlite3
+
+from ceteris_paribus.db.diagnostics import diagnostics, Diagnostic, WARNING, INVALID_NAME, INVALID_FUNCTION
+from ceteris_paribus.db.function_parser import expression_cache
+from ceteris_paribus.db.sqlite_database import SQLiteDatabase, is_sqlite_path, MODEL_TABLES
+
+
+class ModelLoadError(Exception):
+    """ Raised when a file does not contain a valid model. The problems attribute lists everything which is wrong with
+        it, not only the first problem."""
+
+    def __init__(self, problems):
+        super().__init__("\n".join(problems))
+        self.problems = list(problems)
+
+
+class _DocumentTable(object):
+    # A table of a ModelDescription, with the documents of the corresponding TinyDB table
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def all(self):
+        return [dict(document) for document in self.documents]
+
+    def __len__(self):
+        return len(self.documents)
+
+
+class ModelDescription(object):
+    """ A validated model, held in memory. Values with an invalid name have been left out, and functions with an invalid
+        expression are kept so that they can be corrected, both are listed in the warnings."""
+
+    def __init__(self, params, constants, functions, organ_infos, warnings=()):
+        """
+        :param params: a dict mapping the global parameters to their [min, max, val] lists
+        :param constants: a dict mapping the global constants to their values
+        :param functions: a dict mapping the global functions to their expressions
+        :param organ_infos: a list of organ_info dicts with the 'name', 'variables' and 'functions' of every organ
+        :param warnings: the Diagnostics found while validating the model
+        """
+        self.params = params
+        self.constants = constants
+        self.functions = functions
+        self.organ_infos = organ_infos
+        self.warnings = list(warnings)
+
+    def tables(self):
+        return set(MODEL_TABLES)
+
+    def table(self, name):
+        # Every global value is a document of its own, as the GlobalModel expects from the files it reads
+        if name == 'GlobalParameters':
+            return _DocumentTable([{key: value} for key, value in self.params.items()])
+        if name == 'GlobalConstants':
+            return _DocumentTable([{key: value} for key, value in self.constants.items()])
+        if name == 'GlobalFunctions':
+            return _DocumentTable([{key: value} for key, value in self.functions.items()])
+        if name == 'SystemicOrgans':
+            return _DocumentTable(self.organ_infos)
+        raise KeyError("Unknown table: " + str(name))
+
+
+def read_tables(path):
+    """ Reads the documents of all tables in a TinyDB or SQLite database file, parsing the file a single time.
+        :return: a dict mapping the table names to lists of documents, in the order in which they were stored
+    """
+    try:
+        if is_sqlite_path(path):
+            db = SQLiteDatabase(path, read_only=True)
+            try:
+                return {name: db.table(name).all() for name in db.tables()}
+            finally:
+                db.close()
+        with open(path) as file:
+            content = json.load(file)
+    except (OSError, ValueError, sqlite3.Error) as error:
+        raise ModelLoadError(["The file " + str(path) + " cannot be read: " + str(error)])
+    if not isinstance(content, dict) or not all(isinstance(table, dict) for table in content.values()):
+        raise ModelLoadError(["The file " + str(path) + " is not a TinyDB database"])
+    # TinyDB numbers its documents from 1, in the order in which they were inserted
+    return {name: [document for _, document in sorted(table.items(), key=lambda item: _document_order(item[0]))]
+            for name, table in content.items()}
+
+
+def _document_order(document_id):
+    try:
+        return int(document_id), ''
+    except ValueError:
+        return 0, document_id
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _check_range(description, value, problems):
+    # A range is a [min, max, value] list of numbers with min <= max
+    if not isinstance(value, list) or len(value) != 3 or not all(_is_number(item) for item in value):
+        problems.append(description + " does not define a [min, max, value] range")
+        return False
+    if value[0] > value[1]:
+        problems.append(description + " has a minimum larger than its maximum")
+        return False
+    return True
+
+
+def _check_expression(description, expression, problems, warnings, name, organ_name=None):
+    # Only a function which is not text makes the model invalid, a function which cannot be parsed is kept, as it can be
+    # corrected in the editor. The expressions are compiled into the shared cache, ready for the first evaluation.
+    if not isinstance(expression, str):
+        problems.append(description + " is not text")
+        return False
+    try:
+        expression_cache.get(expression)
+    except (SyntaxError, ValueError):
+        warnings.append(Diagnostic(INVALID_FUNCTION, WARNING, description + " is not a valid expression: " + expression,
+                                   name, organ_name))
+    return True
+
+
+def validate_tables(tables):
+    """
+    Validates the documents of a model database and collects them into a ModelDescription.
+    :param tables: a dict mapping table names to lists of documents, as returned by read_tables
+    :return: a ModelDescription
+    :raises ModelLoadError: with every problem which makes the model invalid
+    """
+    missing = [name for name in MODEL_TABLES if name not in tables]
+    if missing:
+        raise ModelLoadError(["Not all required tables are present, missing: " + ", ".join(missing)])
+    problems = []
+    warnings = []
+    invalid_names = []
+
+    params = {}
+    for document in tables['GlobalParameters']:
+        for name, value in document.items():
+            if not name.isidentifier():
+                invalid_names.append(name)
+            elif _check_range("The global parameter " + name, value, problems):
+                params[name] = value
+    constants = {}
+    for document in tables['GlobalConstants']:
+        for name, value in document.items():
+            if not name.isidentifier():
+                invalid_names.append(name)
+            elif not _is_number(value):
+                problems.append("The global constant " + name + " is not a number")
+            else:
+                constants[name] = value
+    functions = {}
+    for document in tables['GlobalFunctions']:
+        for name, expression in document.items():
+            if not name.isidentifier():
+                invalid_names.append(name)
+            elif _check_expression("The global function " + name, expression, problems, warnings, name):
+                functions[name] = expression
+
+    organ_infos = []
+    organ_names = set()
+    for document in tables['SystemicOrgans']:
+        organ_name = document.get('name') if isinstance(document, dict) else None
+        if not isinstance(organ_name, str) or not organ_name:
+            problems.append("An organ does not have a name")
+            continue
+        if organ_name in organ_names:
+            problems.append("The organ " + organ_name + " is defined more than once")
+            continue
+        organ_names.add(organ_name)
+        variables = document.get('variables', {})
+        organ_functions = document.get('functions', {})
+        if not isinstance(variables, dict) or not isinstance(organ_functions, dict):
+            problems.append("The variables and functions of the organ " + organ_name + " are not tables")
+            continue
+        organ_info = dict(document, variables={}, functions={})
+        for name, value in variables.items():
+            if name == '__builtins__':
+                continue
+            if not name.isidentifier():
+                invalid_names.append(organ_name + "." + name)
+            elif _check_range("The variable " + name + " of " + organ_name, value, problems):
+                organ_info['variables'][name] = value
+        for name, expression in organ_functions.items():
+            if not name.isidentifier():
+                invalid_names.append(organ_name + "." + name)
+            elif _check_expression("The function " + name + " of " + organ_name, expression, problems, warnings, name,
+                                   organ_name):
+                organ_info['functions'][name] = expression
+        organ_infos.append(organ_info)
+
+    if problems:
+        raise ModelLoadError(problems)
+    if invalid_names:
+        warnings.insert(0, Diagnostic(INVALID_NAME, WARNING, "Warning: these values have an invalid name in the "
+                                      "database, they were not included in the model: " + ", ".join(invalid_names)))
+    return ModelDescription(params, constants, functions, organ_infos, warnings)
+
+
+def load_model_description(path, report=True):
+    """
+    Reads and validates a model database file in a single pass.
+    :param path: a TinyDB JSON file, a SQLite database or a snapshot
+    :param report: whether the warnings are passed to the diagnostics reporter
+    :return: a ModelDescription, or for a snapshot a Snapshot, from which a GlobalModel or a CompiledModel is built
+    :raises ModelLoadError: if the file cannot be read or does not contain a valid model
+    """
+    # Imported here, as the snapshot module builds on this one. A snapshot is written from a loaded model, so it is not
+    # validated again and its arrays are only decoded when the model is built.
+    from ceteris_paribus.db.snapshot import Snapshot, SnapshotError, is_snapshot_path
+    if is_snapshot_path(path):
+        try:
+            return Snapshot(path)
+        except (OSError, ValueError, SnapshotError) as error:
+            raise ModelLoadError(["The file " + str(path) + " cannot be read: " + str(error)])
+    description = validate_tables(read_tables(path))
+    if report:
+        for warning in description.warnings:
+            diagnostics.report(warning)
+    return description
@@ -0,0 +1,243 @@
+""" This module contains a binary snapshot format for models, for opening large projects quickly. All names and
+    expressions are interned in a single string table, the [min, max, value] ranges and the values are stored as packed
+    float64 arrays, and the order in which the functions are evaluated is stored with them. A snapshot is opened by
+    memory-mapping its arrays, the model is only decoded when it is built, and the organs of a model opened from a
+    snapshot are not evaluated until their values are requested.
+
+    A snapshot consists of the magic bytes, the length of a JSON header and the header itself, followed by the arrays.
+    The header gives the dtype, shape and offset of every array, and the sequence number of the last change of the
+    journal which is contained in the snapshot. Whether a number was an integer is stored as well, so
+    a model converted from the JSON format and back is written exactly as dump_model writes it.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+from tinydb import TinyDB
+
+from ceteris_paribus.db.model_loader import ModelDescription
+from ceteris_paribus.db.sqlite_database import get_database_data, get_model_data, write_json_data
+
+MAGIC = b'CPSNAP\x00\x01'
+SNAPSHOT_SUFFIX = '.cpsnap'
+# The arrays start at a multiple of this number of bytes, so that they can be mapped with their natural alignment
+ALIGNMENT = 8
+
+
+class SnapshotError(Exception):
+    """ Raised when a file is not a valid snapshot."""
+
+
+class _StringTable(object):
+    # Interns strings, every distinct string is stored once and referred to by its index
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, text):
+        if text not in self.index:
+            self.index[text] = len(self.strings)
+            self.strings.append(text)
+        return self.index[text]
+
+    def get_arrays(self):
+        encoded = [text.encode('utf-8') for text in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(item) for item in encoded])
+        return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _pack_numbers(values, width=None):
+    # Returns the numbers as float64 together with a mask of those which are integers
+    numbers = np.array(values, dtype=np.float64)
+    integers = np.array([[isinstance(value, int) for value in row] if width else isinstance(row, int)
+                         for row in values], dtype=np.uint8)
+    if width:
+        numbers = numbers.reshape(-1, width)
+        integers = integers.reshape(-1, width)
+    return numbers, integers
+
+
+def write_snapshot(data, path, order=(), journal_sequence=0):
+    """
+    Writes model data to a snapshot file.
+    :param data: the model data, as returned by get_model_data or get_database_data
+    :param path: the file to write, it is replaced as a whole once it has been written completely
+    :param order: the keys of the functions in the order in which they are evaluated
+    :param journal_sequence: the sequence number of the last change of the journal which is contained in the data
+    """
+    strings = _StringTable()
+    organs = data['organs']
+    arrays = {
+        'param_names': np.array([strings.add(name) for name in data['parameters']], dtype=np.int32),
+        'constant_names': np.array([strings.add(name) for name in data['constants']], dtype=np.int32),
+        'function_names': np.array([strings.add(name) for name in data['functions']], dtype=np.int32),
+        'function_expressions': np.array([strings.add(text) for text in data['functions'].values()], dtype=np.int32),
+        'organ_names': np.array([strings.add(name) for name in organs], dtype=np.int32),
+        'organ_positions': np.array([organ.get('pos') or [np.nan, np.nan] for organ in organs.values()],
+                                    dtype=np.float64).reshape(-1, 2),
+        'order': np.array([strings.add(key) for key in order], dtype=np.int32),
+    }
+    arrays['param_ranges'], arrays['param_integers'] = _pack_numbers(list(data['parameters'].values()), 3)
+    arrays['constant_values'], arrays['constant_integers'] = _pack_numbers(list(data['constants'].values()))
+    # The variables and functions of all organs are stored one after the other, the organ with index i owns the
+    # entries from start[i] up to start[i + 1]
+    variables = [(name, value) for organ in organs.values() for name, value in organ['variables'].items()]
+    functions = [(name, text) for organ in organs.values() for name, text in organ['functions'].items()]
+    arrays['variable_start'] = np.cumsum([0] + [len(organ['variables']) for organ in organs.values()], dtype=np.int64)
+    arrays['variable_names'] = np.array([strings.add(name) for name, _ in variables], dtype=np.int32)
+    arrays['variable_ranges'], arrays['variable_integers'] = _pack_numbers([value for _, value in variables], 3)
+    arrays['organ_function_start'] = np.cumsum([0] + [len(organ['functions']) for organ in organs.values()],
+                                               dtype=np.int64)
+    arrays['organ_function_names'] = np.array([strings.add(name) for name, _ in functions], dtype=np.int32)
+    arrays['organ_function_expressions'] = np.array([strings.add(text) for _, text in functions], dtype=np.int32)
+    arrays['string_offsets'], arrays['string_data'] = strings.get_arrays()
+
+    header = {'arrays': {}, 'journal_sequence': journal_sequence}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [offset, array.dtype.str, list(array.shape)]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8')
+    start = len(MAGIC) + 8 + len(header_bytes)
+    start += -start % ALIGNMENT
+
+    # The snapshot is written next to the target first, so an interrupted write never leaves a damaged file behind
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        file.write(b'\0' * (start - file.tell()))
+        for name, array in arrays.items():
+            file.seek(start + header['arrays'][name][0])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(start + offset)
+        # The data must be on disk before the rename, otherwise a crash may leave the new name pointing to lost data
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    sync_directory(path)
+
+
+def sync_directory(path):
+    """ Makes sure a file which was created or renamed is on disk under its name, by flushing the directory it is in.
+        Directories cannot be opened as files on all platforms, there the rename is left to the file system."""
+    if os.name != 'posix':
+        return
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class Snapshot(object):
+    """ A model opened from a snapshot file. The arrays are mapped into memory and the model is decoded on first use.
+        It offers the same tables() and table(name).all() as TinyDB."""
+
+    # The organs of a model built from a snapshot are evaluated when their values are first requested
+    defer_evaluation = True
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic = file.read(len(MAGIC))
+            if magic != MAGIC:
+                raise SnapshotError("The file " + str(path) + " is not a model snapshot")
+            header_length, = struct.unpack('<Q', file.read(8))
+            header = json.loads(file.read(header_length).decode('utf-8'))
+        start = len(MAGIC) + 8 + header_length
+        start += -start % ALIGNMENT
+        self.journal_sequence = header.get('journal_sequence', 0)
+        self.arrays = {}
+        for name, (offset, dtype, shape) in header['arrays'].items():
+            if int(np.prod(shape)) == 0:
+                self.arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                self.arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=start + offset, shape=tuple(shape))
+        self._strings = None
+        self._description = None
+
+    def get_string(self, index):
+        if self._strings is None:
+            offsets = self.arrays['string_offsets'].tolist()
+            data = bytes(self.arrays['string_data'])
+            self._strings = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+        return self._strings[index]
+
+    def get_dependency_order(self):
+        """ Returns the keys of the functions in the order in which they are evaluated, as stored with the model."""
+        return [self.get_string(index) for index in self.arrays['order'].tolist()]
+
+    def get_description(self):
+        """ Decodes the model into a ModelDescription, this happens once."""
+        if self._description is None:
+            self._description = ModelDescription(*self._decode())
+        return self._description
+
+    def _decode(self):
+        arrays = self.arrays
+        names = [self.get_string(index) for index in arrays['param_names'].tolist()]
+        params = dict(zip(names, _unpack_numbers(arrays['param_ranges'], arrays['param_integers'])))
+        names = [self.get_string(index) for index in arrays['constant_names'].tolist()]
+        constants = dict(zip(names, _unpack_numbers(arrays['constant_values'], arrays['constant_integers'])))
+        functions = {self.get_string(name): self.get_string(text) for name, text in
+                     zip(arrays['function_names'].tolist(), arrays['function_expressions'].tolist())}
+
+        variable_names = [self.get_string(index) for index in arrays['variable_names'].tolist()]
+        variable_ranges = _unpack_numbers(arrays['variable_ranges'], arrays['variable_integers'])
+        function_names = [self.get_string(index) for index in arrays['organ_function_names'].tolist()]
+        function_texts = [self.get_string(index) for index in arrays['organ_function_expressions'].tolist()]
+        variable_start = arrays['variable_start'].tolist()
+        function_start = arrays['organ_function_start'].tolist()
+        organ_infos = []
+        for index, (name, pos) in enumerate(zip(arrays['organ_names'].tolist(), arrays['organ_positions'].tolist())):
+            first, last = variable_start[index], variable_start[index + 1]
+            variables = dict(zip(variable_names[first:last], variable_ranges[first:last]))
+            first, last = function_start[index], function_start[index + 1]
+            organ_functions = dict(zip(function_names[first:last], function_texts[first:last]))
+            organ_info = {'name': self.get_string(name), 'variables': variables, 'functions': organ_functions}
+            if not np.isnan(pos).any():
+                organ_info['pos'] = pos
+            organ_infos.append(organ_info)
+        return params, constants, functions, organ_infos
+
+    def tables(self):
+        return self.get_description().tables()
+
+    def table(self, name):
+        return self.get_description().table(name)
+
+
+def _unpack_numbers(numbers, integers):
+    # The inverse of _pack_numbers, returns lists with the integers restored
+    if numbers.ndim == 1:
+        return [int(value) if integer else value for value, integer in zip(numbers.tolist(), integers.tolist())]
+    return [[int(value) if integer else value for value, integer in zip(row, mask)]
+            for row, mask in zip(numbers.tolist(), integers.tolist())]
+
+
+def is_snapshot_path(path):
+    return os.path.splitext(path)[1].lower() == SNAPSHOT_SUFFIX
+
+
+def dump_snapshot(model, path):
+    """ Writes a GlobalModel to a snapshot file, with the evaluation order of its functions."""
+    write_snapshot(get_model_data(model), path, list(model.get_compiled_model().nodes))
+
+
+def import_json(json_path, snapshot_path):
+    """ Converts a TinyDB JSON file into a snapshot."""
+    # Imported here, as the compiled model is only needed to find the evaluation order
+    from ceteris_paribus.model.compiled_model import compile_database
+    source = TinyDB(json_path, access_mode='r')
+    try:
+        write_snapshot(get_database_data(source), snapshot_path, list(compile_database(source).nodes))
+    finally:
+        source.close()
+
+
+def export_json(snapshot_path, json_path):
+    """ Converts a snapshot into a TinyDB JSON file, in the layout written by dump_model."""
+    write_json_data(get_database_data(Snapshot(snapshot_path)), json_path)
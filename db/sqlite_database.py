@@ -0,0 +1,371 @@
+""" This module contains a storage backend which keeps a model in a SQLite database instead of a TinyDB JSON file. The
+    parameters, constants, global functions, organs, their variables and their functions each have a table with one row
+    per item. A model is saved in a single transaction, so a crash during a save leaves the previous version intact.
+    After the first save, the database follows the edits of the model, and a later save only writes the rows of the
+    values which were edited, so saving after moving a slider writes a single row.
+
+    For reading, a SQLiteDatabase offers the same tables() and table(name).all() as TinyDB, with documents in the same
+    layout, so a model is loaded from either backend by the same code. Models are converted between both formats with
+    import_json and export_json.
+"""
+import os
+import sqlite3
+import threading
+
+from tinydb import TinyDB
+
+from ceteris_paribus.db.model_changes import SET_INPUT, ADD_PARAMETER, REMOVE_PARAMETER, ADD_CONSTANT, ADD_FUNCTION, \
+    REMOVE_FUNCTION, ADD_ORGAN, REMOVE_ORGAN, MOVE_ORGAN, UPDATE_ORGAN, RENAME_ORGAN
+
+# Every SQLite database file starts with this header, the files which do not are opened as TinyDB databases
+SQLITE_HEADER = b'SQLite format 3\x00'
+# A file which does not exist yet, or is empty, is created as a SQLite database if it has one of these suffixes
+SQLITE_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+
+# The names of the TinyDB tables which are presented by a SQLiteDatabase
+MODEL_TABLES = ('GlobalParameters', 'GlobalConstants', 'GlobalFunctions', 'SystemicOrgans')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parameters (
+    name TEXT PRIMARY KEY, minimum, maximum, value, position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS constants (
+    name TEXT PRIMARY KEY, value, position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS global_functions (
+    name TEXT PRIMARY KEY, expression TEXT NOT NULL, position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS organs (
+    name TEXT PRIMARY KEY, x REAL, y REAL, position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS variables (
+    organ TEXT NOT NULL REFERENCES organs (name) ON DELETE CASCADE, name TEXT NOT NULL, minimum, maximum, value,
+    position INTEGER NOT NULL, PRIMARY KEY (organ, name));
+CREATE TABLE IF NOT EXISTS organ_functions (
+    organ TEXT NOT NULL REFERENCES organs (name) ON DELETE CASCADE, name TEXT NOT NULL, expression TEXT NOT NULL,
+    position INTEGER NOT NULL, PRIMARY KEY (organ, name));
+"""
+
+# For every table: its key columns and its value columns
+TABLE_COLUMNS = {
+    'parameters': (('name',), ('minimum', 'maximum', 'value', 'position')),
+    'constants': (('name',), ('value', 'position')),
+    'global_functions': (('name',), ('expression', 'position')),
+    'organs': (('name',), ('x', 'y', 'position')),
+    'variables': (('organ', 'name'), ('minimum', 'maximum', 'value', 'position')),
+    'organ_functions': (('organ', 'name'), ('expression', 'position')),
+}
+# The order in which the tables are written, the organs come first so that the variables and functions of a removed
+# organ are deleted with it
+TABLE_ORDER = ('organs', 'parameters', 'constants', 'global_functions', 'variables', 'organ_functions')
+
+# The tables which are compared with the model when it is saved after a change of each kind. A change of an input or a
+# move of an organ only writes the row of that input or organ.
+ORGAN_TABLES = ('organs', 'variables', 'organ_functions')
+CHANGED_TABLES = {
+    ADD_PARAMETER: ('parameters',),
+    REMOVE_PARAMETER: ('parameters',),
+    ADD_CONSTANT: ('constants',),
+    ADD_FUNCTION: ('global_functions',),
+    REMOVE_FUNCTION: ('global_functions',),
+    ADD_ORGAN: ORGAN_TABLES,
+    REMOVE_ORGAN: ORGAN_TABLES,
+    RENAME_ORGAN: ORGAN_TABLES,
+    UPDATE_ORGAN: ('variables', 'organ_functions'),
+}
+
+
+class SQLiteTable(object):
+    """ A read-only view of one of the model tables, with the documents of the corresponding TinyDB table."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    def all(self):
+        return self.database.read_documents(self.name)
+
+    def __len__(self):
+        return len(self.all())
+
+
+class SQLiteDatabase(object):
+    """ A model stored in a SQLite database. It is called with the changes of the model it follows, see save_model."""
+
+    def __init__(self, path, read_only=False):
+        """
+        :param path: the file of the database, which is created with an empty model if it does not exist
+        :param read_only: if set, the file is never changed, and it must exist
+        """
+        self.path = path
+        if read_only:
+            self.connection = sqlite3.connect('file:' + os.path.abspath(path) + '?mode=ro', uri=True)
+        else:
+            self.connection = sqlite3.connect(path)
+            with self.connection:
+                self.connection.executescript(SCHEMA)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        # The model whose edits are followed, together with the inputs, organs and tables it changed since it was saved
+        self._model = None
+        self._lock = threading.Lock()
+        self._changed_inputs = set()
+        self._moved_organs = set()
+        self._changed_tables = set()
+
+    def tables(self):
+        """ Returns the names of the TinyDB tables which are present, these are all of them unless the file does not
+            contain a model."""
+        present = {row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return set(MODEL_TABLES) if set(TABLE_COLUMNS) <= present else set()
+
+    def table(self, name):
+        if name not in MODEL_TABLES:
+            raise KeyError("Unknown table: " + str(name))
+        return SQLiteTable(self, name)
+
+    def read_documents(self, name):
+        """ Returns the rows of a model table in the layout of the TinyDB documents, with one document per item."""
+        execute = self.connection.execute
+        if name == 'GlobalParameters':
+            return [{row[0]: [row[1], row[2], row[3]]} for row in
+                    execute("SELECT name, minimum, maximum, value FROM parameters ORDER BY position")]
+        if name == 'GlobalConstants':
+            return [{row[0]: row[1]} for row in execute("SELECT name, value FROM constants ORDER BY position")]
+        if name == 'GlobalFunctions':
+            return [{row[0]: row[1]} for row in
+                    execute("SELECT name, expression FROM global_functions ORDER BY position")]
+        organs = {}
+        for organ_name, x, y in execute("SELECT name, x, y FROM organs ORDER BY position"):
+            organs[organ_name] = {'name': organ_name, 'variables': {}, 'functions': {}, 'pos': [x, y]}
+        for organ_name, variable, minimum, maximum, value in execute(
+                "SELECT organ, name, minimum, maximum, value FROM variables ORDER BY organ, position"):
+            organs[organ_name]['variables'][variable] = [minimum, maximum, value]
+        for organ_name, function, expression in execute(
+                "SELECT organ, name, expression FROM organ_functions ORDER BY organ, position"):
+            organs[organ_name]['functions'][function] = expression
+        return list(organs.values())
+
+    def save_model(self, model):
+        """ Saves a GlobalModel. The first save compares every row with the stored one, and writes those which differ.
+            From then on the database follows the edits of the model, so a later save only writes the rows of the
+            values which were edited, and compares only the tables whose items were added, removed or renamed.
+            :return: the number of rows which were inserted, updated or deleted
+        """
+        if self._model is not model:
+            # The model is followed before it is read, so no edit made in the meantime is missed
+            self.follow(model)
+            return self.write_data(get_model_data(model))
+        with self._lock:
+            inputs, organs, tables = self._changed_inputs, self._moved_organs, self._changed_tables
+            self._changed_inputs, self._moved_organs, self._changed_tables = set(), set(), set()
+        try:
+            with model.lock, self.connection:
+                return self._write_changes(model, inputs, organs, tables)
+        except BaseException:
+            # Nothing was written, the changes are saved with the next save
+            with self._lock:
+                self._changed_inputs.update(inputs)
+                self._moved_organs.update(organs)
+                self._changed_tables.update(tables)
+            raise
+
+    def _write_changes(self, model, inputs, organs, tables):
+        written = 0
+        if tables:
+            rows = _make_rows(get_model_data(model))
+            for table in TABLE_ORDER:
+                if table in tables:
+                    written += self._sync_table(table, rows[table])
+        execute = self.connection.execute
+        params = model.get_global_param_ranges()
+        model_organs = model.get_organs()
+        for key in inputs:
+            organ_name, _, name = key.rpartition('.')
+            if organ_name:
+                variables = model_organs[organ_name].get_local_ranges() if organ_name in model_organs else {}
+                if name in variables:
+                    written += execute("UPDATE variables SET value = ? WHERE organ = ? AND name = ?",
+                                       (variables[name][2], organ_name, name)).rowcount
+            elif key in params:
+                written += execute("UPDATE parameters SET value = ? WHERE name = ?", (params[key][2], key)).rowcount
+        for organ_name in organs:
+            if organ_name in model_organs:
+                x, y = model_organs[organ_name].get_pos()
+                written += execute("UPDATE organs SET x = ?, y = ? WHERE name = ?", (x, y, organ_name)).rowcount
+        return written
+
+    def follow(self, model):
+        """ Follows the edits of a model from now on, instead of those of the previously followed model."""
+        self.release()
+        with self._lock:
+            self._changed_inputs, self._moved_organs, self._changed_tables = set(), set(), set()
+        self._model = model
+        model.add_change_listener(self)
+
+    def release(self):
+        """ Stops following the edits of the model, its next save compares every row again."""
+        if self._model is not None:
+            self._model.remove_change_listener(self)
+            self._model = None
+
+    def __call__(self, op, fields):
+        # Called with every edit of the followed model, possibly on a worker thread
+        with self._lock:
+            if op == SET_INPUT:
+                self._changed_inputs.add(fields['key'])
+            elif op == MOVE_ORGAN:
+                self._moved_organs.add(fields['name'])
+            else:
+                self._changed_tables.update(CHANGED_TABLES.get(op, TABLE_ORDER))
+
+    def write_data(self, data):
+        """ Replaces the stored model by the model data, in a single transaction.
+            :param data: the model data, as returned by get_model_data or get_database_data
+            :return: the number of rows which were inserted, updated or deleted
+        """
+        rows = _make_rows(data)
+        written = 0
+        with self.connection:
+            for table in TABLE_ORDER:
+                written += self._sync_table(table, rows[table])
+        return written
+
+    def _sync_table(self, table, rows):
+        # Writes the rows which differ from the stored ones, and deletes the stored rows which are no longer present
+        key_columns, value_columns = TABLE_COLUMNS[table]
+        columns = key_columns + value_columns
+        stored = {}
+        for row in self.connection.execute("SELECT " + ", ".join(columns) + " FROM " + table):
+            stored[row[:len(key_columns)]] = row[len(key_columns):]
+        removed = [key for key in stored if key not in rows]
+        changed = [key + values for key, values in rows.items() if stored.get(key) != values]
+        if removed:
+            self.connection.executemany("DELETE FROM " + table + " WHERE " +
+                                        " AND ".join(column + " = ?" for column in key_columns), removed)
+        if changed:
+            self.connection.executemany(
+                "INSERT INTO " + table + " (" + ", ".join(columns) + ") VALUES (" + ", ".join("?" * len(columns)) +
+                ") ON CONFLICT (" + ", ".join(key_columns) + ") DO UPDATE SET " +
+                ", ".join(column + " = excluded." + column for column in value_columns), changed)
+        return len(removed) + len(changed)
+
+    def close(self):
+        self.release()
+        self.connection.close()
+
+
+def _make_rows(data):
+    # Converts model data into the rows of every table, keyed by their key columns
+    rows = {table: {} for table in TABLE_COLUMNS}
+    for position, (name, (minimum, maximum, value)) in enumerate(data['parameters'].items()):
+        rows['parameters'][(name,)] = (minimum, maximum, value, position)
+    for position, (name, value) in enumerate(data['constants'].items()):
+        rows['constants'][(name,)] = (value, position)
+    for position, (name, expression) in enumerate(data['functions'].items()):
+        rows['global_functions'][(name,)] = (expression, position)
+    for position, (organ_name, organ) in enumerate(data['organs'].items()):
+        pos = organ.get('pos') or [None, None]
+        rows['organs'][(organ_name,)] = (pos[0], pos[1], position)
+        for index, (name, (minimum, maximum, value)) in enumerate(organ['variables'].items()):
+            rows['variables'][(organ_name, name)] = (minimum, maximum, value, index)
+        for index, (name, expression) in enumerate(organ['functions'].items()):
+            rows['organ_functions'][(organ_name, name)] = (expression, index)
+    return rows
+
+
+def get_model_data(model):
+    """ Returns the parameters, constants, functions and organs of a GlobalModel as model data."""
+    organs = {}
+    for organ_name, organ in model.get_organs().items():
+        if organ_name == '__builtins__':
+            continue
+        organs[organ_name] = {'variables': {name: list(variable) for name, variable in organ.get_local_ranges().items()
+                                            if name != '__builtins__'},
+                              'functions': dict(organ.get_funcs()), 'pos': list(organ.get_pos())}
+    return {'parameters': {name: list(param) for name, param in model.get_global_param_ranges().items()},
+            'constants': dict(model.get_global_constants()), 'functions': dict(model.get_global_functions()),
+            'organs': organs}
+
+
+def get_database_data(db):
+    """ Returns the model data stored in a TinyDB or SQLite database."""
+    data = {'parameters': {}, 'constants': {}, 'functions': {}, 'organs': {}}
+    for table_name, key in (('GlobalParameters', 'parameters'), ('GlobalConstants', 'constants'),
+                            ('GlobalFunctions', 'functions')):
+        for document in db.table(table_name).all():
+            data[key].update(document)
+    for organ_info in db.table('SystemicOrgans').all():
+        data['organs'][organ_info['name']] = {'variables': {name: variable for name, variable
+                                                            in organ_info.get('variables', {}).items()
+                                                            if name != '__builtins__'},
+                                              'functions': dict(organ_info.get('functions', {})),
+                                              'pos': organ_info.get('pos')}
+    return data
+
+
+def is_sqlite_path(path):
+    """ Returns whether a file is a SQLite database. An existing file is recognised by its header, so a TinyDB file with
+        one of the SQLite suffixes is still a TinyDB file. A file which does not exist yet, or is empty, is a SQLite
+        database if it has one of the SQLite suffixes."""
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(len(SQLITE_HEADER))
+    except OSError:
+        header = b''
+    if header:
+        return header == SQLITE_HEADER
+    return os.path.splitext(path)[1].lower() in SQLITE_SUFFIXES
+
+
+def save_to_sqlite(model, path):
+    """ Saves a GlobalModel to a SQLite database. The database stays open and follows the edits of the model, so saving
+        the model to the same file again only writes the rows which changed.
+        :return: the number of rows which were inserted, updated or deleted
+    """
+    for listener in model.get_change_listeners():
+        if isinstance(listener, SQLiteDatabase) and os.path.abspath(listener.path) == os.path.abspath(path):
+            return listener.save_model(model)
+    return SQLiteDatabase(path).save_model(model)
+
+
+def open_database(path, read_only=False):
+    """ Opens a model database, as a SQLiteDatabase if the file is a SQLite database and as a TinyDB otherwise."""
+    if is_sqlite_path(path):
+        return SQLiteDatabase(path, read_only)
+    if read_only:
+        return TinyDB(path, access_mode='r')
+    return TinyDB(path)
+
+
+def import_json(json_path, sqlite_path):
+    """ Copies the model in a TinyDB JSON file into a SQLite database, replacing the model stored in it."""
+    source = TinyDB(json_path, access_mode='r')
+    target = SQLiteDatabase(sqlite_path)
+    try:
+        target.write_data(get_database_data(source))
+    finally:
+        source.close()
+        target.close()
+
+
+def export_json(sqlite_path, json_path):
+    """ Writes the model in a SQLite database to a TinyDB JSON file, in the layout written by dump_model."""
+    source = SQLiteDatabase(sqlite_path, read_only=True)
+    try:
+        data = get_database_data(source)
+    finally:
+        source.close()
+    write_json_data(data, json_path)
+
+
+def write_json_data(data, json_path):
+    """ Writes model data to a new TinyDB JSON file, in the layout written by dump_model."""
+    if os.path.exists(json_path):
+        os.remove(json_path)
+    target = TinyDB(json_path)
+    try:
+        target.table("GlobalConstants").insert(data['constants'])
+        target.table("GlobalFunctions").insert(data['functions'])
+        target.table("GlobalParameters").insert(data['parameters'])
+        systemic_organs = target.table("SystemicOrgans")
+        for organ_name, organ in data['organs'].items():
+            systemic_organs.insert({'name': organ_name, 'variables': organ['variables'],
+                                    'functions': organ['functions']})
+    finally:
+        target.close()
@@ -18,9 +18,16 @@ class MoveCommand(QUndoCommand):
 
     def undo(self):
         self.node.setPos(self.old_pos)
+        self.store_pos()
 
     def redo(self):
         self.node.setPos(self.new_pos)
+        self.store_pos()
+
+    def store_pos(self):
+        # The position of an organ is kept in the model, so that it is saved with it
+        if hasattr(self.node, 'organ'):
+            self.controller.organ_moved(self.node.organ, self.node.pos())
 
 
 class DeleteCommand(QUndoCommand):
@@ -1,30 +1,24 @@
 """ This module contains code for the generic dialogs used when opening a new dialog. Note that we don't specify classes
     for this as the functionality is simple enough."""
 
-from PyQt5.QtWidgets import QFileDialog, QMessageBox
-from tinydb import TinyDB
+from PyQt5.QtWidgets import QFileDialog
 
 
 def select_db_dialog():
-    """ This function, which opens the database and connects it to the model is called before the UI can actually be
-        used. """
+    """ This function asks the user for the database to open, which is loaded and connected to the model before the UI
+        can actually be used. It returns the path of the file, or None if no file was selected."""
     qfd = QFileDialog()
-    qfd.setNameFilter("*.json")
-    qfd.exec_()
+    qfd.setFileMode(QFileDialog.ExistingFile)
+    qfd.setNameFilter("*.json *.sqlite *.db *.cpsnap")
+    if not qfd.exec_():
+        return None
     # We can only select a single file, therefore, we can always look at [0] without missing anything
-    potential_db = qfd.selectedFiles()[0]
-    try:
-        return TinyDB(potential_db)
-    except:
-        # If we were unable to open the database for whatever reason we give the user another chance.
-        msg = QMessageBox()
-        msg.setText("Unable to load database, the file might be corrupted\nPlease try again")
-        msg.exec_()
+    return qfd.selectedFiles()[0]
 
 
 def save_db_dialog():
     """ This function creates a graphical interface to save a file. It returns the name of the target"""
-    return QFileDialog.getSaveFileName(None, "Save File", "/home", "*.json")[0]
+    return QFileDialog.getSaveFileName(None, "Save File", "/home", "*.json;;*.sqlite;;*.cpsnap")[0]
 
 
 def remove_selected(var_view, variables):
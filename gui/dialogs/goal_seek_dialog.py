@@ -0,0 +1,72 @@
+""" This module defines the dialog in which the user asks which value of an input makes an output reach a target value,
+    all else being equal. The solution can be applied to the model, which moves the slider of the input."""
+from PyQt5.QtGui import QDoubleValidator
+from PyQt5.QtWidgets import QDialog, QGridLayout, QComboBox, QLineEdit, QLabel, QPushButton, QHBoxLayout
+
+
+class GoalSeekDialog(QDialog):
+
+    def __init__(self, controller, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.controller = controller
+        self.result = None
+        self.setWindowTitle("Goal seek")
+
+        layout = QGridLayout()
+        layout.addWidget(QLabel("Output"), 0, 0)
+        self.output_selector = QComboBox()
+        self.output_selector.addItems(self.controller.get_output_names())
+        layout.addWidget(self.output_selector, 0, 1)
+
+        layout.addWidget(QLabel("Target value"), 1, 0)
+        self.target_value = QLineEdit()
+        self.target_value.setValidator(QDoubleValidator())
+        layout.addWidget(self.target_value, 1, 1)
+
+        layout.addWidget(QLabel("By changing"), 2, 0)
+        self.input_selector = QComboBox()
+        self.input_selector.addItems(self.controller.get_sweepable_inputs())
+        layout.addWidget(self.input_selector, 2, 1)
+
+        self.result_label = QLabel()
+        layout.addWidget(self.result_label, 3, 0, 1, 2)
+
+        button_layout = QHBoxLayout()
+        solve_button = QPushButton("Solve")
+        solve_button.clicked.connect(self.solve)
+        button_layout.addWidget(solve_button)
+        self.apply_button = QPushButton("Apply")
+        self.apply_button.setEnabled(False)
+        self.apply_button.clicked.connect(self.apply)
+        button_layout.addWidget(self.apply_button)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.reject)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout, 4, 0, 1, 2)
+
+        self.setLayout(layout)
+
+    def solve(self):
+        input_key = self.input_selector.currentText()
+        target_key = self.output_selector.currentText()
+        try:
+            target_value = float(self.target_value.text())
+        except ValueError:
+            self.result_label.setText("Please enter a target value")
+            return
+        if not input_key or not target_key:
+            return
+        self.result = self.controller.goal_seek(input_key, target_key, target_value)
+        if self.result.converged:
+            self.result_label.setText(input_key + " = " + str(round(self.result.value, 4)) + " gives " + target_key +
+                                      " = " + str(round(self.result.achieved, 4)))
+        else:
+            # The target cannot be reached within the range of the input, the closest value is offered instead
+            self.result_label.setText("The target cannot be reached, the closest is " + target_key + " = " +
+                                      str(round(self.result.achieved, 4)) + " at " + input_key + " = " +
+                                      str(round(self.result.value, 4)))
+        self.apply_button.setEnabled(True)
+
+    def apply(self):
+        if self.result is not None:
+            self.controller.apply_input_value(self.result.input_key, self.result.value)
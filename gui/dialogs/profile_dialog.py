@@ -0,0 +1,45 @@
+""" This module defines the dialog which shows the sensitivity profiles of the model. An input is selected, after which
+    the response of the global outputs to a sweep over the range of that input is plotted, all else being equal."""
+import pyqtgraph as pg
+from PyQt5.QtWidgets import QDialog, QComboBox, QVBoxLayout, QHBoxLayout, QLabel, QSpinBox
+
+
+class ProfileDialog(QDialog):
+    """ Plots the sensitivity profiles computed by the model for a single input at a time."""
+
+    def __init__(self, controller, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.controller = controller
+        self.setWindowTitle("Sensitivity profiles")
+
+        layout = QVBoxLayout()
+        selection_layout = QHBoxLayout()
+        selection_layout.addWidget(QLabel("Input"))
+        self.input_selector = QComboBox()
+        self.input_selector.addItems(self.controller.get_sweepable_inputs())
+        self.input_selector.currentIndexChanged.connect(self.update_plot)
+        selection_layout.addWidget(self.input_selector)
+
+        selection_layout.addWidget(QLabel("Points"))
+        self.points = QSpinBox()
+        self.points.setRange(2, 1000)
+        self.points.setValue(50)
+        self.points.valueChanged.connect(self.update_plot)
+        selection_layout.addWidget(self.points)
+        layout.addLayout(selection_layout)
+
+        self.plot = pg.PlotWidget()
+        self.plot.addLegend()
+        layout.addWidget(self.plot)
+        self.setLayout(layout)
+        self.update_plot()
+
+    def update_plot(self):
+        self.plot.clear()
+        input_key = self.input_selector.currentText()
+        if not input_key:
+            return
+        profile = self.controller.get_sensitivity_profile(input_key, self.points.value())
+        self.plot.setLabel('bottom', input_key)
+        for index, (name, response) in enumerate(profile.responses.items()):
+            self.plot.plot(profile.samples, response, pen=pg.intColor(index), name=name)
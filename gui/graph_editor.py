@@ -54,6 +54,10 @@ class GraphWindow(QMainWindow):
         grid_action = view_menu.addAction('Toggle grid')
         grid_action.setStatusTip('Show or hide the grid background')
         grid_action.triggered.connect(self.toggleGrid)
+        code_generation_action = view_menu.addAction('Generate evaluation code')
+        code_generation_action.setStatusTip('Evaluate the outputs with a single function generated from the model')
+        code_generation_action.setCheckable(True)
+        code_generation_action.toggled.connect(self.controller.set_code_generation)
 
         self.statusBar().showMessage("Ready")
 
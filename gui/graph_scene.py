@@ -3,7 +3,6 @@ from PyQt5.QtGui import QTransform, QBrush
 from PyQt5.QtWidgets import QGraphicsScene
 
 from ceteris_paribus.gui.commands import MoveCommand, NewCommand
-from ceteris_paribus.gui.dialogs.new_node_dialog import NewNodeDialog
 from ceteris_paribus.gui.visual_elements import OrganNode, InNode, OutNode, Edge
 
 
@@ -89,6 +88,8 @@ class GraphScene(QGraphicsScene):
         return QGraphicsScene.mouseReleaseEvent(self, event)
 
     def create_new_node(self, pos):
+        # The dialog is imported on first use, so that it does not delay the start of the program
+        from ceteris_paribus.gui.dialogs.new_node_dialog import NewNodeDialog
         dialog = NewNodeDialog(self.controller)
 
         if dialog.run():
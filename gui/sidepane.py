@@ -1,16 +1,12 @@
 """ Contains the definition of the side panel on the right hand side of the UI. This panel displays the relevant
-    information for the model."""
+    information for the model. The dialogs and pyqtgraph are imported when they are first used, as importing them
+    would otherwise delay the start of the program."""
 from functools import partial
 
-import pyqtgraph as pg
 from PyQt5.QtWidgets import QWidget, QGridLayout, QGroupBox, QLabel, QHBoxLayout, QVBoxLayout, \
     QPushButton, QDialog, QLineEdit, QComboBox, QFrame, QMessageBox
 
 from ceteris_paribus.gui.commands import DeleteCommand
-from ceteris_paribus.gui.dialogs.function_dialog import FunctionDialog
-from ceteris_paribus.gui.dialogs.global_function_dialog import GlobalFunctionDialog, parse_function
-from ceteris_paribus.gui.dialogs.global_input_dialog import GlobalInputDialog
-from ceteris_paribus.gui.dialogs.var_dialog import VarDialog
 from ceteris_paribus.gui.visual_elements import FloatSlider
 
 
@@ -60,13 +56,11 @@ class ContextPane(QWidget):
         color_group = QGroupBox("Color")
         color_group.setFixedSize(300, (available_height / 5))
         self.color_global = QLabel("")
-        self.colorBar = pg.GradientWidget()
-        color_layout = QGridLayout()
-        color_layout.addWidget(self.color_global)
-        color_layout.addWidget(self.colorBar)
-        color_group.setLayout(color_layout)
-        self.colorBar.loadPreset('cyclic')
-        self.colorBar.sigGradientChangeFinished.connect(lambda: self.controller.update_colors())
+        self.color_layout = QGridLayout()
+        self.color_layout.addWidget(self.color_global)
+        color_group.setLayout(self.color_layout)
+        # The color bar is created when a global value is first colored, pyqtgraph is only loaded when it is used
+        self.colorBar = None
 
         layout = QGridLayout()
         layout.addWidget(self.input_group)
@@ -76,6 +70,16 @@ class ContextPane(QWidget):
 
         self.setLayout(layout)
 
+    def get_color_bar(self):
+        # Returns the color bar, creating it on first use
+        if self.colorBar is None:
+            import pyqtgraph as pg
+            self.colorBar = pg.GradientWidget()
+            self.color_layout.addWidget(self.colorBar)
+            self.colorBar.loadPreset('cyclic')
+            self.colorBar.sigGradientChangeFinished.connect(lambda: self.controller.update_colors())
+        return self.colorBar
+
     def reload(self):
         self.initialize_input()
 
@@ -132,6 +136,12 @@ class ContextPane(QWidget):
         global_outs = QPushButton("Global functions")
         global_outs.clicked.connect(lambda: self.show_global_funcs())
         button_layout.addWidget(global_outs)
+        profiles = QPushButton("Sensitivity")
+        profiles.clicked.connect(self.show_profiles)
+        button_layout.addWidget(profiles)
+        seek = QPushButton("Goal seek")
+        seek.clicked.connect(self.show_goal_seek)
+        button_layout.addWidget(seek)
 
         self.fill_output_grid()
 
@@ -139,13 +149,25 @@ class ContextPane(QWidget):
         output_layout.addLayout(self.output_grid_layout)
         self.output_group.setLayout(output_layout)
 
+    def show_profiles(self):
+        # Shows the response of the outputs to each of the inputs, all else being equal
+        from ceteris_paribus.gui.dialogs.profile_dialog import ProfileDialog
+        dialog = ProfileDialog(self.controller)
+        dialog.exec_()
+
+    def show_goal_seek(self):
+        # Solves for the value of an input at which an output reaches a target value
+        from ceteris_paribus.gui.dialogs.goal_seek_dialog import GoalSeekDialog
+        dialog = GoalSeekDialog(self.controller)
+        dialog.exec_()
+
     def change_context_organ(self, organ):
         self.current_organ = organ
         self.name_label.setText(organ.get_name())
 
     def new_global_input(self):
         # This dialog constructs a new global input slider for use everywhere.
-
+        from ceteris_paribus.gui.dialogs.global_input_dialog import GlobalInputDialog
         dialog = GlobalInputDialog(self.controller)
         if dialog.exec():
             self.controller.add_global_input(dialog.var_name.text(), dialog.min, dialog.val, dialog.max)
@@ -258,6 +280,7 @@ class ContextPane(QWidget):
 
     def edit_global_function(self, func_combobox):
         if func_combobox.currentText():
+            from ceteris_paribus.gui.dialogs.global_function_dialog import GlobalFunctionDialog
             dialog = GlobalFunctionDialog(self.controller, func_combobox.currentText())
             if dialog.exec():
                 self.controller.add_global_function(dialog.func_name, dialog.reconstruction)
@@ -269,6 +292,7 @@ class ContextPane(QWidget):
             msg.exec_()
 
     def view_global_function(self, func_combobox, func_dict):
+        from ceteris_paribus.gui.dialogs.global_function_dialog import parse_function
         dialog = QDialog()
         layout = QGridLayout()
 
@@ -287,6 +311,7 @@ class ContextPane(QWidget):
         dialog.exec()
 
     def new_global_function(self, selector):
+        from ceteris_paribus.gui.dialogs.global_function_dialog import GlobalFunctionDialog
         dialog = GlobalFunctionDialog(self.controller)
         if dialog.exec():
             self.controller.add_global_function(dialog.func_name, dialog.reconstruction)
@@ -360,19 +385,24 @@ class ContextPane(QWidget):
 
     def edit_locals(self, previous_dialog):
         if self.current_organ:
+            from ceteris_paribus.gui.dialogs.var_dialog import VarDialog
             dialog = VarDialog(self.current_organ.get_local_ranges())
 
             if dialog.exec_():
+                # The variables of the organ were edited in place, so the model has to be recompiled
+                self.controller.model_structure_changed(self.current_organ)
                 # Close the previous dialogs and start a new one, showing the updated locals
                 previous_dialog.accept()
                 self.show_locals()
 
     def edit_functions(self, previous_dialog):
         if self.current_organ:
+            from ceteris_paribus.gui.dialogs.function_dialog import FunctionDialog
             dialog = FunctionDialog(self.current_organ.get_defined_variables(), self.current_organ.get_name(),
                                     self.current_organ.get_funcs())
 
             if dialog.exec_():
+                self.controller.model_structure_changed(self.current_organ)
                 previous_dialog.accept()
                 self.show_local_funcs()
 
@@ -399,6 +429,9 @@ class ContextPane(QWidget):
     def reload_input_layout(self):
         while not self.in_slider_layout.isEmpty():
             item = self.in_slider_layout.takeAt(0)
+            if isinstance(item.widget(), FloatSlider):
+                # A value which is still waiting for the next frame is reported before the slider is deleted
+                item.widget().flush()
             if item.widget():
                 item.widget().deleteLater()
         self.fill_input_grid()
@@ -421,7 +454,10 @@ class ContextPane(QWidget):
     def update_output(self, target_label, new_out):
         if target_label is not None:
             target_label.setText(str(round(new_out, 2)))
-        outputs = self.controller.get_outputs()
+        self.show_outputs(self.controller.get_outputs())
+
+    def show_outputs(self, outputs):
+        # Shows outputs which have been evaluated, for instance on the worker thread after a slider was moved
         for local_out_val in self.local_outs:
             self.local_outs[local_out_val].setText(str(round(outputs[local_out_val], 2)))
             if self.controller.current_global == local_out_val:
@@ -1,10 +1,13 @@
 """ Module containing the definitions of the parts of the graph, including node types and edges. Currently, the Input
     and Output nodes are special, the other nodes should all contain Organ data."""
-from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtCore import Qt, QPointF, QRectF, QTimer, QObject, pyqtSignal
 from PyQt5.QtGui import QLinearGradient, QFont, QFontMetrics, QColor, QPainterPath
 from PyQt5.QtWidgets import QGraphicsRectItem, QGraphicsItem, QGraphicsLineItem, QSlider, QMessageBox
 
-from ceteris_paribus.gui.dialogs.name_dialog import NameDialog
+from ceteris_paribus.db.diagnostics import ERROR
+
+# The time in milliseconds during which the changes of a slider are combined, the latest value of a frame is reported
+FRAME_INTERVAL = 16
 
 
 class GraphNode(QGraphicsRectItem):
@@ -152,12 +155,13 @@ class OrganNode(GraphNode):
         self.click = True
 
     def mouseDoubleClickEvent(self, event):
+        from ceteris_paribus.gui.dialogs.name_dialog import NameDialog
         dialog = NameDialog()
 
         if dialog.exec():
             name = dialog.get_name()
             if name not in self.controller.get_organ_names():
-                self.organ.set_name(name)
+                self.controller.rename_organ(self.organ, name)
                 self.name = name
                 self.controller.change_context_organ(self.organ)
                 self.controller.ui.reload()
@@ -204,7 +208,9 @@ class Edge(QGraphicsLineItem):
 
 class FloatSlider(QSlider):
     """ Custom QSlider subclass which performs a translation step between its value in a range from [0,100] to the
-        variables arbitrary floating point range."""
+        variables arbitrary floating point range. While the slider is dragged, the target is called at most once per
+        frame, with the latest value. The value which is still pending is reported right away when the slider is
+        released or hidden, such as when its dialog is closed."""
 
     def __init__(self, min, max, val, target):
         super().__init__(Qt.Horizontal)
@@ -222,9 +228,31 @@ class FloatSlider(QSlider):
         else:
             scaled_init_val = (float(val) - float(min)) * 100 / self.diff
         self.setValue(scaled_init_val)
+
+        self.pending_value = None
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(FRAME_INTERVAL)
+        self.frame_timer.timeout.connect(self.flush)
         self.valueChanged.connect(self.value_handler)
+        self.sliderReleased.connect(self.flush)
+
+    def hideEvent(self, event):
+        self.flush()
+        super().hideEvent(event)
 
     def value_handler(self, value):
+        # Every tick of the slider replaces the pending value, which is reported once the frame has passed
+        self.pending_value = value
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def flush(self):
+        # Reports the pending value, if there is any
+        self.frame_timer.stop()
+        if self.pending_value is None:
+            return
+        value, self.pending_value = self.pending_value, None
         if self.diff == 0:
             # We have no range to map to, defaulting to 0
             scaled_val = 0
@@ -238,3 +266,39 @@ def print_warning(text):
     msg.setWindowTitle("Warning")
     msg.setText(text)
     msg.exec()
+
+
+def show_diagnostic(diagnostic):
+    """ Shows a diagnostic of the model to the user, it is subscribed to the diagnostics reporter by the controller."""
+    msg = QMessageBox()
+    msg.setWindowTitle("Error" if diagnostic.severity == ERROR else "Warning")
+    msg.setText(diagnostic.message)
+    msg.exec_()
+
+
+class DiagnosticsRelay(QObject):
+    """ Shows the diagnostics of the model on the GUI thread, also when they are reported by a worker thread."""
+
+    received = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        # A diagnostic from the GUI thread is shown right away, one from another thread is queued
+        self.received.connect(self.show)
+
+    def __call__(self, diagnostic):
+        self.received.emit(diagnostic)
+
+    def show(self, diagnostic):
+        show_diagnostic(diagnostic)
+
+
+def confirm_diagnostic(diagnostic):
+    """ Asks the user whether the action described by a diagnostic should go ahead, the default answer is no."""
+    msg = QMessageBox()
+    msg.setWindowTitle("Warning")
+    msg.setText(diagnostic.message)
+    msg.setStandardButtons(QMessageBox.Yes)
+    msg.addButton(QMessageBox.No)
+    msg.setDefaultButton(QMessageBox.No)
+    return msg.exec() == QMessageBox.Yes
@@ -0,0 +1,118 @@
+""" This module evaluates a compiled model for many input vectors at once. Every function is evaluated a single time
+    with NumPy arrays in place of numbers, so a batch of any size costs a handful of array operations per function."""
+import numpy as np
+
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, DEPENDENCY, INVALID
+
+
+class _ElementValues(object):
+    """ Presents the values of a single element of a batch, used for the functions which are not array safe."""
+
+    def __init__(self, values, index, shape):
+        self.values = values
+        self.index = index
+        self.shape = shape
+
+    def __getitem__(self, key):
+        # A value is either the same for the whole batch, or an array which broadcasts to the shape of the batch
+        value = self.values[key]
+        if np.ndim(value) == 0:
+            return float(value)
+        return float(np.broadcast_to(value, self.shape)[self.index])
+
+    def __contains__(self, key):
+        return key in self.values
+
+
+def get_batch_shape(inputs):
+    """ Returns the shape of a batch, which is the shape all input arrays broadcast to."""
+    return np.broadcast_shapes(*[np.shape(value) for value in inputs.values()]) if inputs else ()
+
+
+def evaluate_batch(compiled, inputs, targets=None, errors=None, known=None):
+    """
+    Evaluates a compiled model for a batch of input vectors.
+    :param compiled: the CompiledModel to evaluate
+    :param inputs: a dict mapping input keys to arrays of values. Inputs which are not given keep their current value
+        in the compiled model. All arrays must broadcast to the same shape.
+    :param targets: the keys of the functions which should be evaluated, together with everything they depend on. By
+        default, all functions are evaluated.
+    :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+    :param known: an optional dict of function results which are the same for the whole batch. These functions are
+        not evaluated again, which is useful when the inputs in the batch only affect part of the model.
+    :return: a dict mapping the keys of the evaluated functions to arrays with the shape of the batch
+    """
+    shape = get_batch_shape(inputs)
+    # All values are floating point so that division by zero does not raise but gives inf or nan. The current values
+    # are taken straight from the array of the model state.
+    values = dict(zip(compiled.state.input_keys, compiled.state.inputs))
+    for key, value in inputs.items():
+        values[key] = np.asarray(value, dtype=float)
+
+    order = compiled.nodes if targets is None else compiled.get_ancestors(targets)
+    results = {}
+    if known:
+        results.update((key, np.asarray(value, dtype=float)) for key, value in known.items())
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for key in order:
+            if known and key in known:
+                continue
+            node = compiled.nodes[key]
+            missing = [dep for dep in node.function_deps if dep not in results]
+            if missing:
+                if errors is not None:
+                    errors.append(UnresolvedFunction(key, node.expression, DEPENDENCY, tuple(sorted(missing))))
+                continue
+            try:
+                if node.compiled.array_safe:
+                    result = eval(node.code, compiled.make_namespace(node, values, results))
+                else:
+                    result = _evaluate_elements(compiled, node, values, results, shape)
+                result = np.asarray(result, dtype=float)
+            except (NameError, TypeError, KeyError, AttributeError, ValueError):
+                if errors is not None:
+                    errors.append(UnresolvedFunction(key, node.expression, INVALID, ()))
+                continue
+            if result.shape != shape:
+                result = np.broadcast_to(result, shape)
+            if node.compiled.array_safe and not np.isfinite(result).all():
+                result = _evaluate_non_finite(compiled, node, values, results, result)
+            results[key] = result
+    if known:
+        # The known functions which were requested are returned with the shape of the batch as well
+        results = {key: results[key] if key not in known else np.full(shape, results[key])
+                   for key in order if key in results}
+    return results
+
+
+def _evaluate_non_finite(compiled, node, values, results, result):
+    # An element which is inf or nan may come from a division by zero, which results in a value of 0 when a single input
+    # vector is evaluated, or from an overflow, which keeps its value. These elements are evaluated again with the
+    # ordinary number semantics, so that they have the same value as in the evaluation of a single input vector.
+    result = np.array(result)
+    for index in np.argwhere(~np.isfinite(result)):
+        index = tuple(index)
+        element_values = _ElementValues(values, index, result.shape)
+        element_results = _ElementValues(results, index, result.shape)
+        try:
+            result[index] = eval(node.code, compiled.make_namespace(node, element_values, element_results))
+        except ZeroDivisionError:
+            result[index] = 0
+        except ArithmeticError:
+            # Numbers raise on some overflows where arrays give inf, the value of the array is kept
+            pass
+    return result
+
+
+def _evaluate_elements(compiled, node, values, results, shape):
+    # Functions which are not array safe are evaluated element by element, with the ordinary number semantics
+    result = np.empty(shape)
+    for index in np.ndindex(*shape):
+        element_values = _ElementValues(values, index, shape)
+        element_results = _ElementValues(results, index, shape)
+        namespace = compiled.make_namespace(node, element_values, element_results)
+        try:
+            result[index] = eval(node.code, namespace)
+        except ZeroDivisionError:
+            result[index] = 0
+    return result
@@ -0,0 +1,170 @@
+""" This module generates the source of a single straight-line Python function which evaluates a whole compiled model.
+    Every input and every function becomes a local variable of the generated function, and the functions are computed
+    in topological order, so an evaluation is one function call without any dicts or calls to eval. The generated
+    function is compiled once and cached for as long as the compiled model exists, which is until the structure of
+    the model changes.
+"""
+import ast
+import weakref
+
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, DEPENDENCY, INVALID
+from ceteris_paribus.db.function_parser import AccessorRewriter, report_division_by_zero
+from ceteris_paribus.model.compiled_model import INPUT, FUNCTION
+
+# The name of the generated function
+FUNCTION_NAME = 'evaluate_model'
+
+# The errors on which a function is marked as failed, as in evaluate_expression
+ERRORS = (NameError, TypeError, KeyError, AttributeError)
+
+
+class _Failed(object):
+    """ Marks the result of a function which could not be evaluated. Any arithmetic with it raises a TypeError, so the
+        functions which depend on it fail as well."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'FAILED'
+
+
+FAILED = _Failed()
+
+
+class _Renamer(ast.NodeTransformer):
+    # Replaces the names in an expression by the local variables of the generated function
+
+    def __init__(self, names):
+        self.names = names
+
+    def visit_Name(self, node):
+        return ast.copy_location(ast.Name(id=self.names[node.id], ctx=ast.Load()), node)
+
+
+class GeneratedModel(object):
+    """ The generated function of a compiled model together with its source."""
+
+    def __init__(self, compiled, source, function):
+        self.compiled = compiled
+        self.source = source
+        self.function = function
+
+    def __call__(self, inputs, divided_by_zero):
+        """
+        :param inputs: the values of all inputs, in the order of the inputs of the model state
+        :param divided_by_zero: a list to which the position of every function which divided by zero is appended
+        :return: a tuple with the results of all functions, in the order of the nodes
+        """
+        return self.function(inputs, divided_by_zero)
+
+
+def _input_name(index):
+    return 'i' + str(index)
+
+
+def _function_name(slot):
+    return 'f' + str(slot)
+
+
+def generate_source(compiled):
+    """
+    Generates the source of the function which evaluates a compiled model.
+    :return: the source, or None if a function uses an organ in a way which cannot be replaced by a direct lookup
+    """
+    state = compiled.state
+    used_inputs = set()
+    statements = []
+    for slot, (key, node) in enumerate(compiled.nodes.items()):
+        names = {}
+        for name, (kind, target) in node.bindings.items():
+            if kind == INPUT:
+                names[name] = _input_name(state.input_index[target])
+                used_inputs.add(state.input_index[target])
+            elif kind == FUNCTION:
+                names[name] = _function_name(state.function_index[target] - state.input_count)
+            else:
+                return None
+        tree = ast.parse(node.expression, mode='eval')
+        if node.code is node.compiled.direct_code:
+            tree = AccessorRewriter(node.compiled.accessed).visit(tree)
+        expression = ast.unparse(_Renamer(names).visit(tree))
+        # The comment shows which function each result belongs to
+        statements.append("    # " + key + "\n"
+                          "    try:\n"
+                          "        " + _function_name(slot) + " = " + expression + "\n"
+                          "    except ZeroDivisionError:\n"
+                          "        " + _function_name(slot) + " = 0\n"
+                          "        divided_by_zero.append(" + str(slot) + ")\n"
+                          "    except ERRORS:\n"
+                          "        " + _function_name(slot) + " = FAILED\n")
+    lines = ["def " + FUNCTION_NAME + "(inputs, divided_by_zero):\n"]
+    lines.extend("    " + _input_name(index) + " = inputs[" + str(index) + "]\n" for index in sorted(used_inputs))
+    lines.extend(statements)
+    results = ", ".join(_function_name(slot) for slot in range(len(compiled.nodes)))
+    lines.append("    return (" + results + ("," if len(compiled.nodes) == 1 else "") + ")\n")
+    return "".join(lines)
+
+
+# The generated models are kept as long as their compiled model exists
+_generated_models = weakref.WeakKeyDictionary()
+
+
+def get_generated_model(compiled):
+    """ Returns the GeneratedModel of a compiled model, generating and compiling it on first use. Returns None if the
+        model cannot be generated, in which case it has to be evaluated function by function."""
+    if compiled not in _generated_models:
+        source = generate_source(compiled)
+        generated = None
+        if source is not None:
+            namespace = {'FAILED': FAILED, 'ERRORS': ERRORS}
+            exec(compile(source, '<generated model>', 'exec'), namespace)
+            generated = GeneratedModel(compiled, source, namespace[FUNCTION_NAME])
+        _generated_models[compiled] = generated
+    return _generated_models[compiled]
+
+
+def evaluate_generated(compiled, targets=None, errors=None):
+    """
+    Evaluates the whole model with its generated function, using the current values of the inputs. The results are
+    stored in the compiled model, after which none of its functions is dirty.
+    :param compiled: the CompiledModel to evaluate
+    :param targets: the keys of the functions whose problems are reported, by default all functions. Every function
+        is evaluated regardless.
+    :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+    :return: the results of the compiled model, or None if the model cannot be generated
+    """
+    generated = get_generated_model(compiled)
+    if generated is None:
+        return None
+    divided_by_zero = []
+    results = generated(compiled.state.inputs.tolist(), divided_by_zero)
+    keys = list(compiled.nodes)
+    reported = set(keys) if targets is None else set(compiled.get_ancestors(targets))
+    try:
+        compiled.set_results(results, True)
+    except (TypeError, ValueError):
+        # Some function failed or did not give a number, these are checked one at a time
+        valid = []
+        clean = []
+        failed = set()
+        for key, result in zip(keys, results):
+            try:
+                clean.append(float(result))
+                valid.append(True)
+            except (TypeError, ValueError):
+                clean.append(0.0)
+                valid.append(False)
+                failed.add(key)
+                node = compiled.nodes[key]
+                missing = tuple(sorted(dep for dep in node.function_deps if dep in failed))
+                if errors is not None and key in reported:
+                    if missing:
+                        errors.append(UnresolvedFunction(key, node.expression, DEPENDENCY, missing))
+                    else:
+                        errors.append(UnresolvedFunction(key, node.expression, INVALID, ()))
+        compiled.set_results(clean, valid)
+    for slot in divided_by_zero:
+        if keys[slot] in reported:
+            node = compiled.nodes[keys[slot]]
+            report_division_by_zero(node.name, node.organ_name)
+    return compiled.results
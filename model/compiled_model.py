@@ -0,0 +1,468 @@
+""" This module contains the compiled representation of a model. All organ functions and global functions are placed in a
+    single dependency graph, which is evaluated in topological order in a single pass.
+
+    Every value in the compiled model is identified by a key. Global parameters, global constants and global functions
+    use their own name as key, while organ variables and organ functions use the qualified name "Organ.name". Inputs
+    (parameters, constants and organ variables) and functions have separate keys, so an organ function may have the
+    same key as the organ variable it shadows.
+"""
+from ceteris_paribus.db.dependency_graph import UnresolvedFunction, topological_order, split_cycles, UNDEFINED, \
+    CYCLE, DEPENDENCY, INVALID
+from ceteris_paribus.db.function_parser import expression_cache, evaluate_expression
+from ceteris_paribus.model.model_state import ModelState, InputValues, FunctionResults
+
+# The kinds of values a name in an expression can be bound to
+INPUT = 'input'
+FUNCTION = 'function'
+ORGAN = 'organ'
+
+
+def qualify(organ_name, name):
+    """ Returns the key of a variable or function defined in an organ."""
+    return organ_name + '.' + name
+
+
+class FunctionNode(object):
+    """ A single function in the dependency graph of the compiled model."""
+
+    def __init__(self, key, name, expression, compiled, organ_name=None):
+        self.key = key
+        self.name = name
+        self.expression = expression
+        self.compiled = compiled
+        # The code which is evaluated, in which the accessors of organs may have been replaced by direct lookups
+        self.code = compiled.code
+        # The organ_name is None for global functions
+        self.organ_name = organ_name
+        # Maps every name used in the expression to a (kind, key) tuple
+        self.bindings = {}
+        self.input_deps = set()
+        self.function_deps = set()
+        # The positions of the values of the bound names in the ModelState, set once the whole model is compiled
+        self.slot_names = []
+        self.slots = []
+        self.dependency_slots = []
+        self.position = None
+
+
+class OrganView(object):
+    """ A read-only stand-in for an Organ, used when global functions are evaluated on the compiled model. It provides
+        the accessors used in global functions, based on the values of the current evaluation."""
+
+    def __init__(self, compiled_model, name, inputs, results):
+        self.compiled_model = compiled_model
+        self.name = name
+        self.inputs = inputs
+        self.results = results
+
+    def get_name(self):
+        return self.name
+
+    def get_local_vals(self):
+        return {name: self.inputs[qualify(self.name, name)] for name in self.compiled_model.organ_variables[self.name]}
+
+    def get_defined_variables(self):
+        # The same precedence is used as for the defined variables of an Organ
+        defined_variables = self.get_local_vals()
+        for name in self.compiled_model.param_names:
+            defined_variables[name] = self.inputs[name]
+        for name in self.compiled_model.constant_names:
+            defined_variables[name] = self.inputs[name]
+        for name in self.compiled_model.organ_functions[self.name]:
+            key = qualify(self.name, name)
+            if key in self.results:
+                defined_variables[name] = self.results[key]
+        return defined_variables
+
+
+class CompiledModel(object):
+    """ The dependency graph of a whole model. It is built from the same data which is stored in the database, so it
+        can be created from a GlobalModel as well as directly from a database."""
+
+    def __init__(self, global_params, global_constants, global_functions, organ_infos):
+        """
+        :param global_params: a dict mapping the global parameters to their [min, max, val] lists
+        :param global_constants: a dict mapping the global constants to their values
+        :param global_functions: a dict mapping the global functions to their expressions
+        :param organ_infos: a dict mapping organ names to organ_info dicts, which contain the 'variables' and
+            'functions' of the organ in the same form as the database
+        """
+        self.param_names = list(global_params)
+        self.constant_names = list(global_constants)
+        self.global_function_names = list(global_functions)
+        self.organ_names = list(organ_infos)
+
+        # The value of every input, together with the [min, max] range of the ranged inputs. The values are only
+        # gathered here, the state keeps them from then on.
+        input_values = {}
+        self.input_ranges = {}
+        for name, param in global_params.items():
+            input_values[name] = param[2]
+            self.input_ranges[name] = (param[0], param[1])
+        for name, value in global_constants.items():
+            input_values[name] = value
+            self.input_ranges.pop(name, None)
+
+        self.organ_variables = {}
+        self.organ_functions = {}
+        for organ_name, organ_info in organ_infos.items():
+            variables = organ_info.get('variables', {})
+            self.organ_variables[organ_name] = [name for name in variables if name != '__builtins__']
+            self.organ_functions[organ_name] = dict(organ_info.get('functions', {}))
+            for name in self.organ_variables[organ_name]:
+                key = qualify(organ_name, name)
+                input_values[key] = variables[name][2]
+                self.input_ranges[key] = (variables[name][0], variables[name][1])
+
+        self.errors = []
+        self.nodes = {}
+        candidates = {}
+        for organ_name in self.organ_names:
+            for name, expression in self.organ_functions[organ_name].items():
+                node = self._compile_node(qualify(organ_name, name), name, expression, organ_name)
+                if node is not None:
+                    candidates[node.key] = node
+        for name, expression in global_functions.items():
+            node = self._compile_node(name, name, expression)
+            if node is not None:
+                candidates[node.key] = node
+
+        order, unordered = topological_order({key: node.function_deps for key, node in candidates.items()})
+        cyclic = split_cycles(unordered)
+        for key in unordered:
+            reason = CYCLE if key in cyclic else DEPENDENCY
+            self.errors.append(UnresolvedFunction(key, candidates[key].expression, reason,
+                                                  tuple(sorted(unordered[key]))))
+        failed = set(unordered)
+        for key in order:
+            node = candidates[key]
+            missing = [dep for dep in node.function_deps if dep in failed or dep not in candidates]
+            if missing:
+                self.errors.append(UnresolvedFunction(key, node.expression, DEPENDENCY, tuple(sorted(missing))))
+                failed.add(key)
+            else:
+                self.nodes[key] = node
+
+        # The functions every node depends on, directly or indirectly, in topological order
+        self._ancestors = {}
+
+        # The functions using each input and each function directly, used to propagate changes
+        self._input_dependents = {}
+        self._function_dependents = {}
+        for key, node in self.nodes.items():
+            for dep in node.input_deps:
+                self._input_dependents.setdefault(dep, []).append(key)
+            for dep in node.function_deps:
+                self._function_dependents.setdefault(dep, []).append(key)
+        self._downstream = {}
+        self._position = {key: position for position, key in enumerate(self.nodes)}
+        self._global_output_keys = [key for key, node in self.nodes.items() if node.organ_name is None]
+
+        # The state of the incremental evaluation: the current inputs and the last results are stored in a single
+        # array, the values and results present them as dicts. The GlobalModel keeps the values of its parameters and
+        # organs as well, the state mirrors them for the evaluation. The dirty functions are those whose result is out
+        # of date, initially nothing has been computed yet.
+        self.state = ModelState(input_values, self.nodes, input_values, self.input_ranges)
+        self.values = InputValues(self.state)
+        self.results = FunctionResults(self.state)
+        self._dirty = set(self.nodes)
+        for node in self.nodes.values():
+            self._assign_slots(node)
+
+    def _compile_node(self, key, name, expression, organ_name=None):
+        try:
+            compiled = expression_cache.get(expression)
+        except SyntaxError:
+            self.errors.append(UnresolvedFunction(key, expression, INVALID, ()))
+            return None
+        node = FunctionNode(key, name, expression, compiled, organ_name)
+        undefined = []
+        for used_name in compiled.names:
+            if organ_name is not None:
+                binding = self._resolve_in_organ(organ_name, used_name, exclude=name)
+            else:
+                binding = self._resolve_global(used_name, exclude=name)
+            if binding is None:
+                undefined.append(used_name)
+                continue
+            node.bindings[used_name] = binding
+            kind, target = binding
+            if kind == INPUT:
+                node.input_deps.add(target)
+            elif kind == FUNCTION:
+                node.function_deps.add(target)
+            else:
+                self._add_organ_deps(node, target, compiled)
+        if undefined:
+            self.errors.append(UnresolvedFunction(key, expression, UNDEFINED, tuple(sorted(undefined))))
+            return None
+        if compiled.direct_code is not None:
+            self._bind_accessors(node)
+        return node
+
+    def _bind_accessors(self, node):
+        # Binds every accessor, such as Heart.get_local_vals()['VO2'], directly to the input or function it reads, so
+        # that evaluating it is a single lookup instead of building the dict of the organ. This is only done if all
+        # accessors of the expression can be resolved, otherwise the organs are called as usual.
+        compiled = node.compiled
+        direct = {}
+        for (name, method, key), accessor_name in compiled.accessor_names.items():
+            if node.bindings.get(name, (None, None))[0] != ORGAN:
+                return
+            if method == 'get_local_vals':
+                binding = (INPUT, qualify(name, key)) if key in self.organ_variables[name] else None
+            elif method == 'get_defined_variables':
+                binding = self._resolve_in_organ(name, key)
+            else:
+                binding = None
+            if binding is None:
+                return
+            direct[accessor_name] = binding
+        node.code = compiled.direct_code
+        node.bindings.update(direct)
+        for name in compiled.names:
+            # Organs which are only used through accessors no longer appear in the expression
+            if node.bindings[name][0] == ORGAN and name not in compiled.opaque_names:
+                del node.bindings[name]
+
+    def _assign_slots(self, node):
+        for name, (kind, target) in node.bindings.items():
+            if kind == INPUT:
+                node.slot_names.append(name)
+                node.slots.append(self.state.input_index[target])
+            elif kind == FUNCTION:
+                node.slot_names.append(name)
+                node.slots.append(self.state.function_index[target])
+        node.dependency_slots = [self.state.function_index[dep] - self.state.input_count for dep in node.function_deps]
+        node.position = self.state.function_index[node.key]
+
+    def _resolve_in_organ(self, organ_name, name, exclude=None):
+        # The names in an organ are resolved in the same order as the defined variables of an Organ: the functions of
+        # the organ come first, followed by the global constants, the global parameters and finally the organ variables
+        if name in self.organ_functions[organ_name] and name != exclude:
+            return FUNCTION, qualify(organ_name, name)
+        if name in self.constant_names or name in self.param_names:
+            return INPUT, name
+        if name in self.organ_variables[organ_name]:
+            return INPUT, qualify(organ_name, name)
+        return None
+
+    def _resolve_global(self, name, exclude=None):
+        # Global functions have access to the other global functions and to the organs
+        if name in self.global_function_names and name != exclude:
+            return FUNCTION, name
+        if name in self.organ_functions:
+            return ORGAN, name
+        return None
+
+    def _add_organ_deps(self, node, organ_name, compiled):
+        if organ_name in compiled.opaque_names:
+            # The organ is used in a way we do not recognize, so the function depends on everything in the organ
+            node.input_deps.update(qualify(organ_name, name) for name in self.organ_variables[organ_name])
+            node.function_deps.update(qualify(organ_name, name) for name in self.organ_functions[organ_name])
+            node.input_deps.update(self.param_names)
+            node.input_deps.update(self.constant_names)
+        for name, method, key in compiled.accessors:
+            if name != organ_name:
+                continue
+            if method == 'get_local_vals':
+                if key in self.organ_variables[organ_name]:
+                    node.input_deps.add(qualify(organ_name, key))
+            else:
+                binding = self._resolve_in_organ(organ_name, key)
+                if binding is not None:
+                    if binding[0] == FUNCTION:
+                        node.function_deps.add(binding[1])
+                    else:
+                        node.input_deps.add(binding[1])
+
+    def get_ancestors(self, targets):
+        """ Returns the keys of the given functions and all functions they depend on, in topological order."""
+        targets = tuple(targets)
+        if targets not in self._ancestors:
+            required = set()
+            stack = [key for key in targets if key in self.nodes]
+            while stack:
+                key = stack.pop()
+                if key not in required:
+                    required.add(key)
+                    stack.extend(self.nodes[key].function_deps)
+            self._ancestors[targets] = ([key for key in self.nodes if key in required], required)
+        return self._ancestors[targets][0]
+
+    def get_downstream(self, input_key):
+        """ Returns the set of keys of all functions which depend on an input, directly or indirectly."""
+        if input_key not in self._downstream:
+            affected = set()
+            stack = list(self._input_dependents.get(input_key, ()))
+            while stack:
+                key = stack.pop()
+                if key not in affected:
+                    affected.add(key)
+                    stack.extend(self._function_dependents.get(key, ()))
+            self._downstream[input_key] = affected
+        return self._downstream[input_key]
+
+    def set_input(self, key, value):
+        """ Changes the current value of an input. Only the functions downstream of the input are marked as dirty, the
+            other results remain valid."""
+        self.values[key] = value
+        self._dirty.update(self.get_downstream(key))
+
+    def update(self, targets=None, errors=None):
+        """
+        Brings the results of the incremental evaluation up to date by recomputing only the dirty functions.
+        :param targets: if given, only the dirty functions required by these functions are recomputed, the others
+            remain dirty until they are needed
+        :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+        :return: the dict containing the current result of every function
+        """
+        if targets is None:
+            pending = self._dirty
+        else:
+            self.get_ancestors(targets)
+            pending = self._dirty.intersection(self._ancestors[tuple(targets)][1])
+        if pending:
+            for key in sorted(pending, key=self._position.__getitem__):
+                self._update_node(self.nodes[key], errors)
+            self._dirty.difference_update(pending)
+        return self.results
+
+    def _update_node(self, node, errors=None):
+        # Evaluates a single function on the current state, reading the values it uses directly from the array
+        data = self.state.data
+        valid = self.state.valid
+        slot = node.position - self.state.input_count
+        for dependency_slot in node.dependency_slots:
+            if not valid.item(dependency_slot):
+                # Functions depending on a failed function must not use its previous result
+                valid[slot] = False
+                if errors is not None:
+                    missing = [dep for dep in node.function_deps if dep not in self.results]
+                    errors.append(UnresolvedFunction(node.key, node.expression, DEPENDENCY, tuple(sorted(missing))))
+                return
+        namespace = dict(zip(node.slot_names, data.take(node.slots).tolist()))
+        if len(namespace) < len(node.bindings):
+            for name, (kind, target) in node.bindings.items():
+                if kind == ORGAN:
+                    namespace[name] = OrganView(self, target, self.values, self.results)
+        result = evaluate_expression(node.compiled, namespace, node.name, node.organ_name, node.code)
+        try:
+            data[node.position] = result
+        except (TypeError, ValueError):
+            # Only numbers can be stored in the state
+            result = None
+        if result is None:
+            valid[slot] = False
+            if errors is not None:
+                errors.append(UnresolvedFunction(node.key, node.expression, INVALID, ()))
+        elif not valid.item(slot):
+            valid[slot] = True
+
+    def set_results(self, results, valid):
+        """ Stores the results of an evaluation of the whole model, after which no function is dirty.
+            :param results: the results of all functions, in the order of the nodes
+            :param valid: whether each of the results is valid
+        """
+        self.state.results[:] = results
+        self.state.valid[:] = valid
+        self._dirty.clear()
+
+    def snapshot(self):
+        """ Returns a copy of the current state of the incremental evaluation, taken with a single array copy."""
+        return self.state.snapshot(frozenset(self._dirty))
+
+    def restore(self, snapshot):
+        """ Returns to a state taken with snapshot, the structure of the model must not have changed since then."""
+        self.state.restore(snapshot)
+        self._dirty = set(snapshot.dirty)
+
+    def get_organ_inputs(self, organ_name):
+        """ Returns a view on the current values of the local variables of an organ, in the order of its variables."""
+        return self.state.get_slice([qualify(organ_name, name) for name in self.organ_variables[organ_name]])
+
+    def get_prerequisites(self):
+        """ Returns the names and subscripts accessed by each global function, as used for the color schemes."""
+        return {key: dict(node.compiled.accessed) for key, node in self.nodes.items() if node.organ_name is None}
+
+    def evaluate(self, inputs=None, targets=None, errors=None):
+        """
+        Evaluates the model in a single pass over the dependency graph.
+        :param inputs: a dict of input values which replace the current values of the compiled model, as set with
+            set_input
+        :param targets: the keys of the functions which should be evaluated, together with everything they depend
+            on. By default, all functions are evaluated.
+        :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+        :return: a dict mapping the keys of the evaluated functions to their values
+        """
+        values = dict(self.values)
+        if inputs:
+            values.update(inputs)
+        order = self.nodes if targets is None else self.get_ancestors(targets)
+        results = {}
+        for key in order:
+            self._evaluate_node(self.nodes[key], values, results, errors)
+        return results
+
+    def make_namespace(self, node, values, results):
+        """ Creates the variables used to evaluate a function, based on the given input values and function results."""
+        namespace = {}
+        for name, (kind, target) in node.bindings.items():
+            if kind == INPUT:
+                namespace[name] = values[target]
+            elif kind == FUNCTION:
+                if target in results:
+                    namespace[name] = results[target]
+            else:
+                namespace[name] = OrganView(self, target, values, results)
+        return namespace
+
+    def _evaluate_node(self, node, values, results, errors=None):
+        # Evaluates a single function, storing its value in the results. Returns whether the evaluation succeeded.
+        namespace = self.make_namespace(node, values, results)
+        missing = [dep for dep in node.function_deps if dep not in results]
+        if missing:
+            if errors is not None:
+                errors.append(UnresolvedFunction(node.key, node.expression, DEPENDENCY, tuple(sorted(missing))))
+            return False
+        result = evaluate_expression(node.compiled, namespace, node.name, node.organ_name, node.code)
+        if result is None:
+            if errors is not None:
+                errors.append(UnresolvedFunction(node.key, node.expression, INVALID, ()))
+            return False
+        results[node.key] = result
+        return True
+
+    def get_global_outputs(self, results):
+        """ Selects the global functions from the results of an evaluation, in the order in which they are evaluated."""
+        return {key: results[key] for key in self._global_output_keys if key in results}
+
+    def get_global_output_keys(self):
+        return list(self._global_output_keys)
+
+
+def compile_model(model):
+    """ Creates the CompiledModel of a GlobalModel."""
+    organ_infos = {}
+    for organ_name, organ in model.get_organs().items():
+        if organ_name == '__builtins__':
+            continue
+        organ_infos[organ_name] = {'variables': organ.get_local_ranges(), 'functions': organ.get_funcs()}
+    return CompiledModel(model.get_global_param_ranges(), model.get_global_constants(), model.get_global_functions(),
+                         organ_infos)
+
+
+def compile_database(db):
+    """ Creates the CompiledModel of a model stored in a TinyDB database, without creating the organs of a GlobalModel.
+        As in GlobalModel, global values with an invalid name are left out."""
+    tables = {}
+    for table_name in ("GlobalParameters", "GlobalConstants", "GlobalFunctions"):
+        tables[table_name] = {}
+        for row in db.table(table_name).all():
+            for name, value in row.items():
+                if name.isidentifier():
+                    tables[table_name][name] = value
+    organ_infos = {}
+    for organ_info in db.table("SystemicOrgans").all():
+        organ_infos[organ_info['name']] = organ_info
+    return CompiledModel(tables["GlobalParameters"], tables["GlobalConstants"], tables["GlobalFunctions"], organ_infos)
@@ -1,7 +1,20 @@
-from PyQt5.QtWidgets import QMessageBox
+import threading
 
-from ceteris_paribus.db.function_parser import EvalWrapper, ModelTransformer, evaluate_functions
+from ceteris_paribus.analysis.goal_seek import goal_seek, NEWTON
+from ceteris_paribus.analysis.jacobian import compute_jacobian
+from ceteris_paribus.analysis.monte_carlo import run_monte_carlo, UNIFORM
+from ceteris_paribus.analysis.sobol import run_sobol
+from ceteris_paribus.analysis.sensitivity import compute_profile, compute_profiles, get_sweepable_inputs
+from ceteris_paribus.db.diagnostics import diagnostics, Diagnostic, WARNING, INVALID_NAME, DUPLICATE_NAME, \
+    NOT_FOUND, INVALID_FUNCTION
+from ceteris_paribus.db.function_parser import EvalWrapper, ModelTransformer, report_unresolved
+from ceteris_paribus.db.model_changes import SET_INPUT, ADD_PARAMETER, REMOVE_PARAMETER, ADD_CONSTANT, \
+    ADD_FUNCTION, REMOVE_FUNCTION, ADD_ORGAN, REMOVE_ORGAN, MOVE_ORGAN, UPDATE_ORGAN, RENAME_ORGAN
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+from ceteris_paribus.model.code_generation import evaluate_generated
+from ceteris_paribus.model.compiled_model import compile_model, qualify
 from ceteris_paribus.model.organ import Organ
+from ceteris_paribus.model.output_cache import OutputCache
 
 
 class GlobalModel(object):
@@ -17,6 +30,21 @@ class GlobalModel(object):
         self._global_params = {}
         self.color_schemes = {}
         self.controller = controller
+        # The dependency graph of the model, it is rebuilt on first use after the structure of the model changed
+        self._compiled_model = None
+        # The current values of the global parameters, this dict is shared by reference with all organs
+        self._rangeless_params = {}
+        # Whether the outputs are computed with a single generated function for the whole model, instead of updating
+        # only the functions affected by a change
+        self._code_generation = False
+        # Held while the inputs are changed or the outputs are evaluated, as this may happen on a worker thread
+        self.lock = threading.RLock()
+        # The outputs of the most recently used states of the model, keyed by the values of all inputs
+        self._output_cache = OutputCache()
+        # The journal in which the edits of the model are recorded, if the model was opened from or saved as a snapshot
+        self.journal = None
+        # The handlers which are called with every edit of the model, such as a database which only saves what changed
+        self._change_listeners = []
         # Since we only create a model after we know that the db has been loaded, we know that get_db() works
         if self.controller.get_db() is not None:
             self._database = self.controller.get_db()
@@ -51,12 +79,11 @@ class GlobalModel(object):
                 self._global_funcs.update(func)
             else:
                 invalid_name_flag = True
-        # If, during the initialization we encountered an invalid identifier we can display a warning
+        # If, during the initialization we encountered an invalid identifier we report a warning
         if invalid_name_flag:
-            msg = QMessageBox()
-            msg.setText("Warning: at least one global value has an invalid name in the database, it was not included"
-                        "in the model.")
-            msg.exec_()
+            diagnostics.report(Diagnostic(INVALID_NAME, WARNING, "Warning: at least one global value has an invalid "
+                                                                 "name in the database, it was not included in the "
+                                                                 "model."))
         # _globals is defined as the dictionary containing all globally accessible values, constant or variable
         self._globals = {**self._global_params, **self._global_constants}
 
@@ -65,7 +92,9 @@ class GlobalModel(object):
             the model."""
         pos = [0, 0]
         self.count = 0
-        rangeless_globals = self.make_rangeless_params(self._global_params)
+        # A database can ask for the organs to be evaluated on first use, such as a snapshot of a large model
+        evaluate = not getattr(self._database, 'defer_evaluation', False)
+        self._rangeless_params.update(self.make_rangeless_params(self._global_params))
         for organ_info in self._database.table("SystemicOrgans").all():
             # In the default UI we stack the organs on top of each other by generating a pos for each
             if self.count % 2 == 0:
@@ -73,8 +102,14 @@ class GlobalModel(object):
             else:
                 pos[1] *= -1
                 pos[1] += 35
+            # A position stored in the database, such as in a snapshot, takes precedence over the generated one
+            organ_pos = organ_info.get('pos')
+            if not organ_pos or None in organ_pos:
+                organ_pos = pos[:]
             # An organ_info key gives us access to all the information required to instantiate a single organ.
-            self.organs[organ_info['name']] = Organ(organ_info, rangeless_globals, self._global_constants, pos[:])
+            self.organs[organ_info['name']] = Organ(organ_info, self._rangeless_params, self._global_constants,
+                                                    list(organ_pos), evaluate)
+            self.organs[organ_info['name']].set_listener(self.organ_local_changed)
             self.count += 1
 
     def make_rangeless_params(self, params_with_range):
@@ -89,13 +124,30 @@ class GlobalModel(object):
 
     def param_changed(self, name, new_value):
         """This function handles the updating of a parameter in response to the user interacting with the UI"""
-        # Set the new value in the global params
-        self._global_params[name][2] = new_value
-        rangeless_params = self.make_rangeless_params(self._global_params)
-        # We update each organ by explicitly resetting its globals
-        for organ in self.organs:
-            if organ != '__builtins__':
-                self.organs[organ].set_globals({**rangeless_params, **self._global_constants})
+        with self.lock:
+            # Set the new value in the global params
+            self._global_params[name][2] = new_value
+            # The organs share the dict of parameter values, so only this single value has to be updated
+            self._rangeless_params[name] = new_value
+            if self._compiled_model is not None and name not in self._global_constants:
+                # Only the functions downstream of this parameter are recomputed on the next evaluation
+                self._compiled_model.set_input(name, new_value)
+            self._record(SET_INPUT, key=name, value=new_value)
+
+    def organ_local_changed(self, organ, name, new_value):
+        """This function is called by an organ after one of its local values was changed"""
+        with self.lock:
+            if self._compiled_model is not None:
+                self._compiled_model.set_input(qualify(organ.get_name(), name), new_value)
+            self._record(SET_INPUT, key=qualify(organ.get_name(), name), value=new_value)
+
+    def set_input_value(self, key, new_value):
+        """ Changes a global parameter or, if the key has the form "Organ.variable", a local value of an organ."""
+        organ_name, _, name = key.rpartition('.')
+        if organ_name:
+            self.organs[organ_name].local_changed(name, new_value)
+        else:
+            self.param_changed(key, new_value)
 
     def get_all_variables(self):
         return self._globals
@@ -109,40 +161,37 @@ class GlobalModel(object):
     def remove_global_param(self, name):
         if name in self._global_params:
             del self._global_params[name]
+            self._rangeless_params.pop(name, None)
+            self.structure_changed()
+            self._record(REMOVE_PARAMETER, name=name)
 
     def get_global_constants(self):
         return self._global_constants
 
     def add_global_constant(self, name, val):
         if name in self._global_constants:
-            msg = QMessageBox()
-            msg.setWindowTitle("Warning")
-            msg.setText(
-                "The global constant you want to add already exists:\n" + name + " : " +
-                str(self._global_constants[name]) + "\nOverwrite?")
-            msg.setStandardButtons(QMessageBox.Yes)
-            msg.addButton(QMessageBox.No)
-            msg.setDefaultButton(QMessageBox.No)
-            if msg.exec() == QMessageBox.Yes:
+            # An existing constant is only overwritten if this is confirmed, without an answer it is kept
+            if diagnostics.confirm(Diagnostic(DUPLICATE_NAME, WARNING, "The global constant you want to add already "
+                                              "exists:\n" + name + " : " + str(self._global_constants[name]) +
+                                              "\nOverwrite?", name)):
                 self._global_constants[name] = val
         else:
             self._global_constants[name] = val
+        self.structure_changed()
+        self._record(ADD_CONSTANT, name=name, value=self._global_constants[name])
 
     def add_global_parameter(self, name, val):
         assert (len(val) == 3)
         if name in self._global_params:
-            msg = QMessageBox()
-            msg.setWindowTitle("Warning")
-            msg.setText(
-                "The global constant you want to add already exists:\n" + name + " : " +
-                str(self._global_params[name]) + "\nOverwrite?")
-            msg.setStandardButtons(QMessageBox.Yes)
-            msg.addButton(QMessageBox.No)
-            msg.setDefaultButton(QMessageBox.No)
-            if msg.exec() == QMessageBox.Yes:
+            if diagnostics.confirm(Diagnostic(DUPLICATE_NAME, WARNING, "The global constant you want to add already "
+                                              "exists:\n" + name + " : " + str(self._global_params[name]) +
+                                              "\nOverwrite?", name)):
                 self._global_params[name] = val
         else:
             self._global_params[name] = val
+        self._rangeless_params[name] = self._global_params[name][2]
+        self.structure_changed()
+        self._record(ADD_PARAMETER, name=name, range=list(self._global_params[name]))
 
     def get_organs(self):
         return self.organs
@@ -152,34 +201,26 @@ class GlobalModel(object):
 
     def remove_global_func(self, f_name):
         if f_name not in self._global_funcs:
-            msg = QMessageBox()
-            msg.setText("Unable to remove global function " + f_name)
-            msg.exec()
+            diagnostics.report(Diagnostic(NOT_FOUND, WARNING, "Unable to remove global function " + f_name, f_name))
             return
         self._global_funcs.pop(f_name, None)
+        self.structure_changed()
+        self._record(REMOVE_FUNCTION, name=f_name)
 
     def add_global_func(self, f_name, f_string):
         if f_name in self._global_funcs:
-            msg = QMessageBox()
-            msg.setWindowTitle("Warning")
-            msg.setText(
-                "The global function you want to add already exists:\n" + f_name + " : " +
-                str(self._global_funcs[f_name]) + "\nOverwrite?")
-            msg.setStandardButtons(QMessageBox.Yes)
-            msg.addButton(QMessageBox.No)
-            msg.setDefaultButton(QMessageBox.No)
-            if msg.exec() == QMessageBox.No:
+            if not diagnostics.confirm(Diagnostic(DUPLICATE_NAME, WARNING, "The global function you want to add "
+                                                  "already exists:\n" + f_name + " : " +
+                                                  str(self._global_funcs[f_name]) + "\nOverwrite?", f_name)):
                 return
         if self.verify_function(f_string):
             self._global_funcs[f_name] = f_string
-            print('The function was added')
+            self.structure_changed()
+            self._record(ADD_FUNCTION, name=f_name, expression=f_string)
         else:
-            msg = QMessageBox()
-            msg.setWindowTitle("Warning")
-            msg.setText(
-                "Adding the specified function invalidates the model, please ensure that the variables are defined"
-                " first:\n " + f_name + " : " + f_string)
-            msg.exec()
+            diagnostics.report(Diagnostic(INVALID_FUNCTION, WARNING, "Adding the specified function invalidates the "
+                                          "model, please ensure that the variables are defined first:\n " + f_name +
+                                          " : " + f_string, f_name))
 
     def verify_function(self, function):
         # This function merely verifies whether a given function can be executed under the current model
@@ -195,21 +236,218 @@ class GlobalModel(object):
         # The evaluation was not successful, as we did not obtain a result
         return False
 
+    def structure_changed(self):
+        """ Should be called whenever functions, variables or organs are added, removed or renamed, so that the
+            dependency graph is rebuilt before the next evaluation."""
+        with self.lock:
+            self._compiled_model = None
+            # The outputs which were cached belong to the previous structure of the model
+            self._output_cache.clear()
+
+    def get_compiled_model(self):
+        """ Returns the dependency graph of the model, compiling it if the structure of the model has changed."""
+        with self.lock:
+            if self._compiled_model is None:
+                self._compiled_model = compile_model(self)
+                # The model is compiled with its current values, which are kept up to date through set_input
+                if self._compiled_model.errors:
+                    report_unresolved(self._compiled_model.errors)
+            return self._compiled_model
+
+    def set_code_generation(self, enabled):
+        """ Chooses whether get_outputs evaluates the model with a single generated function. The function is generated
+            on first use and kept until the structure of the model changes. Models in which an organ is used other than
+            through its accessors are always evaluated function by function."""
+        self._code_generation = enabled
+
+    def get_input_values(self):
+        """ Returns the current values of all inputs of the model, keyed as in the compiled model."""
+        values = self.get_global_param_values()
+        values.update(self._global_constants)
+        for organ_name, organ in self.organs.items():
+            for name, value in organ.get_local_vals().items():
+                values[qualify(organ_name, name)] = value
+        return values
+
     def get_outputs(self):
         """
         This function calculates the global outputs of the model
         :return: a dictionary containing the names of the outputs and their calculated values.
         """
-        # Make a shallow copy of the global function dict, so that we can freely modify it
-        copied_functions = self._global_funcs.copy()
-        variables = {**self.vars, **self.organs}
-        result = evaluate_functions(copied_functions, variables, self.color_schemes)
-        return result
+        with self.lock:
+            compiled = self.get_compiled_model()
+            # A state which was evaluated before is answered from the cache, without evaluating any function
+            key = self._output_cache.make_key(compiled.state.inputs)
+            cached = self._output_cache.get(key)
+            if cached is not None:
+                outputs, errors = cached
+                if errors:
+                    report_unresolved(list(errors))
+                return dict(outputs)
+            errors = []
+            results = None
+            if self._code_generation:
+                # The whole model is evaluated in a single call of its generated function
+                results = evaluate_generated(compiled, compiled.get_global_output_keys(), errors)
+            if results is None:
+                # Only the global functions, and the organ functions they depend on, have to be evaluated. Of these,
+                # only the functions affected by changes since the previous call are recomputed.
+                results = compiled.update(compiled.get_global_output_keys(), errors)
+            self.color_schemes.update(compiled.get_prerequisites())
+            if errors:
+                report_unresolved(errors)
+            outputs = compiled.get_global_outputs(results)
+            self._output_cache.put(key, outputs, errors)
+            return outputs
+
+    def evaluate_batch(self, params, organ_locals=None, errors=None):
+        """
+        Evaluates the model for many parameter vectors at once.
+        :param params: a dict mapping names of global parameters to arrays of values
+        :param organ_locals: an optional dict mapping local variables of organs, keyed as "Organ.variable", to arrays
+            of values
+        :param errors: if given, functions which fail to evaluate are appended as UnresolvedFunction records
+        :return: a dict mapping every organ function ("Organ.function") and global function to an array of results.
+            Parameters and variables which are not given keep their current value.
+        """
+        inputs = dict(params)
+        if organ_locals:
+            inputs.update(organ_locals)
+        unknown = [key for key in inputs if key not in self.get_compiled_model().input_ranges]
+        if unknown:
+            raise KeyError("Unknown parameters or organ variables: " + ", ".join(unknown))
+        return evaluate_batch(self.get_compiled_model(), inputs, errors=errors)
+
+    def get_sweepable_inputs(self):
+        """ Returns the keys of the global parameters and organ variables which have a range to sweep over."""
+        return get_sweepable_inputs(self.get_compiled_model())
+
+    def get_sensitivity_profile(self, input_key, points=50, targets=None):
+        """ Sweeps a single input over its range, all else being equal, and returns the SensitivityProfile."""
+        return compute_profile(self.get_compiled_model(), input_key, points, targets)
+
+    def get_sensitivity_profiles(self, points=50, inputs=None, targets=None):
+        """ Computes the SensitivityProfile of every input, or of the given inputs only."""
+        return compute_profiles(self.get_compiled_model(), points, inputs, targets)
+
+    def run_monte_carlo(self, samples=10000, method=UNIFORM, inputs=None, targets=None, seed=None):
+        """ Samples the ranges of the inputs and returns the MonteCarloResult with the distributions of the
+            functions. Inputs which are not sampled keep their current values."""
+        return run_monte_carlo(self.get_compiled_model(), samples, method, inputs, targets, seed=seed)
+
+    def get_sobol_indices(self, samples=1024, inputs=None, targets=None, seed=None):
+        """ Estimates the first-order and total Sobol indices of the global functions, or of the given functions, with
+            respect to every ranged input. The model is evaluated samples * (k + 2) times for k inputs."""
+        return run_sobol(self.get_compiled_model(), samples, inputs, targets, seed=seed)
+
+    def get_jacobian(self, inputs=None, targets=None):
+        """ Returns the Jacobian of the organ functions and global functions, or of the given functions, with respect to
+            the global parameters and organ variables at their current values. It is computed in a single pass."""
+        return compute_jacobian(self.get_compiled_model(), inputs, targets)
+
+    def goal_seek(self, input_key, target_key, target_value, method=NEWTON):
+        """ Solves for the value of a single input, within its range, at which a function reaches the target value, all
+            else being equal. The model itself is not changed, the value can be applied with set_input_value."""
+        return goal_seek(self.get_compiled_model(), input_key, target_key, target_value, method)
 
     def remove(self, organ):
         self.organs.pop(organ.get_name())
+        self.structure_changed()
+        self._record(REMOVE_ORGAN, name=organ.get_name())
 
     def add(self, organ_info, pos):
-        organ = Organ(organ_info, self.get_global_param_values(), self.get_global_constants(), pos)
+        organ = Organ(organ_info, self._rangeless_params, self.get_global_constants(), pos)
+        organ.set_listener(self.organ_local_changed)
         self.organs[organ.get_name()] = organ
+        self.structure_changed()
+        self._record(ADD_ORGAN, organ_info={'name': organ.get_name(), 'variables': organ.get_local_ranges(),
+                                            'functions': organ.get_funcs()}, pos=list(pos))
         return organ
+
+    def move_organ(self, organ, pos):
+        """ Stores the position of an organ after its node was moved in the graph."""
+        if list(pos) != list(organ.get_pos()):
+            organ.pos = list(pos)
+            self._record(MOVE_ORGAN, name=organ.get_name(), pos=organ.pos)
+
+    def rename_organ(self, organ, name):
+        """ Renames an organ. The organ is kept at its place in the model, under its new name, so that its values can
+            still be changed."""
+        old_name = organ.get_name()
+        with self.lock:
+            organs = [(name if key == old_name else key, value) for key, value in self.organs.items()]
+            organ.set_name(name)
+            # The dict is updated in place, as it is shared with the views of the model
+            self.organs.clear()
+            self.organs.update(organs)
+            self.structure_changed()
+        self._record(RENAME_ORGAN, name=old_name, new_name=name)
+
+    def organ_changed(self, organ):
+        """ Should be called after the variables or functions of an organ were edited in place."""
+        self.structure_changed()
+        self._record(UPDATE_ORGAN, name=organ.get_name(), variables=organ.get_local_ranges(),
+                     functions=organ.get_funcs())
+
+    def set_journal(self, journal):
+        """ Attaches the journal in which the edits of the model are recorded, the previous journal is closed."""
+        if self.journal is not None and self.journal is not journal:
+            self.journal.close()
+        self.journal = journal
+
+    def get_journal(self):
+        return self.journal
+
+    def add_change_listener(self, listener):
+        """ Adds a handler which is called with the op and the fields of every edit, as they are recorded in a journal.
+            The handler may be called on a worker thread."""
+        if listener not in self._change_listeners:
+            self._change_listeners.append(listener)
+
+    def remove_change_listener(self, listener):
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
+
+    def get_change_listeners(self):
+        return list(self._change_listeners)
+
+    def _record(self, op, **fields):
+        if self.journal is not None:
+            self.journal.record(op, **fields)
+        for listener in self._change_listeners:
+            listener(op, fields)
+
+    def apply_change(self, change):
+        """ Applies a change which was recorded in a journal. Existing values are overwritten without confirmation, as
+            the change was confirmed when it was recorded."""
+        op = change['op']
+        if op == SET_INPUT:
+            self.set_input_value(change['key'], change['value'])
+        elif op == ADD_PARAMETER:
+            self._global_params[change['name']] = change['range']
+            self._rangeless_params[change['name']] = change['range'][2]
+            self.structure_changed()
+        elif op == REMOVE_PARAMETER:
+            self.remove_global_param(change['name'])
+        elif op == ADD_CONSTANT:
+            self._global_constants[change['name']] = change['value']
+            self.structure_changed()
+        elif op == ADD_FUNCTION:
+            self._global_funcs[change['name']] = change['expression']
+            self.structure_changed()
+        elif op == REMOVE_FUNCTION:
+            self._global_funcs.pop(change['name'], None)
+            self.structure_changed()
+        elif op == ADD_ORGAN:
+            self.add(change['organ_info'], change['pos'])
+        elif op == REMOVE_ORGAN:
+            self.remove(self.organs[change['name']])
+        elif op == MOVE_ORGAN:
+            self.organs[change['name']].pos = change['pos']
+        elif op == RENAME_ORGAN:
+            self.rename_organ(self.organs[change['name']], change['new_name'])
+        elif op == UPDATE_ORGAN:
+            organ = self.organs[change['name']]
+            organ.variables = change['variables']
+            organ.functions = change['functions']
+            self.structure_changed()
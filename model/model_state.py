@@ -0,0 +1,134 @@
+""" This module contains the state of a compiled model. The values of all inputs and the results of all functions are
+    stored in a single contiguous float64 array, with parallel arrays for the [min, max] ranges of the inputs and for the
+    validity of the results. A key is mapped to its position in the array once, after which a value is read or written
+    without any intermediate dicts. Taking a snapshot of the state is a single array copy, and the inputs can be handed
+    to NumPy code without copying them.
+
+    The state is a mirror of the values for the evaluation, it does not replace the values kept by the GlobalModel and
+    its organs. The model writes every change of an input to both.
+"""
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+class ModelState(object):
+    """ The values of the inputs followed by the results of the functions of a model, in one array."""
+
+    def __init__(self, input_keys, function_keys, values, ranges):
+        """
+        :param input_keys: the keys of the inputs, in the order in which they are stored
+        :param function_keys: the keys of the functions, in the order in which they are stored
+        :param values: a dict mapping the input keys to their values
+        :param ranges: a dict mapping the keys of the ranged inputs to their (min, max) tuples. Inputs without a range,
+            such as the constants, have their value as minimum and maximum.
+        """
+        self.input_keys = list(input_keys)
+        self.function_keys = list(function_keys)
+        self.input_count = len(self.input_keys)
+        # Inputs and functions have separate keys, so they have separate maps. The functions are stored after the
+        # inputs, the function_index gives the position in the whole array.
+        self.input_index = {key: index for index, key in enumerate(self.input_keys)}
+        self.function_index = {key: self.input_count + index for index, key in enumerate(self.function_keys)}
+
+        self.data = np.zeros(self.input_count + len(self.function_keys))
+        self.data[:self.input_count] = [values[key] for key in self.input_keys]
+        self.minimum = np.array([ranges[key][0] if key in ranges else values[key] for key in self.input_keys],
+                                dtype=float)
+        self.maximum = np.array([ranges[key][1] if key in ranges else values[key] for key in self.input_keys],
+                                dtype=float)
+        # Whether each function has a valid result, functions which failed or were not evaluated yet have none
+        self.valid = np.zeros(len(self.function_keys), dtype=bool)
+
+        # Views into the data, these share memory with the data array
+        self.inputs = self.data[:self.input_count]
+        self.results = self.data[self.input_count:]
+
+    def get_slice(self, keys):
+        """ Returns a view on the values of a consecutive run of inputs, such as the local variables of an organ."""
+        if not keys:
+            return self.inputs[0:0]
+        start = self.input_index[keys[0]]
+        return self.inputs[start:start + len(keys)]
+
+    def snapshot(self, dirty=frozenset()):
+        """ Returns a copy of the values and the validity of the results, which can be restored later.
+            :param dirty: the keys of the functions whose result is out of date, stored with the snapshot
+        """
+        return StateSnapshot(self.data.copy(), self.valid.copy(), dirty)
+
+    def restore(self, snapshot):
+        self.data[:] = snapshot.data
+        self.valid[:] = snapshot.valid
+
+    def get_memory_usage(self):
+        """ Returns the number of bytes used by the arrays of the state."""
+        return self.data.nbytes + self.minimum.nbytes + self.maximum.nbytes + self.valid.nbytes
+
+
+class StateSnapshot(object):
+    """ A copy of the arrays of a ModelState at a single moment."""
+
+    def __init__(self, data, valid, dirty=frozenset()):
+        self.data = data
+        self.valid = valid
+        self.dirty = dirty
+
+
+class InputValues(MutableMapping):
+    """ Presents the inputs of a ModelState as a dict, keyed by input key."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def __getitem__(self, key):
+        return self.state.data.item(self.state.input_index[key])
+
+    def __setitem__(self, key, value):
+        self.state.data[self.state.input_index[key]] = value
+
+    def __delitem__(self, key):
+        raise TypeError("The inputs of a model cannot be removed")
+
+    def __contains__(self, key):
+        return key in self.state.input_index
+
+    def __iter__(self):
+        return iter(self.state.input_keys)
+
+    def __len__(self):
+        return self.state.input_count
+
+
+class FunctionResults(MutableMapping):
+    """ Presents the valid results of the functions in a ModelState as a dict, keyed by function key."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def __getitem__(self, key):
+        index = self.state.function_index[key]
+        if not self.state.valid[index - self.state.input_count]:
+            raise KeyError(key)
+        return self.state.data.item(index)
+
+    def __setitem__(self, key, value):
+        index = self.state.function_index[key]
+        self.state.data[index] = value
+        self.state.valid[index - self.state.input_count] = True
+
+    def __delitem__(self, key):
+        index = self.state.function_index[key] - self.state.input_count
+        if not self.state.valid[index]:
+            raise KeyError(key)
+        self.state.valid[index] = False
+
+    def __contains__(self, key):
+        index = self.state.function_index.get(key)
+        return index is not None and bool(self.state.valid[index - self.state.input_count])
+
+    def __iter__(self):
+        return (key for key, valid in zip(self.state.function_keys, self.state.valid) if valid)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.state.valid))
@@ -1,68 +1,74 @@
-from PyQt5.QtWidgets import QDialog, QErrorMessage, QMessageBox
-
-from ceteris_paribus.db.function_parser import EvalWrapper, Transformer, evaluate_functions
+from ceteris_paribus.db.function_parser import evaluate_functions
 
 
 class Organ(object):
     """The class which represents all organs"""
 
-    def __init__(self, organ_info, input_params, input_constants, pos):
-        """ This generic implementation of an organ in the model uses the __setattr__ method to add attributes.
-            Adding attributes in this way is necessary since not all attributes are defined for each organ.
+    # Every organ has the same fixed set of attributes, which keeps the memory used by each organ small
+    __slots__ = ('name', 'variables', 'functions', 'pos', 'input_params', 'input_constants', 'results', 'listener')
+
+    def __init__(self, organ_info, input_params, input_constants, pos, evaluate=True):
+        """ An organ is defined by its name, its local variables with their [min, max, val] ranges and its functions.
+            The global parameters and constants are shared with the model by reference, they are never copied into the
+            organ. If evaluate is not set, the functions are only evaluated when the defined variables are requested.
         """
+        if not organ_info:
+            organ_info = {}
+        self.name = organ_info.get('name', 'default_organ')
+        self.variables = organ_info.get('variables', {})
+        self.variables.pop('__builtins__', None)
+        self.functions = organ_info.get('functions', {})
         self.input_params = input_params
         self.input_constants = input_constants
         self.pos = pos
-        if organ_info:
-            for property in organ_info.keys():
-                if isinstance(property, str):
-                    if property.isidentifier():
-                        self.__setattr__(property, organ_info[property])
-                elif isinstance(property, dict):
-                    for k,v in organ_info[property].items():
-                        if k.isidentifier():
-                            self.__setattr__(property, organ_info[property])
-
-        # The defined variables dict is a combination of all the variables and their values available to this organ
-        # It will be used by the evaluator to resolve all functions and their values
-        self.defined_variables = {**self.get_local_vals(), **self.input_params, **self.input_constants}
-
+        # The listener is notified when a local value changes, so the model can update the affected functions only
+        self.listener = None
+        # The computed values of the functions of the organ
         self.results = {}
-        self.evaluate()
+        if evaluate:
+            self.evaluate()
 
     def set_globals(self, new_globals):
         """
-        This functions swaps the global variables of the organ. As a side-effect, the defined_variables are also changed
+        This functions swaps the global variables of the organ.
         :param new_globals: a dict containing the new global variables
         :return: None
         """
         self.input_params = new_globals
-        self.defined_variables = {**self.defined_variables, **self.input_params, **self.input_constants}
+
+    def get_namespace(self):
+        """ Returns the values available to the functions of this organ. The namespace is only built when it is needed,
+            the local values come first, followed by the global parameters and the global constants."""
+        return {**self.get_local_vals(), **self.input_params, **self.input_constants}
 
     def evaluate(self):
-        unresolved_funcs = getattr(self, 'functions').copy()
-        self.defined_variables = {**self.defined_variables,
-                                  **evaluate_functions(unresolved_funcs, self.defined_variables)}
+        """ Evaluates the functions of the organ and returns all defined variables, including the results."""
+        namespace = self.get_namespace()
+        self.results = evaluate_functions(self.functions.copy(), namespace)
+        namespace.pop('__builtins__', None)
+        return namespace
 
     def get_name(self):
-        return getattr(self, 'name', 'default_organ')
+        return self.name
 
     def set_name(self, name):
-        setattr(self, 'name', name)
+        self.name = name
+
+    def set_listener(self, listener):
+        self.listener = listener
 
     def local_changed(self, name: str, new_value):
         # Set local value to the new one
-        self.defined_variables[name] = new_value
-        self.get_local_ranges()[name][2] = new_value
+        self.variables[name][2] = new_value
+        if self.listener is not None:
+            self.listener(self, name, new_value)
 
     def get_pos(self):
         return self.pos
 
     def get_defined_variables(self) -> dict:
         # Returns all variables defined for this organ and their values in a single dict
-        self.evaluate()
-        self.defined_variables.pop('__builtins__', None)
-        return self.defined_variables
+        return self.evaluate()
 
     def get_inputs(self) -> dict:
         # Returns the global values as known to this organ in a single dict
@@ -70,23 +76,15 @@ class Organ(object):
 
     def get_local_ranges(self) -> dict:
         # Returns only the locally defined variables
-        local_ranges = getattr(self, 'variables')
-        local_ranges.pop('__builtins__', None)
-        return getattr(self, 'variables')
+        return self.variables
 
     def get_local_vals(self) -> dict:
         # returns only the third value in the list
-        local_vals = {}
-        ranged_vals = getattr(self, 'variables')
-        ranged_vals.pop('__builtins__', None)
-        for param in ranged_vals:
-            local_vals[param] = ranged_vals[param][2]
-        return local_vals
+        return {name: ranged_val[2] for name, ranged_val in self.variables.items()}
 
     def get_funcs(self) -> dict:
         # Returns the local functions defined for this organ
-        return getattr(self, 'functions')
+        return self.functions
 
     def __str__(self) -> str:
-        return str(getattr(self, 'name', 'default_organ')) + ":\n\tFunctions: " + str(
-            getattr(self, 'functions')) + "\n\t\tVars: " + str(getattr(self, 'variables'))
+        return str(self.name) + ":\n\tFunctions: " + str(self.functions) + "\n\t\tVars: " + str(self.variables)
@@ -0,0 +1,52 @@
+""" This module contains the cache of the outputs of a model. The user often returns to a state of the model which was
+    evaluated before, for example by switching between a handful of scenarios, and the GUI asks for the outputs of the
+    same state more than once. The outputs are therefore stored by the full vector of input values, so a state which
+    was seen before is not evaluated again. The cache only holds for a single structure of the model, it is cleared
+    whenever functions, variables or organs are added or removed."""
+from collections import OrderedDict
+
+
+class OutputCache(object):
+    """ A size bounded cache of outputs, keyed by the values of all inputs. The least recently used entry is evicted
+        first."""
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(inputs):
+        """ Returns the key of an array with the values of all inputs. The key is the raw content of the array, so two
+            states only share an entry if all their values are exactly equal."""
+        return inputs.tobytes()
+
+    def get(self, key):
+        """ Returns the (outputs, errors) tuple stored for the key, or None if the state was not evaluated before."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, outputs, errors=()):
+        """ Stores the outputs of a state, together with the functions which could not be evaluated in it."""
+        self._entries[key] = (dict(outputs), tuple(errors))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.max_size}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
@@ -0,0 +1,185 @@
+""" Test cases for the analyses built on the compiled model"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from tinydb import TinyDB
+
+from ceteris_paribus.analysis.goal_seek import goal_seek, BISECTION, BRENT, NEWTON
+from ceteris_paribus.analysis.jacobian import compute_jacobian
+from ceteris_paribus.analysis.monte_carlo import run_monte_carlo, sample_inputs, LATIN_HYPERCUBE, TRIANGULAR
+from ceteris_paribus.analysis.sobol import halton, run_sobol
+from ceteris_paribus.analysis.sensitivity import compute_profile, compute_profiles
+from ceteris_paribus.analysis.worker_pool import WorkerPool
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+from ceteris_paribus.model.compiled_model import CompiledModel
+
+GLOBAL_PARAMS = {'BodyCO': [0, 10000, 5000]}
+GLOBAL_CONSTANTS = {'factor': 2}
+GLOBAL_FUNCTIONS = {'Total': "Heart.get_defined_variables()['Out'] + Brain.get_local_vals()['Weight']",
+                    'Half': "Total / 2"}
+ORGANS = {'Heart': {'variables': {'Weight': [0, 1, 0.5], 'Out': [0, 100, 1]},
+                    'functions': {'Out': "Flow * factor", 'Flow': "BodyCO * Weight"}},
+          'Brain': {'variables': {'Weight': [1, 2, 1.5]}, 'functions': {}}}
+
+
+class TestSensitivity(unittest.TestCase):
+
+    def setUp(self):
+        self.model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, ORGANS)
+
+    def test_profile_all_else_equal(self):
+        profile = compute_profile(self.model, 'Brain.Weight', points=3)
+        self.assertEqual(list(profile.samples), [1.0, 1.5, 2.0])
+        self.assertEqual(list(profile.get_response('Total')), [5001, 5001.5, 5002])
+        # Functions which do not depend on the input are flat
+        self.assertEqual(list(profile.get_response('Heart.Out')), [5000, 5000, 5000])
+        self.assertEqual(sorted(profile.affected), ['Half', 'Total'])
+
+    def test_profiles_match_single_evaluations(self):
+        profiles = compute_profiles(self.model, points=5)
+        self.assertEqual(set(profiles), {'BodyCO', 'Heart.Weight', 'Heart.Out', 'Brain.Weight'})
+        profile = profiles['BodyCO']
+        for index, sample in enumerate(profile.samples):
+            single = self.model.evaluate({'BodyCO': sample})
+            for key, value in single.items():
+                self.assertTrue(np.isclose(profile.get_response(key)[index], value))
+
+
+class TestMonteCarlo(unittest.TestCase):
+
+    def setUp(self):
+        self.model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, ORGANS)
+
+    def test_samples_within_ranges(self):
+        for method in (TRIANGULAR, LATIN_HYPERCUBE):
+            samples = sample_inputs(self.model, 1000, method, seed=1)
+            for key, values in samples.items():
+                minimum, maximum = self.model.input_ranges[key]
+                self.assertTrue(np.all((values >= minimum) & (values <= maximum)))
+
+    def test_latin_hypercube_strata(self):
+        samples = sample_inputs(self.model, 10, LATIN_HYPERCUBE, ['Brain.Weight'], seed=1)['Brain.Weight']
+        self.assertEqual(sorted(np.floor((samples - 1) * 10).astype(int)), list(range(10)))
+
+    def test_chunks_match_single_batch(self):
+        result = run_monte_carlo(self.model, 1000, chunk_size=64, seed=3)
+        expected = evaluate_batch(self.model, result.samples)
+        for key, values in expected.items():
+            self.assertTrue(np.allclose(result.get_output(key), values))
+        self.assertAlmostEqual(result.get_mean('Half'), float(np.mean(expected['Half'])))
+
+
+class TestSobol(unittest.TestCase):
+
+    def setUp(self):
+        organs = {'Organ': {'variables': {'a': [0, 1, 0.5], 'b': [0, 1, 0.5], 'c': [0, 1, 0.5]},
+                            'functions': {'S': "a + 2 * b", 'P': "a * b"}}}
+        functions = {'Sum': "Organ.get_defined_variables()['S']", 'Product': "Organ.get_defined_variables()['P']"}
+        self.model = CompiledModel({}, {}, functions, organs)
+
+    def test_halton_fills_unit_cube(self):
+        points = halton(1000, 6, seed=0)
+        self.assertTrue(np.all((points >= 0) & (points < 1)))
+        self.assertTrue(np.allclose(np.mean(points, axis=0), 0.5, atol=0.01))
+
+    def test_additive_indices(self):
+        indices = run_sobol(self.model, 4096, seed=0)
+        # For a + 2 * b with uniform inputs, the variances of the terms are in a ratio of 1 to 4
+        self.assertTrue(np.allclose(indices.first_order['Sum'], [0.2, 0.8, 0], atol=0.02))
+        self.assertTrue(np.allclose(indices.total['Sum'], [0.2, 0.8, 0], atol=0.02))
+        self.assertEqual(indices.get_ranking('Sum'), ['Organ.b', 'Organ.a', 'Organ.c'])
+        # The interaction of a and b shows up in the total indices only
+        self.assertTrue(np.all(indices.total['Product'][:2] > indices.first_order['Product'][:2] + 0.05))
+
+    def test_chunks_match_single_batch(self):
+        single = run_sobol(self.model, 256, seed=1)
+        chunked = run_sobol(self.model, 256, chunk_size=50, seed=1)
+        self.assertTrue(np.allclose(single.first_order['Product'], chunked.first_order['Product']))
+        self.assertTrue(np.allclose(single.total['Product'], chunked.total['Product']))
+
+
+class TestJacobian(unittest.TestCase):
+
+    def test_matches_finite_differences(self):
+        organs = dict(ORGANS)
+        organs['Lung'] = {'variables': {'a': [1, 3, 2], 'b': [0, 1, 0.5]},
+                          'functions': {'R': "a ** b / (a - b) + 2 ** b", 'S': "R * BodyCO - b"}}
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, organs)
+        jacobian = compute_jacobian(model)
+        baseline = model.evaluate()
+        step = 1e-6
+        for input_key in jacobian.inputs:
+            shifted = model.evaluate({input_key: model.values[input_key] + step})
+            for output_key in jacobian.outputs:
+                expected = (shifted[output_key] - baseline[output_key]) / step
+                self.assertAlmostEqual(jacobian.get_derivative(output_key, input_key), expected,
+                                       delta=1e-5 * max(1.0, abs(expected)))
+        self.assertIn('Lung.S', jacobian.outputs)
+        self.assertEqual(jacobian.get_gradient('Total'),
+                         {'BodyCO': 1.0, 'Heart.Weight': 10000.0, 'Heart.Out': 0.0, 'Brain.Weight': 1.0,
+                          'Lung.a': 0.0, 'Lung.b': 0.0})
+
+    def test_constant_function(self):
+        model = CompiledModel({}, {}, {}, {'Organ': {'variables': {'x': [0, 1, 0.5]}, 'functions': {'y': "3"}}})
+        jacobian = compute_jacobian(model)
+        self.assertEqual(jacobian.get_gradient('Organ.y'), {'Organ.x': 0.0})
+        self.assertEqual(jacobian.output_values['Organ.y'], 3)
+
+
+class TestGoalSeek(unittest.TestCase):
+
+    def setUp(self):
+        self.model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, ORGANS)
+
+    def test_methods_reach_target(self):
+        # Half = (BodyCO * Heart.Weight * factor + Brain.Weight) / 2 = BodyCO / 2 + 0.75
+        for method in (NEWTON, BRENT, BISECTION):
+            result = goal_seek(self.model, 'BodyCO', 'Half', 2000.75, method)
+            self.assertTrue(result.converged)
+            self.assertAlmostEqual(result.value, 4000, places=6)
+            self.assertAlmostEqual(result.achieved, 2000.75, places=6)
+        # The model itself keeps its current values
+        self.assertEqual(self.model.values['BodyCO'], 5000)
+
+    def test_nonlinear_target(self):
+        organs = {'Organ': {'variables': {'x': [0, 10, 1]}, 'functions': {'y': "x ** 3 - 2 * x"}}}
+        model = CompiledModel({}, {}, {'Out': "Organ.get_defined_variables()['y']"}, organs)
+        for method in (NEWTON, BRENT):
+            result = goal_seek(model, 'Organ.x', 'Out', 100, method)
+            self.assertTrue(result.converged)
+            self.assertAlmostEqual(result.value ** 3 - 2 * result.value, 100, places=6)
+
+    def test_unreachable_target(self):
+        result = goal_seek(self.model, 'Brain.Weight', 'Total', 0)
+        self.assertFalse(result.converged)
+        self.assertEqual(result.value, 1)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        db = TinyDB(self.db_path)
+        db.table("GlobalParameters").insert(GLOBAL_PARAMS)
+        db.table("GlobalConstants").insert(GLOBAL_CONSTANTS)
+        db.table("GlobalFunctions").insert(GLOBAL_FUNCTIONS)
+        for name, organ_info in ORGANS.items():
+            db.table("SystemicOrgans").insert({'name': name, **organ_info})
+        db.close()
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def test_pool_matches_batch(self):
+        inputs = {'BodyCO': np.linspace(0, 10000, 1001), 'Brain.Weight': np.linspace(1, 2, 1001)}
+        with WorkerPool(self.db_path, processes=2) as pool:
+            results = pool.evaluate(inputs, chunk_size=100)
+            expected = evaluate_batch(CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, ORGANS), inputs)
+            for key, value in expected.items():
+                self.assertTrue(np.allclose(results[key], value))
+            # Inputs outside of the batch can be given a different value for the whole batch
+            shifted = pool.evaluate(inputs, ['Total'], base_values={'factor': 0})
+            self.assertTrue(np.allclose(shifted['Total'], inputs['Brain.Weight']))
@@ -0,0 +1,72 @@
+""" Test cases for the headless batch run"""
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from tinydb import TinyDB
+
+from ceteris_paribus.control.batch_run import main
+
+
+def write_database(path):
+    db = TinyDB(path)
+    db.table("GlobalParameters").insert({'BodyCO': [0, 10000, 5000]})
+    db.table("GlobalConstants").insert({'factor': 2})
+    db.table("GlobalFunctions").insert({'Total': "Heart.get_defined_variables()['Out'] * 2", 'Bad': "Missing + 1"})
+    db.table("SystemicOrgans").insert({'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5], 'Out': [0, 100, 1]},
+                                       'functions': {'Out': "BodyCO * Weight * factor"}, 'pos': [0, 0]})
+    db.close()
+
+
+class TestBatchRun(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'model.json')
+        write_database(self.database)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_main(self, *args):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main(list(args))
+        return status, [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_scenarios_and_errors_as_records(self):
+        scenarios = os.path.join(self.directory.name, 'scenarios.csv')
+        with open(scenarios, 'w') as file:
+            file.write("scenario,Heart.Weight,Unknown\nlow,0.25,\nhigh,1,\nwrong,abc,\nextra,,3\n")
+        status, records = self.run_main(self.database, os.path.join(self.directory.name, 'missing.json'),
+                                        '--set', 'BodyCO=1000', '--scenarios', scenarios, '--outputs', 'Total')
+        self.assertEqual(status, 1)
+        self.assertEqual([(record['scenario'], record['status']) for record in records],
+                         [('low', 'ok'), ('high', 'ok'), ('wrong', 'error'), ('extra', 'error'), (None, 'error')])
+        self.assertEqual(records[0]['outputs'], {'Total': 1000})
+        self.assertEqual(records[1]['inputs'], {'BodyCO': 1000, 'Heart.Weight': 1})
+        self.assertEqual(records[1]['outputs'], {'Total': 4000})
+        self.assertEqual(records[2]['errors'], [{'name': 'Heart.Weight', 'reason': 'invalid value', 'names': ['abc']}])
+        self.assertEqual(records[3]['errors'][0]['reason'], 'unknown input')
+        self.assertEqual(records[4]['errors'][0]['reason'], 'load failed')
+
+    def test_failed_function_gives_partial_record(self):
+        status, records = self.run_main(self.database)
+        self.assertEqual(status, 1)
+        self.assertEqual(records[0]['status'], 'partial')
+        self.assertEqual(records[0]['outputs'], {'Total': 10000, 'Bad': None})
+        self.assertEqual(records[0]['errors'], [{'name': 'Bad', 'reason': 'undefined', 'names': ['Missing']}])
+
+    def test_runs_without_qt(self):
+        # PyQt5 is made unimportable, so the run fails if anything imports it
+        code = ("import sys; sys.modules['PyQt5'] = None; from ceteris_paribus.control.batch_run import main; "
+                "sys.exit(main([" + repr(self.database) + ", '--format', 'csv', '--outputs', 'Total']))")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=os.getcwd())
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines(), ["database,scenario,status,errors,Total",
+                                                      self.database + ",1,ok,,10000.0"])
@@ -0,0 +1,139 @@
+""" Test cases for the change journal of models saved as snapshots"""
+import os
+import tempfile
+import unittest
+
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from ceteris_paribus.db.change_journal import open_journal, read_changes, start_journal
+from ceteris_paribus.db.diagnostics import DiagnosticsCollector, COMPACTION_FAILED, INVALID_CHANGE
+from ceteris_paribus.db.model_changes import SET_INPUT, REMOVE_ORGAN
+from ceteris_paribus.db.snapshot import Snapshot
+from ceteris_paribus.db.sqlite_database import get_model_data
+from ceteris_paribus.model.global_model import GlobalModel
+
+
+class _DatabaseController(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_db(self):
+        return self.db
+
+
+def _make_database():
+    db = TinyDB(storage=MemoryStorage)
+    db.table("GlobalParameters").insert({'BodyCO': [0, 10000, 5000]})
+    db.table("GlobalConstants").insert({'factor': 2})
+    db.table("GlobalFunctions").insert({'Total': "Heart.get_defined_variables()['Out'] * 2"})
+    db.table("SystemicOrgans").insert({'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5]},
+                                       'functions': {'Out': "BodyCO * Weight * factor"}})
+    return db
+
+
+class TestChangeJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'model.cpsnap')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def reopen(self):
+        model = GlobalModel(_DatabaseController(Snapshot(self.path)))
+        open_journal(model, self.path)
+        return model
+
+    def edit(self, model):
+        model.param_changed('BodyCO', 1000)
+        model.set_input_value('Heart.Weight', 1)
+        model.add_global_func('Half', "Heart.get_defined_variables()['Out'] / 2")
+        brain = model.add({'name': 'Brain', 'variables': {'VO2': [0, 10, 4]}, 'functions': {}}, [10, 20])
+        model.move_organ(brain, [30, 40])
+        model.rename_organ(brain, 'Head')
+        model.add_global_constant('offset', 3)
+        model.remove_global_func('Total')
+
+    def test_replay_recovers_session(self):
+        model = GlobalModel(_DatabaseController(_make_database()))
+        journal = start_journal(model, self.path)
+        self.edit(model)
+        self.assertEqual(len(read_changes(journal.path)), 8)
+        self.assertEqual(read_changes(journal.path)[0], {'seq': 1, 'op': SET_INPUT, 'key': 'BodyCO', 'value': 1000})
+        journal.sync()
+        # The journal is replayed on top of the snapshot, which still holds the model as it was first saved
+        reopened = self.reopen()
+        self.assertEqual(get_model_data(reopened), get_model_data(model))
+        self.assertEqual(reopened.get_outputs(), model.get_outputs())
+        reopened.set_journal(None)
+        journal.close()
+
+    def test_compaction(self):
+        model = GlobalModel(_DatabaseController(_make_database()))
+        journal = start_journal(model, self.path, compact_after=3)
+        self.edit(model)
+        journal.wait()
+        self.assertGreater(Snapshot(self.path).journal_sequence, 0)
+        # Only the changes which are not contained in the snapshot remain in the journal
+        self.assertLess(len(read_changes(journal.path)), 8)
+        model.param_changed('BodyCO', 2000)
+        journal.compact()
+        self.assertEqual(read_changes(journal.path), [])
+        journal.close()
+        self.assertEqual(get_model_data(self.reopen()), get_model_data(model))
+
+    def test_failed_compaction_is_retried(self):
+        model = GlobalModel(_DatabaseController(_make_database()))
+        journal = start_journal(model, self.path, compact_after=3)
+        # The snapshot cannot be written into a directory which does not exist
+        journal.snapshot_path = os.path.join(self.directory.name, 'missing', 'model.cpsnap')
+        with DiagnosticsCollector() as collector:
+            for value in (1000, 2000, 3000):
+                model.param_changed('BodyCO', value)
+            journal.wait()
+        self.assertEqual(collector.get_kinds(), [COMPACTION_FAILED])
+        self.assertEqual(journal.pending, 3)
+        self.assertEqual(len(read_changes(journal.path)), 3)
+        journal.snapshot_path = self.path
+        model.param_changed('BodyCO', 4000)
+        journal.wait()
+        self.assertEqual(Snapshot(self.path).journal_sequence, 4)
+        self.assertEqual(read_changes(journal.path), [])
+        journal.close()
+        self.assertEqual(self.reopen().get_global_param_values(), {'BodyCO': 4000})
+
+    def test_partly_written_change_is_ignored(self):
+        model = GlobalModel(_DatabaseController(_make_database()))
+        journal = start_journal(model, self.path)
+        model.param_changed('BodyCO', 1000)
+        journal.close()
+        with open(journal.path, 'a') as file:
+            file.write('{"seq": 2, "op": "set_in')
+        reopened = self.reopen()
+        self.assertEqual(reopened.get_global_param_values(), {'BodyCO': 1000})
+        reopened.param_changed('BodyCO', 3000)
+        self.assertEqual([change['value'] for change in read_changes(journal.path)], [1000, 3000])
+        reopened.set_journal(None)
+
+    def test_invalid_changes_are_skipped(self):
+        model = GlobalModel(_DatabaseController(_make_database()))
+        journal = start_journal(model, self.path)
+        model.param_changed('BodyCO', 1000)
+        journal.record(REMOVE_ORGAN, name='Missing')
+        journal.close()
+        with open(journal.path, 'a') as file:
+            file.write('{"seq": 3, "op": "set_in\n')
+            file.write('{"seq": 4, "op": "set_input", "key": "Heart.Weight", "value": 1}\n')
+        with DiagnosticsCollector() as collector:
+            reopened = self.reopen()
+        self.assertEqual(collector.get_kinds(), [INVALID_CHANGE, INVALID_CHANGE])
+        self.assertEqual(reopened.get_global_param_values(), {'BodyCO': 1000})
+        self.assertEqual(reopened.get_organs()['Heart'].get_local_vals()['Weight'], 1)
+        reopened.set_journal(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
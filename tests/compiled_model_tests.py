@@ -0,0 +1,254 @@
+""" Test cases for the compiled model"""
+import time
+import unittest
+
+import numpy as np
+from PyQt5.QtCore import Qt
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from ceteris_paribus.control.background_evaluation import BackgroundEvaluator
+from ceteris_paribus.db.dependency_graph import DEPENDENCY, INVALID, UNDEFINED
+from ceteris_paribus.db.diagnostics import DiagnosticsCollector, EVALUATION_FAILED
+from ceteris_paribus.model.batch_evaluation import evaluate_batch
+from ceteris_paribus.model.code_generation import evaluate_generated, get_generated_model
+from ceteris_paribus.model.compiled_model import CompiledModel
+from ceteris_paribus.model.global_model import GlobalModel
+from ceteris_paribus.model.output_cache import OutputCache
+
+GLOBAL_PARAMS = {'BodyCO': [0, 10000, 5000]}
+GLOBAL_CONSTANTS = {'factor': 2}
+GLOBAL_FUNCTIONS = {'Total': "Heart.get_defined_variables()['Out'] + Brain.get_local_vals()['Weight']",
+                    'Half': "Total / 2"}
+ORGANS = {'Heart': {'variables': {'Weight': [0, 1, 0.5], 'Out': [0, 100, 1]},
+                    'functions': {'Out': "Flow * factor", 'Flow': "BodyCO * Weight"}},
+          'Brain': {'variables': {'Weight': [1, 2, 1.5]}, 'functions': {}}}
+
+
+class TestCompiledModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, ORGANS)
+
+    def test_single_pass_evaluation(self):
+        results = self.model.evaluate()
+        self.assertEqual(results['Heart.Flow'], 2500)
+        self.assertEqual(results['Heart.Out'], 5000)
+        self.assertEqual(results['Total'], 5001.5)
+        self.assertEqual(results['Half'], 2500.75)
+
+    def test_dependencies_through_accessors(self):
+        self.assertEqual(self.model.nodes['Total'].function_deps, {'Heart.Out'})
+        self.assertEqual(self.model.nodes['Total'].input_deps, {'Brain.Weight'})
+        self.assertEqual(self.model.get_ancestors(['Half']), ['Heart.Flow', 'Heart.Out', 'Total', 'Half'])
+
+    def test_accessors_bound_directly(self):
+        node = self.model.nodes['Total']
+        self.assertIs(node.code, node.compiled.direct_code)
+        # The organs are no longer passed to the expression, only the values it reads
+        self.assertEqual(sorted(node.bindings.values()), [('function', 'Heart.Out'), ('input', 'Brain.Weight')])
+
+    def test_unknown_accessor_key(self):
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, {'Bad': "Brain.get_local_vals()['Missing']",
+                                                                'Good': "Brain.get_local_vals()['Weight'] * 2"}, ORGANS)
+        self.assertIs(model.nodes['Bad'].code, model.nodes['Bad'].compiled.code)
+        errors = []
+        self.assertEqual(model.evaluate(errors=errors), {'Heart.Flow': 2500, 'Heart.Out': 5000, 'Good': 3})
+        self.assertEqual([error.name for error in errors], ['Bad'])
+
+    def test_inputs_override_defaults(self):
+        results = self.model.evaluate({'BodyCO': 1000, 'Brain.Weight': 2})
+        self.assertEqual(results['Total'], 1002)
+
+    def test_incremental_update(self):
+        self.model.update()
+        self.assertEqual(self.model.get_downstream('Brain.Weight'), {'Total', 'Half'})
+        self.model.set_input('Brain.Weight', 2)
+        self.assertEqual(self.model._dirty, {'Total', 'Half'})
+        self.assertEqual(self.model.update()['Half'], 2501)
+        self.assertEqual(self.model.update(), self.model.evaluate({'Brain.Weight': 2}))
+        # Without inputs, the model is evaluated with the values which were set
+        self.assertEqual(self.model.evaluate(), self.model.update())
+
+    def test_state_snapshot(self):
+        self.model.update()
+        snapshot = self.model.snapshot()
+        self.model.set_input('BodyCO', 1000)
+        self.assertEqual(self.model.update()['Total'], 1001.5)
+        self.model.restore(snapshot)
+        self.assertEqual(self.model.values['BodyCO'], 5000)
+        self.assertEqual(self.model.update()['Total'], 5001.5)
+
+    def test_state_views(self):
+        state = self.model.state
+        self.model.update()
+        # The values, the results and the organ views all share the array of the state
+        self.assertTrue(np.shares_memory(self.model.get_organ_inputs('Heart'), state.data))
+        self.model.set_input('Heart.Weight', 0.25)
+        self.assertEqual(list(self.model.get_organ_inputs('Heart')), [0.25, 1])
+        self.assertEqual(state.results[state.function_index['Total'] - state.input_count], 5001.5)
+        self.assertEqual(list(state.minimum), [0, 2, 0, 0, 1])
+
+    def test_batch_matches_single_evaluation(self):
+        body_co = np.array([0.0, 1000.0, 5000.0])
+        weight = np.array([1.0, 1.5, 2.0])
+        results = evaluate_batch(self.model, {'BodyCO': body_co, 'Brain.Weight': weight})
+        for index in range(3):
+            single = self.model.evaluate({'BodyCO': body_co[index], 'Brain.Weight': weight[index]})
+            for key, value in single.items():
+                self.assertAlmostEqual(results[key][index], value)
+
+    def test_batch_division_by_zero(self):
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, {'Ratio': "Total / Brain.get_local_vals()['Weight']",
+                                                                'Total': "1 + Brain.get_local_vals()['Weight']"}, ORGANS)
+        results = evaluate_batch(model, {'Brain.Weight': np.array([0.0, 2.0])})
+        self.assertEqual(list(results['Ratio']), [0.0, 1.5])
+
+    def test_batch_overflow_matches_single_evaluation(self):
+        organs = {'Organ': {'variables': {'w': [0, 1, 0.5]},
+                            'functions': {'Big': "w * 1e308 * 10", 'Inverse': "1 / w", 'Mixed': "Big - Big + 1 / w"}}}
+        model = CompiledModel({}, {}, {}, organs)
+        weights = np.array([0.0, 1e-10, 1.0])
+        results = evaluate_batch(model, {'Organ.w': weights})
+        for index, weight in enumerate(weights):
+            single = model.evaluate({'Organ.w': float(weight)})
+            for key, value in single.items():
+                np.testing.assert_equal(results[key][index], value)
+        self.assertEqual(list(results['Organ.Big']), [0.0, 1e299, np.inf])
+        self.assertEqual(list(results['Organ.Inverse']), [0.0, 1e10, 1.0])
+
+    def test_undefined_names(self):
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, {'Bad': "Missing + 1"}, ORGANS)
+        self.assertEqual([(error.name, error.reason, error.names) for error in model.errors],
+                         [('Bad', UNDEFINED, ('Missing',))])
+        self.assertNotIn('Bad', model.evaluate())
+
+
+class TestCodeGeneration(unittest.TestCase):
+
+    def test_generated_matches_update(self):
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, GLOBAL_FUNCTIONS, ORGANS)
+        generated = get_generated_model(model)
+        self.assertIs(get_generated_model(model), generated)
+        self.assertNotIn('get_local_vals', generated.source)
+        model.set_input('BodyCO', 1000)
+        self.assertEqual(dict(evaluate_generated(model)), model.evaluate({'BodyCO': 1000}))
+        self.assertEqual(model._dirty, set())
+
+    def test_failed_functions(self):
+        functions = {'Bad': "Brain.get_local_vals()['Weight'] * 'x' * 'y'", 'Worse': "Bad + 1", 'Good': "Total * 2",
+                     'Total': "Brain.get_local_vals()['Weight']"}
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, functions, ORGANS)
+        errors = []
+        results = evaluate_generated(model, errors=errors)
+        self.assertEqual(results['Good'], 3)
+        self.assertNotIn('Bad', results)
+        self.assertEqual([(error.name, error.reason) for error in errors], [('Bad', INVALID), ('Worse', DEPENDENCY)])
+
+    def test_opaque_organ_not_generated(self):
+        model = CompiledModel(GLOBAL_PARAMS, GLOBAL_CONSTANTS, {'Name': "Brain.get_name()"}, ORGANS)
+        self.assertIsNone(evaluate_generated(model))
+
+
+class _DatabaseController(object):
+
+    def __init__(self):
+        self.db = TinyDB(storage=MemoryStorage)
+        self.db.table("GlobalParameters").insert({'BodyCO': [0, 10000, 5000]})
+        self.db.table("GlobalConstants").insert({'factor': 2})
+        self.db.table("GlobalFunctions").insert({'Total': "Heart.get_defined_variables()['Out'] * 2"})
+        self.db.table("SystemicOrgans").insert({'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5]},
+                                                'functions': {'Out': "BodyCO * Weight * factor"}, 'pos': [0, 0]})
+
+    def get_db(self):
+        return self.db
+
+
+class TestOutputCache(unittest.TestCase):
+
+    def test_least_recently_used_evicted(self):
+        cache = OutputCache(max_size=2)
+        keys = [cache.make_key(np.array([value, 1.0])) for value in (1.0, 2.0, 3.0)]
+        cache.put(keys[0], {'a': 1})
+        cache.put(keys[1], {'a': 2})
+        self.assertEqual(cache.get(keys[0]), ({'a': 1}, ()))
+        cache.put(keys[2], {'a': 3})
+        self.assertNotIn(keys[1], cache)
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1, 'size': 2, 'max_size': 2})
+
+    def test_repeated_states_served_from_cache(self):
+        model = GlobalModel(_DatabaseController())
+        self.assertEqual(model.get_outputs(), {'Total': 10000})
+        model.param_changed('BodyCO', 1000)
+        self.assertEqual(model.get_outputs(), {'Total': 2000})
+        model.param_changed('BodyCO', 5000)
+        self.assertEqual(model.get_outputs(), {'Total': 10000})
+        model.set_input_value('Heart.Weight', 1)
+        self.assertEqual(model.get_outputs(), {'Total': 20000})
+        self.assertEqual(model.get_outputs(), {'Total': 20000})
+        self.assertEqual(model._output_cache.get_stats()['hits'], 2)
+        # A structural edit makes the cached outputs obsolete
+        model.add_global_func('Half', "Heart.get_defined_variables()['Out'] / 2")
+        self.assertEqual(len(model._output_cache), 0)
+        self.assertEqual(model.get_outputs(), {'Total': 20000, 'Half': 5000})
+
+
+class TestGlobalModel(unittest.TestCase):
+
+    def test_rename_organ(self):
+        model = GlobalModel(_DatabaseController())
+        model.rename_organ(model.get_organs()['Heart'], 'Pump')
+        self.assertEqual(list(model.get_organs()), ['Pump'])
+        model.set_input_value('Pump.Weight', 1)
+        self.assertEqual(model.get_input_values()['Pump.Weight'], 1)
+        # The global function still refers to the previous name
+        self.assertNotIn('Total', model.get_outputs())
+
+    def test_outputs_with_code_generation(self):
+        model = GlobalModel(_DatabaseController())
+        reference = GlobalModel(_DatabaseController())
+        model.set_code_generation(True)
+        self.assertIsNotNone(get_generated_model(model.get_compiled_model()))
+        self.assertEqual(model.get_outputs(), reference.get_outputs())
+        for key, value in (('BodyCO', 1000), ('Heart.Weight', 0.25)):
+            model.set_input_value(key, value)
+            reference.set_input_value(key, value)
+            self.assertEqual(model.get_outputs(), reference.get_outputs())
+        self.assertEqual(model.get_outputs(), {'Total': 1000})
+
+
+class TestBackgroundEvaluation(unittest.TestCase):
+
+    def test_only_newest_state_delivered(self):
+        model = GlobalModel(_DatabaseController())
+        evaluator = BackgroundEvaluator(lambda: model)
+        delivered = []
+        evaluator.outputs_ready.connect(lambda outputs, generation: delivered.append((outputs, generation)),
+                                        Qt.DirectConnection)
+        for value in range(1, 101):
+            generation = evaluator.set_input('BodyCO', value * 10)
+        evaluator.set_input('Heart.Weight', 1)
+        evaluator.stop(timeout=5)
+        self.assertTrue(evaluator.is_idle())
+        # The changes are coalesced, so there are fewer evaluations than changes, and the last one is the newest state
+        self.assertLess(len(delivered), 101)
+        self.assertEqual(delivered[-1], ({'Total': 4000}, generation + 1))
+        self.assertEqual(model.get_global_param_values()['BodyCO'], 1000)
+
+    def test_worker_survives_failed_evaluation(self):
+        model = GlobalModel(_DatabaseController())
+        evaluator = BackgroundEvaluator(lambda: model)
+        delivered = []
+        evaluator.outputs_ready.connect(lambda outputs, generation: delivered.append(outputs), Qt.DirectConnection)
+        get_outputs = model.get_outputs
+        model.get_outputs = lambda: 1 / 0
+        with DiagnosticsCollector() as collector:
+            evaluator.set_input('BodyCO', 1000)
+            while not evaluator.is_idle():
+                time.sleep(0.01)
+        self.assertEqual(collector.get_kinds(), [EVALUATION_FAILED])
+        model.get_outputs = get_outputs
+        evaluator.set_input('BodyCO', 2000)
+        evaluator.stop(timeout=5)
+        self.assertEqual(delivered, [{'Total': 4000}])
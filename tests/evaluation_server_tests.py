@@ -0,0 +1,49 @@
+""" Test cases for the local evaluation server"""
+import asyncio
+import unittest
+
+from ceteris_paribus.control.evaluation_server import EvaluationServer, request
+from ceteris_paribus.model.compiled_model import CompiledModel
+
+GLOBAL_FUNCTIONS = {'Total': "Heart.get_defined_variables()['Out'] * 2", 'Bad': "Missing + 1"}
+ORGANS = {'Heart': {'variables': {'Weight': [0, 1, 0.5]}, 'functions': {'Out': "BodyCO * Weight * factor"}}}
+
+
+class TestEvaluationServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EvaluationServer(CompiledModel({'BodyCO': [0, 10000, 5000]}, {'factor': 2}, GLOBAL_FUNCTIONS,
+                                                     ORGANS), batch_window=0.05)
+
+    def run_with_server(self, client):
+        async def scenario():
+            host, port = await self.server.start('127.0.0.1', 0)
+            try:
+                return await client(host, port)
+            finally:
+                await self.server.close()
+        return asyncio.run(scenario())
+
+    def test_concurrent_requests_batched(self):
+        async def client(host, port):
+            return await asyncio.gather(*[request(host, port, 'POST', '/evaluate',
+                                                  {'inputs': {'BodyCO': value}, 'outputs': ['Total']})
+                                          for value in (1000, 2000, 3000)])
+        responses = self.run_with_server(client)
+        self.assertEqual([(status, response['outputs']['Total']) for status, response in responses],
+                         [(200, 2000), (200, 4000), (200, 6000)])
+        self.assertEqual((self.server.batches, self.server.requests), (1, 3))
+
+    def test_errors_and_sweep(self):
+        async def client(host, port):
+            return [await request(host, port, 'POST', '/evaluate', {'inputs': {'Heart.Weight': 1}}),
+                    await request(host, port, 'POST', '/evaluate', {'inputs': {'Unknown': 1}}),
+                    await request(host, port, 'POST', '/sweep', {'input': 'BodyCO', 'points': 3,
+                                                                 'outputs': ['Total']}),
+                    await request(host, port, 'GET', '/missing')]
+        evaluated, unknown, sweep, missing = self.run_with_server(client)
+        self.assertEqual(evaluated, (200, {'outputs': {'Total': 20000, 'Bad': None},
+                                           'errors': [{'name': 'Bad', 'reason': 'undefined', 'names': ['Missing']}]}))
+        self.assertEqual(unknown, (400, {'error': "Unknown input: Unknown"}))
+        self.assertEqual(sweep[1]['responses'], {'Total': [0, 10000, 20000]})
+        self.assertEqual(missing[0], 404)
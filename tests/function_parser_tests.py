@@ -0,0 +1,162 @@
+""" Test cases for the expression evaluator"""
+import marshal
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from ceteris_paribus.db.dependency_graph import CYCLE, DEPENDENCY, UNDEFINED
+from ceteris_paribus.db.diagnostics import DiagnosticsCollector, DiagnosticsReporter, Diagnostic, \
+    DIVISION_BY_ZERO, UNRESOLVED, DUPLICATE_NAME, WARNING
+from ceteris_paribus.db.expression_store import ExpressionStore, ExpressionStoreError, SIGNATURE_SIZE
+from ceteris_paribus.db.function_parser import ExpressionCache, EvalWrapper, ModelTransformer, evaluate_functions
+
+
+class TestExpressionCache(unittest.TestCase):
+
+    def test_compiled_once(self):
+        cache = ExpressionCache()
+        first = cache.get("a * b")
+        second = cache.get("a * b")
+        self.assertIs(first, second)
+        self.assertEqual(cache.get_stats()['misses'], 1)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+    def test_lru_eviction(self):
+        cache = ExpressionCache(max_size=2)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        cache.get("c")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_invalid_expression_not_cached(self):
+        cache = ExpressionCache()
+        with self.assertRaises(SyntaxError):
+            cache.get("a if b else c")
+        self.assertEqual(len(cache), 0)
+
+    def test_accessed_subscripts(self):
+        compiled = ExpressionCache().get("Heart.get_local_vals()['VO2'] + x")
+        self.assertEqual(compiled.accessed, {'Heart': 'VO2', 'x': ''})
+
+
+class TestExpressionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.directory.name, 'store')
+        # The key is kept outside the store, in place of the configuration directory of the user
+        self.key_path = os.path.join(self.directory.name, 'config', 'expression_store.key')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_store(self):
+        return ExpressionStore(self.store_path, self.key_path)
+
+    def test_loaded_by_later_cache(self):
+        expression = "Heart.get_local_vals()['VO2'] * x / 2"
+        original = ExpressionCache(store=self.make_store()).get(expression)
+        # A new cache, as in a new process, loads the expression instead of compiling it
+        cache = ExpressionCache(store=self.make_store())
+        loaded = cache.get(expression)
+        self.assertEqual(cache.get_stats()['store_hits'], 1)
+        for field in ('accessed', 'accessors', 'opaque_names', 'array_safe', 'accessor_names'):
+            self.assertEqual(getattr(loaded, field), getattr(original, field))
+        variables = {'Heart': None, 'x': 3, '__accessor0': 4}
+        self.assertEqual(eval(loaded.direct_code, variables), 6)
+        # A damaged entry is compiled again
+        with open(self.make_store().get_path(expression), 'wb') as file:
+            file.write(b'\0')
+        cache = ExpressionCache(store=self.make_store())
+        self.assertEqual(cache.get(expression).accessed, original.accessed)
+        self.assertEqual(cache.get_stats()['store_hits'], 0)
+        self.assertEqual(len(os.listdir(self.store_path)), 1)
+
+    def test_unsigned_entry_rejected(self):
+        expression = "x + 1"
+        store = self.make_store()
+        ExpressionCache(store=store).get(expression)
+        with open(store.get_path(expression), 'rb') as file:
+            content = file.read()
+        # An entry written without the key, here with the code of another expression, is not loaded
+        entry = marshal.loads(content[SIGNATURE_SIZE:])
+        code = compile("x - 1", '<AST>', 'eval')
+        with open(store.get_path(expression), 'wb') as file:
+            file.write(content[:SIGNATURE_SIZE] + marshal.dumps(entry[:2] + (code,) + entry[3:]))
+        self.assertIsNone(self.make_store().load(expression))
+        # A store with another key does not load the entries either
+        ExpressionCache(store=store).get("x * 2")
+        other = ExpressionStore(self.store_path, os.path.join(self.directory.name, 'other.key'))
+        self.assertIsNone(other.load("x * 2"))
+        self.assertIsNotNone(self.make_store().load("x * 2"))
+
+    @unittest.skipIf(not hasattr(os, 'getuid'), "file permissions are not checked on this platform")
+    def test_private_directory(self):
+        self.make_store()
+        self.assertEqual(os.stat(self.store_path).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(self.key_path).st_mode & 0o777, 0o600)
+        os.chmod(self.store_path, 0o777)
+        self.assertRaises(ExpressionStoreError, self.make_store)
+        os.chmod(self.store_path, 0o700)
+        # The key must not be kept in the store itself
+        self.assertRaises(ExpressionStoreError, ExpressionStore, self.store_path,
+                          os.path.join(self.store_path, 'expression_store.key'))
+
+
+class TestEvaluation(unittest.TestCase):
+
+    def test_evaluate_with_model_transformer(self):
+        variables = {'a': 2, 'b': 3}
+        evaluator = EvalWrapper(variables, ModelTransformer(variables))
+        evaluator.set_function("a * b + 1")
+        self.assertEqual(evaluator.evaluate(), 7)
+        evaluator.set_function("a * c")
+        self.assertIsNone(evaluator.evaluate())
+
+    def test_evaluate_functions_resolves_dependencies(self):
+        functions = {'c': "b * 2", 'b': "a + 1"}
+        variables = {'a': 1}
+        self.assertEqual(evaluate_functions(functions, variables), {'b': 2, 'c': 4})
+
+    def test_evaluate_functions_reports_unresolved(self):
+        functions = {'a': "b + 1", 'b': "a + 1", 'c': "a * 2", 'd': "x * 2", 'e': "1"}
+        errors = []
+        output = evaluate_functions(functions, {}, errors=errors)
+        self.assertEqual(output, {'e': 1})
+        reasons = {error.name: error.reason for error in errors}
+        self.assertEqual(reasons, {'a': CYCLE, 'b': CYCLE, 'c': DEPENDENCY, 'd': UNDEFINED})
+
+
+class TestDiagnostics(unittest.TestCase):
+
+    def test_diagnostics_collected(self):
+        evaluator = EvalWrapper({'a': 1}, ModelTransformer({'a': 1}))
+        evaluator.set_function_name('Ratio')
+        evaluator.set_function("a / 0")
+        with DiagnosticsCollector() as collector:
+            self.assertEqual(evaluator.evaluate(), 0)
+            evaluate_functions({'b': "c + 1"}, {})
+        self.assertEqual(collector.get_kinds(), [DIVISION_BY_ZERO, UNRESOLVED])
+        self.assertEqual(collector.diagnostics[0].name, 'Ratio')
+        self.assertEqual([error.name for error in collector.diagnostics[1].errors], ['b'])
+        # Once the with statement is left, nothing is collected anymore
+        evaluator.evaluate()
+        self.assertEqual(len(collector.diagnostics), 2)
+
+    def test_confirm_without_handler_uses_default(self):
+        reporter = DiagnosticsReporter()
+        question = Diagnostic(DUPLICATE_NAME, WARNING, "Overwrite?", 'a')
+        self.assertFalse(reporter.confirm(question))
+        reporter.set_confirm_handler(lambda diagnostic: diagnostic.name == 'a')
+        self.assertTrue(reporter.confirm(question))
+
+    def test_model_imports_without_qt(self):
+        # PyQt5 is made unimportable, so the import fails if the model or the evaluators still depend on it
+        code = "import sys; sys.modules['PyQt5'] = None; import ceteris_paribus.model.global_model"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
@@ -0,0 +1,61 @@
+""" Test cases for the single-pass model loader"""
+import json
+import os
+import tempfile
+import unittest
+
+from tinydb import TinyDB
+
+from ceteris_paribus.db.diagnostics import INVALID_NAME, INVALID_FUNCTION
+from ceteris_paribus.db.model_loader import load_model_description, ModelLoadError
+from ceteris_paribus.model.compiled_model import compile_database
+
+TABLES = {'GlobalParameters': {'1': {'BodyCO': [0, 10000, 5000]}, '2': {'bad name': [0, 1, 0]}},
+          'GlobalConstants': {'1': {'factor': 2}},
+          'GlobalFunctions': {'1': {'Total': "Heart.get_defined_variables()['Out'] * 2", 'Broken': "1 +"}},
+          'SystemicOrgans': {'1': {'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5]},
+                                   'functions': {'Out': "BodyCO * Weight * factor"}}}}
+
+
+class TestModelLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'model.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, tables):
+        with open(self.path, 'w') as file:
+            json.dump(tables, file)
+
+    def test_description_matches_database(self):
+        self.write(TABLES)
+        description = load_model_description(self.path, report=False)
+        self.assertEqual(description.table('GlobalParameters').all(), [{'BodyCO': [0, 10000, 5000]}])
+        self.assertEqual([warning.kind for warning in description.warnings], [INVALID_NAME, INVALID_FUNCTION])
+        self.assertEqual(description.warnings[1].name, 'Broken')
+        self.assertEqual(compile_database(description).evaluate(), compile_database(TinyDB(self.path)).evaluate())
+
+    def test_all_problems_reported(self):
+        tables = json.loads(json.dumps(TABLES))
+        tables['GlobalParameters']['3'] = {'BodyVO2': [0, 400]}
+        tables['GlobalConstants']['2'] = {'text': "abc"}
+        tables['SystemicOrgans']['2'] = {'name': 'Heart', 'variables': {}, 'functions': {}}
+        tables['SystemicOrgans']['3'] = {'name': 'Brain', 'variables': {'Weight': [2, 1, 1.5]}, 'functions': {}}
+        self.write(tables)
+        with self.assertRaises(ModelLoadError) as context:
+            load_model_description(self.path, report=False)
+        self.assertEqual(context.exception.problems,
+                         ["The global parameter BodyVO2 does not define a [min, max, value] range",
+                          "The global constant text is not a number",
+                          "The organ Heart is defined more than once",
+                          "The variable Weight of Brain has a minimum larger than its maximum"])
+
+    def test_missing_tables_and_files(self):
+        self.write({'GlobalParameters': {}})
+        with self.assertRaises(ModelLoadError):
+            load_model_description(self.path, report=False)
+        with self.assertRaises(ModelLoadError):
+            load_model_description(os.path.join(self.directory.name, 'missing.json'), report=False)
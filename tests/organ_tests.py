@@ -0,0 +1,46 @@
+""" Test cases for the organs of the model"""
+import tracemalloc
+import unittest
+
+from ceteris_paribus.model.organ import Organ
+
+
+def make_organ_info(name):
+    return {'name': name, 'variables': {'Weight': [0, 1, 0.5], 'Out': [0, 100, 1]},
+            'functions': {'Out': "Flow * factor", 'Flow': "BodyCO * Weight"}}
+
+
+class TestOrgan(unittest.TestCase):
+
+    def test_defined_variables(self):
+        params = {'BodyCO': 5000}
+        organ = Organ(make_organ_info('Heart'), params, {'factor': 2}, [0, 0])
+        # The functions take precedence over the local values with the same name
+        self.assertEqual(organ.get_defined_variables(), {'Weight': 0.5, 'Out': 5000, 'BodyCO': 5000, 'factor': 2,
+                                                         'Flow': 2500})
+        # The parameters are shared with the model, so a change is seen without updating the organ
+        params['BodyCO'] = 1000
+        self.assertEqual(organ.get_defined_variables()['Out'], 1000)
+        organ.local_changed('Weight', 1)
+        self.assertEqual(organ.get_local_vals(), {'Weight': 1, 'Out': 1})
+        self.assertEqual(organ.get_defined_variables()['Flow'], 1000)
+
+    def test_fixed_attributes(self):
+        organ = Organ(make_organ_info('Heart'), {'BodyCO': 5000}, {'factor': 2}, [0, 0])
+        self.assertFalse(hasattr(organ, '__dict__'))
+        with self.assertRaises(AttributeError):
+            organ.color = 'red'
+
+    def test_globals_shared_by_reference(self):
+        # The memory used by an organ must not grow with the number of global parameters and constants
+        params = {'P' + str(index): float(index) for index in range(1000)}
+        params['BodyCO'] = 5000
+        constants = {'C' + str(index): float(index) for index in range(1000)}
+        constants['factor'] = 2
+        infos = [make_organ_info('Organ' + str(index)) for index in range(100)]
+        tracemalloc.start()
+        organs = [Organ(info, params, constants, [0, 0]) for info in infos]
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.assertEqual(len(organs), 100)
+        self.assertLess(used / len(organs), 2000)
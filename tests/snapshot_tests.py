@@ -0,0 +1,78 @@
+""" Test cases for the binary snapshot format"""
+import json
+import os
+import tempfile
+import unittest
+
+from tinydb import TinyDB
+
+from ceteris_paribus.db.model_loader import load_model_description
+from ceteris_paribus.db.snapshot import Snapshot, SnapshotError, export_json, import_json
+from ceteris_paribus.model.compiled_model import compile_database
+from ceteris_paribus.model.global_model import GlobalModel
+
+
+class _DatabaseController(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_db(self):
+        return self.db
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.directory.name, 'model.json')
+        self.snapshot_path = os.path.join(self.directory.name, 'model.cpsnap')
+        db = TinyDB(self.json_path)
+        db.table("GlobalParameters").insert({'BodyCO': [0, 10000, 5000]})
+        db.table("GlobalParameters").insert({'BodyVO2': [0.5, 400, 250.25]})
+        db.table("GlobalConstants").insert({'factor': 2})
+        db.table("GlobalFunctions").insert({'Total': "Heart.get_defined_variables()['Out'] * 2"})
+        db.table("SystemicOrgans").insert({'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5]},
+                                           'functions': {'Out': "BodyCO * Weight * factor"}})
+        db.table("SystemicOrgans").insert({'name': 'Brain', 'variables': {}, 'functions': {}})
+        db.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip_to_dumped_json(self):
+        # The layout written by dump_model, with all global values of a table in a single document
+        dumped = os.path.join(self.directory.name, 'dumped.json')
+        db = TinyDB(dumped)
+        db.table("GlobalConstants").insert({'factor': 2, 'ratio': 0.1})
+        db.table("GlobalFunctions").insert({'Total': "Heart.get_defined_variables()['Out'] * 2", 'Text': "'é'"})
+        db.table("GlobalParameters").insert({'BodyCO': [0, 10000, 5000], 'BodyVO2': [0.5, 400, 250.25]})
+        db.table("SystemicOrgans").insert({'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5]},
+                                           'functions': {'Out': "BodyCO * Weight * factor"}})
+        db.table("SystemicOrgans").insert({'name': 'Brain', 'variables': {}, 'functions': {}})
+        db.close()
+        exported = os.path.join(self.directory.name, 'exported.json')
+        import_json(dumped, self.snapshot_path)
+        export_json(self.snapshot_path, exported)
+        with open(dumped) as expected, open(exported) as actual:
+            self.assertEqual(json.load(actual), json.load(expected))
+
+    def test_open_snapshot(self):
+        import_json(self.json_path, self.snapshot_path)
+        snapshot = load_model_description(self.snapshot_path)
+        self.assertIsInstance(snapshot, Snapshot)
+        self.assertEqual(snapshot.get_dependency_order(), ['Heart.Out', 'Total'])
+        self.assertEqual(compile_database(snapshot).evaluate(), compile_database(TinyDB(self.json_path)).evaluate())
+        # The organs are only evaluated once their values are requested
+        model = GlobalModel(_DatabaseController(snapshot))
+        self.assertEqual(model.get_organs()['Heart'].results, {})
+        self.assertEqual(model.get_organs()['Heart'].get_defined_variables()['Out'], 5000)
+        self.assertEqual(model.get_outputs(), {'Total': 10000})
+
+    def test_invalid_file(self):
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.json_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
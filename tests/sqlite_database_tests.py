@@ -0,0 +1,93 @@
+""" Test cases for the SQLite storage backend"""
+import json
+import os
+import tempfile
+import unittest
+
+from tinydb import TinyDB
+
+from ceteris_paribus.db.model_loader import load_model_description
+from ceteris_paribus.db.sqlite_database import SQLiteDatabase, export_json, import_json, open_database
+from ceteris_paribus.model.compiled_model import compile_database
+from ceteris_paribus.model.global_model import GlobalModel
+
+
+class _DatabaseController(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_db(self):
+        return self.db
+
+
+class TestSQLiteDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.directory.name, 'model.json')
+        self.sqlite_path = os.path.join(self.directory.name, 'model.sqlite')
+        db = TinyDB(self.json_path)
+        db.table("GlobalParameters").insert({'BodyCO': [0, 10000, 5000]})
+        db.table("GlobalParameters").insert({'BodyVO2': [0, 400, 250]})
+        db.table("GlobalConstants").insert({'factor': 2})
+        db.table("GlobalFunctions").insert({'Total': "Heart.get_defined_variables()['Out'] * 2"})
+        db.table("SystemicOrgans").insert({'name': 'Heart', 'variables': {'Weight': [0, 1, 0.5]},
+                                           'functions': {'Out': "BodyCO * Weight * factor"}})
+        db.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import_matches_json(self):
+        import_json(self.json_path, self.sqlite_path)
+        db = open_database(self.sqlite_path, read_only=True)
+        self.assertIsInstance(db, SQLiteDatabase)
+        self.assertEqual(db.table("GlobalParameters").all(), [{'BodyCO': [0, 10000, 5000]}, {'BodyVO2': [0, 400, 250]}])
+        self.assertEqual(compile_database(db).evaluate(), compile_database(TinyDB(self.json_path)).evaluate())
+        db.close()
+
+    def test_save_writes_changed_rows_only(self):
+        import_json(self.json_path, self.sqlite_path)
+        db = SQLiteDatabase(self.sqlite_path)
+        model = GlobalModel(_DatabaseController(db))
+        # The organ positions are assigned by the model, so the first save writes the organ row
+        self.assertEqual(db.save_model(model), 1)
+        statements = []
+        db.connection.set_trace_callback(statements.append)
+        model.param_changed('BodyCO', 1000)
+        self.assertEqual(db.save_model(model), 1)
+        self.assertEqual(db.save_model(model), 0)
+        model.set_input_value('Heart.Weight', 1)
+        model.move_organ(model.get_organs()['Heart'], [10, 20])
+        self.assertEqual(db.save_model(model), 2)
+        # Saving the edited values neither reads the tables nor writes the other rows
+        self.assertEqual([statement for statement in statements if statement.startswith('SELECT')], [])
+        db.connection.set_trace_callback(None)
+        model.remove(model.get_organs()['Heart'])
+        # Deleting the organ row deletes its variables and functions as well
+        self.assertEqual(db.save_model(model), 1)
+        db.close()
+        reopened = SQLiteDatabase(self.sqlite_path)
+        self.assertEqual(reopened.table("GlobalParameters").all()[0], {'BodyCO': [0, 10000, 1000]})
+        self.assertEqual(reopened.table("SystemicOrgans").all(), [])
+        reopened.close()
+
+    def test_tinydb_file_with_sqlite_suffix(self):
+        # A TinyDB file is recognised by its content, whatever its suffix
+        tinydb_path = os.path.join(self.directory.name, 'model.db')
+        os.rename(self.json_path, tinydb_path)
+        db = open_database(tinydb_path, read_only=True)
+        self.assertIsInstance(db, TinyDB)
+        db.close()
+        self.assertEqual(load_model_description(tinydb_path).table("GlobalConstants").all(), [{'factor': 2}])
+
+    def test_export_round_trip(self):
+        import_json(self.json_path, self.sqlite_path)
+        exported = os.path.join(self.directory.name, 'exported.json')
+        export_json(self.sqlite_path, exported)
+        with open(exported) as file:
+            tables = json.load(file)
+        self.assertEqual(tables['GlobalParameters'], {'1': {'BodyCO': [0, 10000, 5000], 'BodyVO2': [0, 400, 250]}})
+        self.assertEqual(compile_database(TinyDB(exported)).evaluate(),
+                         compile_database(TinyDB(self.json_path)).evaluate())
@@ -0,0 +1,83 @@
+""" Benchmarks of the time needed to import the entry points of the program"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# The largest time the modules of the program itself may take to import, as a fraction of the time numpy takes to
+# import in the same run, so that the budget does not depend on the speed of the machine. The third party modules an
+# entry point needs are imported before the time is measured, so only the modules of the program and what they load in
+# addition are counted. Loading a module such as pyqtgraph at startup exceeds the budget. The fraction can be set with
+# the CETERIS_PARIBUS_IMPORT_BUDGET environment variable.
+IMPORT_BUDGET = float(os.environ.get('CETERIS_PARIBUS_IMPORT_BUDGET', 0.5))
+
+# For every entry point: the third party modules imported before measuring, and the modules which must only be loaded
+# once they are used
+ENTRY_POINTS = {
+    'ceteris_paribus.model.global_model': (('numpy',), ('PyQt5', 'pyqtgraph', 'asyncio', 'ceteris_paribus.gui')),
+    'ceteris_paribus.control.batch_run': (('numpy',), ('PyQt5', 'pyqtgraph', 'asyncio',
+                                                       'ceteris_paribus.db.expression_store')),
+    'ceteris_paribus.control.evaluation_server': (('numpy', 'asyncio'), ('PyQt5', 'pyqtgraph',
+                                                                         'ceteris_paribus.db.expression_store')),
+    'ceteris_paribus.control.controller': (('numpy', 'PyQt5.QtWidgets'), (
+        'pyqtgraph', 'ceteris_paribus.gui.dialogs.profile_dialog', 'ceteris_paribus.gui.dialogs.goal_seek_dialog',
+        'ceteris_paribus.gui.dialogs.global_function_dialog', 'ceteris_paribus.gui.dialogs.new_node_dialog')),
+}
+
+MEASURE = """
+import importlib, json, sys, time
+for name in {baseline!r}:
+    importlib.import_module(name)
+start = time.perf_counter()
+importlib.import_module({module!r})
+print(json.dumps({{'time': time.perf_counter() - start, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module, baseline, repeat=3):
+    """ Imports a module in new interpreters and returns the shortest import time and the modules which were loaded."""
+    # The bytecode is written by the first run, so that the other runs do not measure the compilation of the sources
+    environment = dict(os.environ)
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = MEASURE.format(baseline=baseline, module=module)
+    results = []
+    for _ in range(repeat + 1):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=environment)
+        if result.returncode != 0:
+            raise AssertionError(result.stderr)
+        results.append(json.loads(result.stdout.splitlines()[-1]))
+    return min(result['time'] for result in results[1:]), set(results[-1]['modules'])
+
+
+class TestStartup(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.budget = IMPORT_BUDGET * measure_import('numpy', ())[0]
+
+    def check_entry_point(self, module):
+        baseline, deferred = ENTRY_POINTS[module]
+        duration, modules = measure_import(module, baseline)
+        loaded = [name for name in deferred if name in modules]
+        self.assertEqual(loaded, [], "imported before they are used: " + ", ".join(loaded))
+        self.assertLess(duration, self.budget, module + " takes " + str(round(duration * 1000)) + " ms to import, the "
+                        "budget is " + str(round(self.budget * 1000)) + " ms")
+
+    def test_model(self):
+        self.check_entry_point('ceteris_paribus.model.global_model')
+
+    def test_batch_run(self):
+        self.check_entry_point('ceteris_paribus.control.batch_run')
+
+    def test_evaluation_server(self):
+        self.check_entry_point('ceteris_paribus.control.evaluation_server')
+
+    @unittest.skipIf(importlib.util.find_spec('PyQt5') is None, "PyQt5 is not installed")
+    def test_gui(self):
+        self.check_entry_point('ceteris_paribus.control.controller')
+
+
+if __name__ == '__main__':
+    unittest.main()